@@ -8,6 +8,168 @@ function g(name) { return global[name]; }
 function isEn() { return window.i18n && window.i18n.getLanguage() === 'en'; }
 function t(key) { return window.i18n ? window.i18n.t(key) : key; }
 
+// 打印服务器会话令牌：首次通过 auth 消息换取，之后的请求只携带令牌，不再发送密码
+var printSession = { token: null, username: null, expiresAt: 0, protocol: 1 };
+
+// 打印协议版本，3 及以上支持信封帧：服务器只解析头部，文档内容原样转发给打印客户端；4 及以上支持分块传输
+var PRINT_PROTOCOL_VERSION = 4;
+
+// UTF-8 编码后超过该字节数的文档分块传输，打印客户端通过 print_credit 控制发送速度
+// 按字节计算：中文内容按字符数计算会超出服务器的单条消息上限
+var PRINT_STREAM_THRESHOLD = 512 * 1024;
+var PRINT_CHUNK_SIZE = 256 * 1024;
+// 进行中的分块传输: job_id -> { ws, message, seq, offset, ended }
+var printStreams = {};
+
+/**
+ * 计算字符串 UTF-8 编码后的字节数
+ * @param {string} text 文本
+ * @returns {number} 字节数
+ */
+function utf8ByteLength(text) {
+    if (typeof TextEncoder !== 'undefined') {
+        return new TextEncoder().encode(text).length;
+    }
+    var bytes = 0;
+    for (var i = 0; i < text.length; i++) {
+        var code = text.charCodeAt(i);
+        if (code < 0x80) {
+            bytes += 1;
+        } else if (code < 0x800) {
+            bytes += 2;
+        } else if (code >= 0xD800 && code <= 0xDBFF && i + 1 < text.length) {
+            // 代理对编码为 4 个字节
+            bytes += 4;
+            i += 1;
+        } else {
+            bytes += 3;
+        }
+    }
+    return bytes;
+}
+
+/**
+ * 发送信封帧：第一行为头部，消息体原样转发给打印客户端
+ */
+function sendEnvelope(ws, header, body) {
+    ws.send(JSON.stringify(Object.assign({}, header, { envelope: 1 })) + '\n' + JSON.stringify(body));
+}
+
+/**
+ * 按打印客户端给出的额度发送分块，全部发送后发送 print_end
+ * @param {Object} stream 分块传输状态
+ * @param {number} credits 可发送的块数
+ */
+function pumpPrintStream(stream, credits) {
+    var content = stream.message.content;
+    while (credits > 0 && stream.offset < content.length) {
+        var end = Math.min(stream.offset + PRINT_CHUNK_SIZE, content.length);
+        var code = content.charCodeAt(end - 1);
+        if (end < content.length && code >= 0xD800 && code <= 0xDBFF) {
+            // 不在代理对中间切开
+            end -= 1;
+        }
+        sendEnvelope(stream.ws, { type: 'print_chunk', job_id: stream.message.job_id, seq: stream.seq },
+            { data: content.slice(stream.offset, end) });
+        stream.offset = end;
+        stream.seq += 1;
+        credits -= 1;
+    }
+    if (stream.offset >= content.length && !stream.ended) {
+        stream.ended = true;
+        stream.ws.send(JSON.stringify({ type: 'print_end', job_id: stream.message.job_id, chunks: stream.seq }));
+    }
+}
+
+/**
+ * 向打印服务器发送请求，自动附带会话令牌
+ * 没有有效令牌时先在同一连接上发送 auth 消息，服务器按顺序处理，认证后的请求无需携带密码
+ * @param {WebSocket} ws 打印服务器连接
+ * @param {Object} message 请求内容
+ */
+function sendPrintMessage(ws, message) {
+    var user = g('currentUser');
+    delete message.token;
+    if (printSession.token && printSession.username === user.username && Date.now() < printSession.expiresAt - 30000) {
+        message.token = printSession.token;
+        // 令牌被服务器拒绝（如服务器重启后密钥变化）时用密码重新认证并重发一次
+        if (!ws.printAuthRetry) {
+            ws.printAuthRetry = { message: message, retried: false };
+        } else if (!ws.printAuthRetry.retried) {
+            ws.printAuthRetry.message = message;
+        }
+    } else {
+        ws.send(JSON.stringify({
+            type: 'auth',
+            username: user.username,
+            password: user.password,
+            protocol_version: PRINT_PROTOCOL_VERSION
+        }));
+    }
+    if (message.type === 'print_request' && typeof message.content === 'string' && printSession.protocol >= 3) {
+        var header = Object.assign({}, message);
+        delete header.content;
+        var size = printSession.protocol >= 4 && message.job_id ? utf8ByteLength(message.content) : 0;
+        if (size > PRINT_STREAM_THRESHOLD) {
+            // 大文档分块传输，收到打印客户端的额度后开始发送分块
+            printStreams[message.job_id] = { ws: ws, message: message, seq: 0, offset: 0, ended: false };
+            header.type = 'print_begin';
+            header.size = size;
+            ws.send(JSON.stringify(header));
+            return;
+        }
+        // 信封帧：第一行为头部，文档内容放在消息体中
+        sendEnvelope(ws, header, { content: message.content });
+        return;
+    }
+    ws.send(JSON.stringify(message));
+}
+
+/**
+ * 处理打印服务器的认证响应及分块传输的控制消息
+ * @param {Object} response 服务器消息
+ * @param {WebSocket} ws 收到消息的连接，令牌失效时在该连接上重新认证并重发请求
+ * @returns {boolean} 是否为已处理的认证成功、令牌失效重发或分块传输控制消息
+ */
+function handlePrintAuthResponse(response, ws) {
+    var stream = response.job_id ? printStreams[response.job_id] : null;
+    if (stream) {
+        if (response.type === 'print_credit') {
+            pumpPrintStream(stream, response.credits || 0);
+            return true;
+        }
+        if (response.type === 'error' && response.code === 'stream_unavailable') {
+            // 没有支持分块传输的打印客户端，改为一次发送整个文档
+            delete printStreams[response.job_id];
+            var header = Object.assign({}, stream.message);
+            delete header.content;
+            sendEnvelope(stream.ws, header, { content: stream.message.content });
+            return true;
+        }
+        if (response.type === 'print_queued' || response.type === 'error') {
+            delete printStreams[response.job_id];
+        }
+    }
+    if (response.type === 'auth_success' && response.token) {
+        printSession.token = response.token;
+        printSession.username = response.username;
+        printSession.expiresAt = Date.now() + (response.expires_in || 0) * 1000;
+        printSession.protocol = response.protocol_version || 1;
+        return true;
+    }
+    if (response.type === 'auth_error' || response.code === 'auth_required') {
+        // 令牌失效，下次请求重新认证
+        printSession.token = null;
+    }
+    if (response.code === 'auth_required' && ws && ws.printAuthRetry && !ws.printAuthRetry.retried) {
+        // 用令牌发送的请求被拒绝：用密码重新认证后重发一次，再次失败时交给调用方报告错误
+        ws.printAuthRetry.retried = true;
+        sendPrintMessage(ws, ws.printAuthRetry.message);
+        return true;
+    }
+    return false;
+}
+
 /**
  * 在 Capacitor 中处理文件下载/分享
  * @param {string} data 数据内容（可以是 URL 也可以是纯文本/HTML）
@@ -570,17 +732,16 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
 
             ws.onopen = function() {
                 clearTimeout(wsTimeout);
-                // 发送状态检查请求，使用用户的账号信息
-                ws.send(JSON.stringify({
-                    type: 'check_client_status',
-                    username: g('currentUser').username,
-                    password: g('currentUser').password
-                }));
+                // 发送状态检查请求，使用会话令牌或用户的账号信息
+                sendPrintMessage(ws, {
+                    type: 'check_client_status'
+                });
             };
 
             ws.onmessage = function(event) {
                 try {
                     var response = JSON.parse(event.data);
+                    if (handlePrintAuthResponse(response, ws)) return;
                     if (response.type === 'client_status') {
                         updateClientStatus(response.connected);
                     }
@@ -723,27 +884,23 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
                 ws.onopen = function() {
                     clearTimeout(timeout);
                     // 发送状态检查请求
-                    ws.send(JSON.stringify({
-                        type: 'check_client_status',
-                        username: g('currentUser').username,
-                        password: g('currentUser').password
-                    }));
+                    sendPrintMessage(ws, {
+                        type: 'check_client_status'
+                    });
                 };
 
                 ws.onmessage = function(event) {
+                    var response = null;
                     try {
-                        var response = JSON.parse(event.data);
-                        if (response.type === 'client_status') {
-                            resolve(response.connected);
-                        } else {
-                            resolve(false);
-                        }
+                        response = JSON.parse(event.data);
                     } catch (e) {
-                        resolve(false);
-                    } finally {
-                        clearTimeout(timeout);
-                        if (ws) ws.close();
+                        response = null;
                     }
+                    // 认证成功的消息之后才是状态结果
+                    if (response && handlePrintAuthResponse(response, ws)) return;
+                    resolve(!!(response && response.type === 'client_status' && response.connected));
+                    clearTimeout(timeout);
+                    if (ws) ws.close();
                 };
 
                 ws.onerror = function() {
@@ -866,9 +1023,6 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
 
         // 发送文件到打印服务器
         async function sendFileToPrint(fileUrl, fileName) {
-            var username = g('currentUser').username;
-            var userPassword = g('currentUser').password;
-
             // 使用统一的状态模态框
             var statusUI = createPrintStatusModal(isEn() ? 'File Print: ' + fileName : '文件打印: ' + fileName);
 
@@ -921,8 +1075,6 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
 
                     var printData = {
                         type: 'print_request',
-                        username: username,
-                        password: userPassword,
                         content: fullFileUrl,
                         content_type: 'file',
                         file_name: fileName,
@@ -933,13 +1085,14 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
                         timestamp: new Date().toISOString()
                     };
 
-                    ws.send(JSON.stringify(printData));
+                    sendPrintMessage(ws, printData);
                 };
 
                 ws.onmessage = function(event) {
                     if (isCancelled) return;
                     try {
                         var response = JSON.parse(event.data);
+                        if (handlePrintAuthResponse(response, ws)) return;
                         if (response.type === 'print_status') {
                             statusUI.updateStatus(isEn() ? 'Printing...' : '正在打印...', response.message, false);
                         } else if (response.type === 'print_queued') {
@@ -1674,8 +1827,6 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
         }
 
         var content = g('vditor') ? g('vditor').getValue() : '';
-        var username = g('currentUser').username;
-        var userPassword = g('currentUser').password;
 
         // 使用统一的状态模态框
         var statusUI = createPrintStatusModal(isEn() ? 'Cloud Print' : '云打印');
@@ -1738,8 +1889,6 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
 
                 var printData = {
                     type: 'print_request',
-                    username: username,
-                    password: userPassword,
                     content: fullFileUrl,
                     content_type: 'file',
                     file_name: 'print_job.pdf',
@@ -1750,13 +1899,14 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
                     timestamp: new Date().toISOString()
                 };
 
-                ws.send(JSON.stringify(printData));
+                sendPrintMessage(ws, printData);
             };
 
             ws.onmessage = function(event) {
                 if (isCancelled) return;
                 try {
                     var response = JSON.parse(event.data);
+                    if (handlePrintAuthResponse(response, ws)) return;
                     if (response.type === 'client_status') {
                         if (response.connected) {
                             statusUI.updateStatus(isEn() ? 'Client connected' : '客户端已连接', isEn() ? 'Waiting for task to start...' : '等待打印任务开始...');
@@ -2111,17 +2261,16 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
 
             ws.onopen = function() {
                 clearTimeout(wsTimeout);
-                // 发送状态检查请求，使用用户的账号信息
-                ws.send(JSON.stringify({
-                    type: 'check_client_status',
-                    username: g('currentUser').username,
-                    password: g('currentUser').password
-                }));
+                // 发送状态检查请求，使用会话令牌或用户的账号信息
+                sendPrintMessage(ws, {
+                    type: 'check_client_status'
+                });
             };
 
             ws.onmessage = function(event) {
                 try {
                     var response = JSON.parse(event.data);
+                    if (handlePrintAuthResponse(response, ws)) return;
                     if (response.type === 'client_status') {
                         updateClientStatus(response.connected);
                     }
@@ -2324,9 +2473,6 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
 
         // 发送文件到打印服务器
         async function sendFileToPrint(fileUrl, fileName) {
-            var username = g('currentUser').username;
-            var userPassword = g('currentUser').password;
-
             // 使用统一的状态模态框
             var statusUI = createPrintStatusModal(isEn() ? 'File Print: ' + fileName : '文件打印: ' + fileName);
 
@@ -2377,8 +2523,6 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
 
                     var printData = {
                         type: 'print_request',
-                        username: username,
-                        password: userPassword,
                         content: fullFileUrl,
                         content_type: 'file',
                         file_name: fileName,
@@ -2389,13 +2533,14 @@ async function downloadInCapacitor(data, filename, mimeType, isRawData = false)
                         timestamp: new Date().toISOString()
                     };
 
-                    ws.send(JSON.stringify(printData));
+                    sendPrintMessage(ws, printData);
                 };
 
                 ws.onmessage = function(event) {
                     if (isCancelled) return;
                     try {
                         var response = JSON.parse(event.data);
+                        if (handlePrintAuthResponse(response, ws)) return;
                         if (response.type === 'print_status') {
                             statusUI.updateStatus(isEn() ? 'Printing...' : '正在打印...', response.message, false);
                         } else if (response.type === 'print_queued') {
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息编码性能测试：对比 JSON、MessagePack 与 deflate/zstd 压缩
+- 消息包括小的状态消息和不同大小的打印请求（Markdown 文档）
+- 统计每种格式的编码/解码吞吐量（MB/s，按 JSON 文本大小计算）和实际发送的字节数
+- 未安装 msgpack 或 zstandard 时跳过对应格式
+- 用法: python benchmarks/bench_codec.py --sizes 0.01 1 5
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_codec import WireFormat, decode_frame, available_codecs, available_compression
+
+
+def make_document(size_mb):
+    """生成指定大小的 Markdown 文档，包含中文、换行和引号"""
+    line = '## 标题 Title\n正文内容 "quoted" text, 列表项与代码 `x = 1`\\n\n'
+    repeat = int(size_mb * 1024 * 1024) // len(line.encode('utf-8')) + 1
+    return line * repeat
+
+
+def make_messages(sizes):
+    messages = [('status', {'type': 'print_status', 'job_id': 'job_bench', 'message': '打印任务已成功发送到绑定的打印客户端'})]
+    for size_mb in sizes:
+        messages.append((f'{size_mb}MB', {
+            'type': 'print_request',
+            'username': 'bench',
+            'job_id': 'job_bench',
+            'settings': {'paper': 'A4'},
+            'content': make_document(size_mb)
+        }))
+    return messages
+
+
+def wire_formats():
+    """当前环境可用的全部编码与压缩组合"""
+    return [WireFormat(codec, compression) for codec in available_codecs() for compression in available_compression()]
+
+
+def decode(frame):
+    message = decode_frame(frame)
+    return json.loads(message) if isinstance(message, str) else message
+
+
+def measure(func, arg, rounds):
+    func(arg)  # 预热
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = func(arg)
+    return (time.perf_counter() - start) / rounds, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息编码性能测试')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[0.01, 1, 5], help='打印请求文档大小（MB）')
+    parser.add_argument('--rounds', type=int, default=20, help='每种消息重复次数')
+    parser.add_argument('--json', action='store_true', help='额外输出 JSON 格式结果')
+    args = parser.parse_args()
+
+    skipped = [name for name, available in (('msgpack', 'msgpack' in available_codecs()),
+                                            ('zstd', 'zstd' in available_compression())) if not available]
+    if skipped:
+        print(f"未安装，已跳过: {', '.join(skipped)}")
+
+    results = []
+    print(f"{'消息':>8} {'格式':>16} {'发送字节':>12} {'比例':>7} {'编码 MB/s':>10} {'解码 MB/s':>10}")
+    for name, message in make_messages(args.sizes):
+        text_size = len(json.dumps(message, ensure_ascii=False).encode('utf-8'))
+        rounds = args.rounds if text_size > 64 * 1024 else args.rounds * 100
+        for wire in wire_formats():
+            encode_time, frame = measure(wire.encode, message, rounds)
+            decode_time, decoded = measure(decode, frame, rounds)
+            assert decoded == message
+            wire_size = len(frame.encode('utf-8')) if isinstance(frame, str) else len(frame)
+            label = f'{wire.codec}+{wire.compression}'
+            result = {
+                'message': name,
+                'format': label,
+                'bytes': wire_size,
+                'ratio': wire_size / text_size,
+                'encode_mb_s': text_size / encode_time / 1024 / 1024,
+                'decode_mb_s': text_size / decode_time / 1024 / 1024
+            }
+            results.append(result)
+            print(f"{name:>8} {label:>16} {wire_size:>12} {result['ratio']:>7.2f} "
+                  f"{result['encode_mb_s']:>10.1f} {result['decode_mb_s']:>10.1f}")
+    if args.json:
+        print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
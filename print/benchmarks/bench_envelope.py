@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印请求转发性能测试：对比完整 JSON 解析/重新编码与信封帧
+- 模拟服务器收到打印请求到生成转发内容的过程（解析、去除密码、重新编码）
+- 统计每次转发的耗时与峰值内存（tracemalloc）
+- 另外启动本地 PrintServer，经真实的 WebSocket 连接从前端发送到打印客户端，统计往返耗时
+- 超过单条消息上限（MAX_MESSAGE_SIZE）的大小服务器会拒绝，不参与测试；更大的文档应使用分块传输
+- 用法: python benchmarks/bench_envelope.py --sizes 1 5 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import websockets
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_protocol import split_envelope, envelope_to_json, payload_header, MAX_MESSAGE_SIZE
+from print_server import PrintServer
+
+
+def make_document(size_mb):
+    """生成指定大小的 Markdown 文档，包含中文、换行和引号，接近真实内容的转义开销"""
+    line = '## 标题 Title\n正文内容 "quoted" text, 列表项与代码 `x = 1`\\n\n'
+    repeat = size_mb * 1024 * 1024 // len(line.encode('utf-8')) + 1
+    return line * repeat
+
+
+def make_frames(content):
+    header = {
+        'type': 'print_request',
+        'username': 'bench',
+        'password': 'secret',
+        'job_id': 'job_bench',
+        'settings': {'paper': 'A4'}
+    }
+    legacy = json.dumps(dict(header, content=content), ensure_ascii=False)
+    envelope = json.dumps(dict(header, envelope=1), ensure_ascii=False) + '\n' + json.dumps({'content': content}, ensure_ascii=False)
+    return legacy, envelope
+
+
+def relay_legacy(server, frame):
+    data = json.loads(frame)
+    return server.job_payload(data)
+
+
+def relay_envelope(server, frame):
+    data, body = split_envelope(frame)
+    return server.job_payload(data, body)
+
+
+def measure(func, server, frame, rounds):
+    """返回 (每次平均耗时秒数, 峰值额外内存字节数)"""
+    func(server, frame)  # 预热
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(server, frame)
+    elapsed = (time.perf_counter() - start) / rounds
+
+    tracemalloc.start()
+    result = func(server, frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+
+class RelayRoundTrip:
+    """本地 PrintServer + 一个支持信封帧的打印客户端，测量前端发送到打印客户端收到任务的耗时"""
+
+    async def start(self):
+        # 关闭限流，只测量转发本身
+        self.server = PrintServer(port=0, user_rate=0, conn_rate=0)
+        self.ws_server = await websockets.serve(self.server.handle_client, '127.0.0.1', 0, max_size=MAX_MESSAGE_SIZE)
+        url = f"ws://127.0.0.1:{self.ws_server.sockets[0].getsockname()[1]}"
+        self.client = await websockets.connect(url, max_size=MAX_MESSAGE_SIZE)
+        await self.client.send(json.dumps({
+            'type': 'client_auth', 'username': 'bench', 'password': 'secret',
+            'client_id': 'bench_client', 'capabilities': ['envelope']
+        }))
+        reply = json.loads(await self.client.recv())
+        if reply.get('type') != 'auth_success':
+            raise RuntimeError(f"打印客户端认证失败: {reply}")
+        self.frontend = await websockets.connect(url, max_size=MAX_MESSAGE_SIZE)
+
+    async def relay(self, frame):
+        """发送一次打印请求，返回打印客户端收到任务的耗时（秒）"""
+        start = time.perf_counter()
+        await self.frontend.send(frame)
+        while True:
+            header = payload_header(await self.client.recv())
+            if header.get('type') == 'print_request':
+                break
+        elapsed = time.perf_counter() - start
+        # 报告结果，任务不再计入进行中的任务数
+        await self.client.send(json.dumps({'type': 'print_queued', 'job_id': header['job_id']}))
+        return elapsed
+
+    async def measure(self, frame, rounds):
+        await self.relay(frame)  # 预热
+        total = 0.0
+        for _ in range(rounds):
+            total += await self.relay(frame)
+        return total / rounds
+
+    async def close(self):
+        await self.client.close()
+        await asyncio.sleep(0.1)  # 等待服务器处理打印客户端断开，再关闭前端连接
+        await self.frontend.close()
+        self.ws_server.close()
+        await self.ws_server.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='打印请求转发性能测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 10], help='文档大小（MB）')
+    parser.add_argument('--rounds', type=int, default=5, help='每种大小重复次数')
+    parser.add_argument('--json', action='store_true', help='额外输出 JSON 格式结果')
+    args = parser.parse_args()
+
+    server = PrintServer(port=0)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    round_trip = RelayRoundTrip()
+    loop.run_until_complete(round_trip.start())
+    results = []
+    print(f"{'大小':>6} {'完整 JSON':>12} {'信封帧':>12} {'峰值内存(完整)':>16} {'峰值内存(信封)':>16} "
+          f"{'往返(完整)':>12} {'往返(信封)':>12}")
+    for size_mb in args.sizes:
+        content = make_document(size_mb)
+        legacy, envelope = make_frames(content)
+        frame_size = max(len(legacy.encode('utf-8')), len(envelope.encode('utf-8')))
+        if frame_size > MAX_MESSAGE_SIZE:
+            print(f"{size_mb:>4}MB 消息 {frame_size / 1024 / 1024:.1f}MB 超过服务器的单条消息上限 "
+                  f"{MAX_MESSAGE_SIZE / 1024 / 1024:.0f}MB，跳过")
+            continue
+        # 两种方式转发给打印客户端的内容等价
+        assert json.loads(envelope_to_json(*split_envelope(relay_envelope(server, envelope)))) == \
+            json.loads(relay_legacy(server, legacy))
+        legacy_time, legacy_peak = measure(relay_legacy, server, legacy, args.rounds)
+        envelope_time, envelope_peak = measure(relay_envelope, server, envelope, args.rounds)
+        legacy_rtt = loop.run_until_complete(round_trip.measure(legacy, args.rounds))
+        envelope_rtt = loop.run_until_complete(round_trip.measure(envelope, args.rounds))
+        results.append({
+            'size_mb': size_mb,
+            'legacy_ms': legacy_time * 1000,
+            'envelope_ms': envelope_time * 1000,
+            'legacy_peak_mb': legacy_peak / 1024 / 1024,
+            'envelope_peak_mb': envelope_peak / 1024 / 1024,
+            'legacy_round_trip_ms': legacy_rtt * 1000,
+            'envelope_round_trip_ms': envelope_rtt * 1000
+        })
+        print(f"{size_mb:>4}MB {legacy_time * 1000:>10.1f}ms {envelope_time * 1000:>10.1f}ms "
+              f"{legacy_peak / 1024 / 1024:>14.1f}MB {envelope_peak / 1024 / 1024:>14.1f}MB "
+              f"{legacy_rtt * 1000:>10.1f}ms {envelope_rtt * 1000:>10.1f}ms")
+    loop.run_until_complete(round_trip.close())
+    loop.close()
+    if args.json:
+        print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
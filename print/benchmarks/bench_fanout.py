@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+广播性能测试：模拟大量前端连接，对比逐个发送与发送队列
+- 大部分连接发送很快，少量连接模拟移动网络下的慢速浏览器
+- 用法: python benchmarks/bench_fanout.py --connections 10000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_server import PrintServer
+
+
+class FakeConnection:
+    """模拟的 websocket 连接，只实现 send/close"""
+
+    remote_address = ('fake', 0)
+
+    def __init__(self, delay, broken=False):
+        self.delay = delay
+        self.broken = broken
+        self.sent = 0
+
+    async def send(self, message):
+        if self.broken:
+            raise ConnectionError("连接已断开")
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent += 1
+
+    async def close(self, code=1000, reason=''):
+        pass
+
+
+def make_connections(count, slow_ratio, slow_delay, broken_ratio):
+    connections = []
+    for _ in range(count):
+        roll = random.random()
+        if roll < broken_ratio:
+            connections.append(FakeConnection(0, broken=True))
+        elif roll < broken_ratio + slow_ratio:
+            connections.append(FakeConnection(slow_delay))
+        else:
+            connections.append(FakeConnection(0))
+    return connections
+
+
+async def sequential_broadcast(connections, message):
+    """旧实现：逐个 await 发送"""
+    for connection in connections:
+        try:
+            await connection.send(message)
+        except Exception:
+            pass
+
+
+async def run(args):
+    random.seed(args.seed)
+    message = json.dumps({
+        'type': 'client_status',
+        'connected': True,
+        'clients': [f'client_{i}' for i in range(10)],
+        'message': '打印客户端已连接'
+    }, ensure_ascii=False)
+
+    server = PrintServer(port=0, send_timeout=args.send_timeout)
+
+    results = {}
+    connections = make_connections(args.connections, args.slow_ratio, args.slow_delay, args.broken_ratio)
+    start = time.perf_counter()
+    await sequential_broadcast(connections, message)
+    results['sequential'] = time.perf_counter() - start
+
+    connections = make_connections(args.connections, args.slow_ratio, args.slow_delay, args.broken_ratio)
+    server.connections = set(connections)
+    queues = [server.open_outbound(connection) for connection in connections]
+    start = time.perf_counter()
+    failed = server.broadcast_frame(connections, message)
+    results['enqueue'] = time.perf_counter() - start
+    # 等待所有写协程发送完毕（慢速连接超时后被断开）
+    await asyncio.gather(*(queue.drained() for queue in queues))
+    results['concurrent'] = time.perf_counter() - start
+    stats = server.outbound_stats()
+    for connection in connections:
+        server.close_outbound(connection)
+
+    print(f"\n连接数: {args.connections}, 慢速连接比例: {args.slow_ratio}, 慢速延迟: {args.slow_delay}s, "
+          f"断开连接比例: {args.broken_ratio}, 发送超时: {args.send_timeout}s")
+    print(f"逐个发送: {results['sequential'] * 1000:.1f} ms")
+    print(f"发送队列: 入队 {results['enqueue'] * 1000:.1f} ms, 全部发送完成 {results['concurrent'] * 1000:.1f} ms "
+          f"(断开 {stats['evicted']} 个, 剩余 {len(server.connections)} 个)")
+    if args.json:
+        print(json.dumps({
+            'connections': args.connections,
+            'sequential_ms': results['sequential'] * 1000,
+            'enqueue_ms': results['enqueue'] * 1000,
+            'concurrent_ms': results['concurrent'] * 1000,
+            'failed': len(failed),
+            'evicted': stats['evicted']
+        }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='广播性能测试')
+    parser.add_argument('--connections', type=int, default=10000, help='模拟连接数')
+    parser.add_argument('--slow-ratio', type=float, default=0.001, help='慢速连接比例')
+    parser.add_argument('--slow-delay', type=float, default=0.2, help='慢速连接每次发送的延迟（秒）')
+    parser.add_argument('--broken-ratio', type=float, default=0.001, help='已断开连接比例')
+    parser.add_argument('--send-timeout', type=float, default=0.1, help='发送队列中单个连接的发送超时（秒）')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='额外输出 JSON 格式结果')
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
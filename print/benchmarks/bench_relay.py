@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印服务器负载测试：启动本地 PrintServer，模拟 N 个前端和 M 个打印客户端
+- 前端按设定速率（或固定并发）发送 print_request，统计到收到 print_queued 的端到端延迟
+- 模拟打印客户端按真实客户端的流程回复 print_ack → print_status → print_queued，
+  可用 --print-delay 模拟打印耗时；--client-impl real 使用真实的 PrintClient 和假的 lpr 命令
+- 默认关闭服务器的限流和进行中任务数上限，--keep-limits 保留默认配置
+- 服务器在子进程中运行，统计其（包括所有工作进程的）CPU 时间和最大内存占用
+- 输出 jobs/s、p50/p90/p99 延迟；--json 输出一行 JSON 结果，--output 追加到文件便于跟踪性能变化
+- 用法: python benchmarks/bench_relay.py --frontends 20 --clients 5 --rate 200 --duration 10
+"""
+
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+import websockets
+
+PRINT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PRINT_DIR)
+from print_protocol import payload_header
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _proc_tree(pid):
+    """/proc 中 pid 及其所有子进程（未安装 psutil 时使用，仅 Linux）"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except OSError:
+            continue
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        pending.extend(children.get(current, ()))
+    return pids
+
+
+def process_usage(pid):
+    """返回进程树的 (CPU 秒数, 常驻内存字节数)，无法获取时返回 (None, None)"""
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            processes = [root] + root.children(recursive=True)
+            cpu = rss = 0
+            for process in processes:
+                try:
+                    times = process.cpu_times()
+                    cpu += times.user + times.system
+                    rss += process.memory_info().rss
+                except psutil.Error:
+                    pass
+            return cpu, rss
+        except psutil.Error:
+            return None, None
+    if not os.path.isdir('/proc'):
+        return None, None
+    ticks = os.sysconf('SC_CLK_TCK')
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    cpu = rss = 0
+    for current in _proc_tree(pid):
+        try:
+            with open(f'/proc/{current}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            # 第 14、15 个字段为 utime、stime，第 24 个为 rss（页数）
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            rss += int(fields[21]) * page_size
+        except OSError:
+            pass
+    return cpu, rss
+
+
+class SimulatedClient:
+    """模拟的打印客户端：收到任务后按真实客户端的顺序回复确认、状态和结果"""
+
+    def __init__(self, url, username, client_id, print_delay):
+        self.url = url
+        self.username = username
+        self.client_id = client_id
+        self.print_delay = print_delay
+        self.jobs = 0
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        await self.websocket.send(json.dumps({
+            'type': 'client_auth', 'username': self.username, 'password': 'bench',
+            'client_id': self.client_id, 'capabilities': ['ack', 'envelope']
+        }))
+        reply = json.loads(await self.websocket.recv())
+        if reply.get('type') != 'auth_success':
+            raise RuntimeError(f"打印客户端认证失败: {reply}")
+
+    async def run(self):
+        async for message in self.websocket:
+            # 信封帧只解析头部，与真实客户端一样不需要文档内容
+            header = payload_header(message)
+            if header.get('type') != 'print_request':
+                continue
+            asyncio.ensure_future(self.handle(header['job_id']))
+
+    async def handle(self, job_id):
+        send = self.websocket.send
+        try:
+            await send(json.dumps({'type': 'print_ack', 'job_id': job_id}))
+            await send(json.dumps({'type': 'print_status', 'job_id': job_id, 'message': '开始打印'}, ensure_ascii=False))
+            if self.print_delay:
+                await asyncio.sleep(self.print_delay)
+            await send(json.dumps({'type': 'print_queued', 'job_id': job_id, 'message': 'ok'}))
+            self.jobs += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def close(self):
+        await self.websocket.close()
+
+
+class RealClient:
+    """真实的 PrintClient，lpr 替换为只读取输入的假命令"""
+
+    def __init__(self, url, username, client_id, print_delay, workers=2):
+        from print_client import PrintClient
+        self.client = PrintClient(log_callback=lambda message: None, workers=workers)
+        self.client.username = username
+        self.client.password = 'bench'
+        self.client.printer_name = 'bench'
+        self.client.server_url = url
+        self.client.save_config = lambda: None
+        self.task = None
+
+    async def connect(self):
+        self.task = asyncio.ensure_future(self.client.connect_and_listen())
+        for _ in range(100):
+            if self.client.connected:
+                return
+            await asyncio.sleep(0.05)
+        raise RuntimeError("打印客户端连接超时")
+
+    async def run(self):
+        await self.task
+
+    async def close(self):
+        self.task.cancel()
+        await self.client.stop_workers()
+
+
+def install_fake_lpr(directory, print_delay):
+    """生成假的 lpr/lpstat 命令并加入 PATH"""
+    lpr = os.path.join(directory, 'lpr')
+    with open(lpr, 'w') as f:
+        f.write(f"#!/bin/sh\ncat > /dev/null\nsleep {print_delay}\n")
+    lpstat = os.path.join(directory, 'lpstat')
+    with open(lpstat, 'w') as f:
+        f.write("#!/bin/sh\necho 'printer bench is idle.'\n")
+    for path in (lpr, lpstat):
+        os.chmod(path, 0o755)
+    os.environ['PATH'] = directory + os.pathsep + os.environ['PATH']
+
+
+class Frontend:
+    """模拟的前端：认证后用会话令牌发送打印请求，记录每个任务的延迟"""
+
+    def __init__(self, url, username, index, content, envelope, timeout):
+        self.url = url
+        self.username = username
+        self.index = index
+        self.content = content
+        self.envelope = envelope
+        self.timeout = timeout
+        self.pending = {}  # job_id -> (发送时间, 完成事件)
+        self.latencies = []
+        self.first_status = []
+        self.errors = 0
+        self.sequence = itertools.count()
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        await self.websocket.send(json.dumps({'type': 'auth', 'username': self.username, 'password': 'bench',
+                                              'protocol_version': 4}))
+        reply = json.loads(await self.websocket.recv())
+        if reply.get('type') != 'auth_success':
+            raise RuntimeError(f"前端认证失败: {reply}")
+        self.token = reply['token']
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def read(self):
+        async for message in self.websocket:
+            data = json.loads(message)
+            entry = self.pending.get(data.get('job_id'))
+            if entry is None:
+                continue
+            started, done, status_seen = entry
+            now = time.perf_counter()
+            if data['type'] == 'print_status' and not status_seen:
+                self.first_status.append(now - started)
+                self.pending[data['job_id']] = (started, done, True)
+            elif data['type'] == 'print_queued':
+                self.latencies.append(now - started)
+                done.set()
+            elif data['type'] == 'error':
+                self.errors += 1
+                done.set()
+
+    async def submit(self):
+        """发送一个任务并等待结果"""
+        job_id = f"bench_{self.index}_{next(self.sequence)}"
+        done = asyncio.Event()
+        self.pending[job_id] = (time.perf_counter(), done, False)
+        header = {'type': 'print_request', 'token': self.token, 'job_id': job_id, 'settings': {}}
+        if self.envelope:
+            frame = json.dumps(dict(header, envelope=1)) + '\n' + json.dumps({'content': self.content}, ensure_ascii=False)
+        else:
+            frame = json.dumps(dict(header, content=self.content), ensure_ascii=False)
+        try:
+            await self.websocket.send(frame)
+            await asyncio.wait_for(done.wait(), self.timeout)
+        except (asyncio.TimeoutError, websockets.ConnectionClosed):
+            self.errors += 1
+        finally:
+            self.pending.pop(job_id, None)
+
+    async def close(self):
+        await self.websocket.close()
+        self.reader.cancel()
+
+
+def make_content(size):
+    line = '## 标题 Title\n正文内容 "quoted" text `x = 1`\n'
+    return (line * (size // len(line.encode('utf-8')) + 1))[:max(size, 1)]
+
+
+async def drive(frontends, args):
+    """按速率（开环）或固定并发（闭环）发送任务，返回实际运行时间"""
+    deadline = time.perf_counter() + args.duration
+    tasks = set()
+    start = time.perf_counter()
+    if args.rate > 0:
+        interval = 1.0 / args.rate
+        next_at = start
+        for count in itertools.count():
+            now = time.perf_counter()
+            if now >= deadline or (args.jobs and count >= args.jobs):
+                break
+            if next_at > now:
+                await asyncio.sleep(next_at - now)
+            next_at += interval
+            task = asyncio.ensure_future(frontends[count % len(frontends)].submit())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    else:
+        sent = itertools.count()
+
+        async def loop(frontend):
+            while time.perf_counter() < deadline and (not args.jobs or next(sent) < args.jobs):
+                await frontend.submit()
+
+        await asyncio.gather(*(loop(frontend) for frontend in frontends for _ in range(args.concurrency)))
+    if tasks:
+        await asyncio.wait(tasks)
+    return time.perf_counter() - start
+
+
+async def run(args):
+    port = free_port()
+    url = f'ws://127.0.0.1:{port}'
+    command = [sys.executable, os.path.join(PRINT_DIR, 'print_server.py'), '--port', str(port),
+               '--auth-backend', 'stub', '--data-dir', args.data_dir, '--log-level', 'WARNING',
+               '--workers', str(args.workers)]
+    if not args.keep_limits:
+        command += ['--user-rate', '0', '--conn-rate', '0', '--max-inflight', '0']
+    command += args.server_args
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL if not args.verbose else None,
+                              stderr=subprocess.STDOUT if not args.verbose else None)
+    clients = []
+    frontends = []
+    try:
+        for _ in range(100):
+            try:
+                probe = await websockets.connect(url)
+                await probe.close()
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError("打印服务器启动超时")
+
+        users = [f'bench_user_{i}' for i in range(args.users or args.clients)]
+        client_class = SimulatedClient
+        if args.client_impl == 'real':
+            install_fake_lpr(tempfile.mkdtemp(prefix='bench_lpr_'), args.print_delay)
+            client_class = functools.partial(RealClient, workers=args.client_workers)
+        for i in range(args.clients):
+            client = client_class(url, users[i % len(users)], f'bench_client_{i}', args.print_delay)
+            await client.connect()
+            clients.append(client)
+        client_tasks = [asyncio.ensure_future(client.run()) for client in clients]
+
+        content = make_content(args.payload_size)
+        for i in range(args.frontends):
+            frontend = Frontend(url, users[i % len(users)], i, content, args.envelope, args.timeout)
+            await frontend.connect()
+            frontends.append(frontend)
+
+        cpu_before, _ = process_usage(server.pid)
+        harness_before = time.process_time()
+        peak_rss = [0]
+
+        async def sample_rss():
+            while True:
+                _, rss = process_usage(server.pid)
+                if rss:
+                    peak_rss[0] = max(peak_rss[0], rss)
+                await asyncio.sleep(0.2)
+
+        sampler = asyncio.ensure_future(sample_rss())
+        elapsed = await drive(frontends, args)
+        sampler.cancel()
+        cpu_after, rss_after = process_usage(server.pid)
+        harness_cpu = time.process_time() - harness_before
+
+        for task in client_tasks:
+            task.cancel()
+    finally:
+        for frontend in frontends:
+            await frontend.close()
+        for client in clients:
+            await client.close()
+        server.terminate()
+        server.wait()
+
+    latencies = [latency for frontend in frontends for latency in frontend.latencies]
+    first_status = [latency for frontend in frontends for latency in frontend.first_status]
+    errors = sum(frontend.errors for frontend in frontends)
+    server_cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    ms = lambda value: None if value is None else value * 1000
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'params': {name: getattr(args, name) for name in (
+            'frontends', 'clients', 'users', 'workers', 'rate', 'concurrency', 'duration', 'jobs',
+            'payload_size', 'envelope', 'print_delay', 'client_impl', 'server_args')},
+        'completed': len(latencies),
+        'errors': errors,
+        'elapsed_s': elapsed,
+        'jobs_per_s': len(latencies) / elapsed if elapsed else 0,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p90': ms(percentile(latencies, 90)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(max(latencies) if latencies else None)
+        },
+        'first_status_ms': {
+            'p50': ms(percentile(first_status, 50)),
+            'p99': ms(percentile(first_status, 99))
+        },
+        'server_cpu_s': server_cpu,
+        'server_cpu_percent': server_cpu / elapsed * 100 if server_cpu is not None and elapsed else None,
+        'server_rss_mb': (max(peak_rss[0], rss_after or 0) / 1024 / 1024) if (peak_rss[0] or rss_after) else None,
+        'harness_cpu_s': harness_cpu
+    }
+
+
+def report(result):
+    fmt = lambda value, unit='': '-' if value is None else f'{value:.1f}{unit}'
+    latency = result['latency_ms']
+    print(f"\n完成 {result['completed']} 个任务，失败 {result['errors']} 个，用时 {result['elapsed_s']:.1f} 秒")
+    print(f"吞吐量: {result['jobs_per_s']:.1f} jobs/s")
+    print(f"端到端延迟: p50 {fmt(latency['p50'], 'ms')}  p90 {fmt(latency['p90'], 'ms')}  "
+          f"p99 {fmt(latency['p99'], 'ms')}  max {fmt(latency['max'], 'ms')}")
+    print(f"首个状态消息: p50 {fmt(result['first_status_ms']['p50'], 'ms')}  "
+          f"p99 {fmt(result['first_status_ms']['p99'], 'ms')}")
+    print(f"服务器: CPU {fmt(result['server_cpu_s'], 's')} ({fmt(result['server_cpu_percent'], '%')})  "
+          f"最大内存 {fmt(result['server_rss_mb'], 'MB')}")
+    print(f"测试程序 CPU: {result['harness_cpu_s']:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='打印服务器负载测试')
+    parser.add_argument('--frontends', type=int, default=10, help='模拟前端连接数')
+    parser.add_argument('--clients', type=int, default=2, help='模拟打印客户端数')
+    parser.add_argument('--users', type=int, default=0, help='用户数（默认与打印客户端数相同，前端和客户端按序号分配到用户）')
+    parser.add_argument('--workers', type=int, default=1, help='服务器工作进程数')
+    parser.add_argument('--rate', type=float, default=0, help='每秒发送的任务数（0 表示按 --concurrency 固定并发尽快发送）')
+    parser.add_argument('--concurrency', type=int, default=1, help='每个前端同时进行的任务数（--rate 为 0 时使用）')
+    parser.add_argument('--duration', type=float, default=10, help='测试时长（秒）')
+    parser.add_argument('--jobs', type=int, default=0, help='最多发送的任务数（0 表示不限）')
+    parser.add_argument('--payload-size', type=int, default=1024, help='文档内容大小（字节）')
+    parser.add_argument('--envelope', action='store_true', help='使用信封帧发送打印请求')
+    parser.add_argument('--print-delay', type=float, default=0, help='模拟打印耗时（秒）')
+    parser.add_argument('--client-impl', choices=['sim', 'real'], default='sim',
+                        help='sim: 模拟打印客户端；real: 真实 PrintClient + 假 lpr（仅 Linux/macOS）')
+    parser.add_argument('--client-workers', type=int, default=2, help='真实打印客户端同时处理的任务数')
+    parser.add_argument('--timeout', type=float, default=30, help='单个任务的超时时间（秒）')
+    parser.add_argument('--data-dir', type=str, default='', help='服务器离线任务队列目录（默认不启用）')
+    parser.add_argument('--server-arg', dest='server_args', action='append', default=[],
+                        help='传给服务器的额外参数，可重复（例如 --server-arg=--schedule=round_robin）')
+    parser.add_argument('--keep-limits', action='store_true',
+                        help='保留服务器默认的限流和进行中任务数上限（默认关闭，以测量最大吞吐量）')
+    parser.add_argument('--verbose', action='store_true', help='显示服务器输出')
+    parser.add_argument('--json', action='store_true', help='额外输出 JSON 格式结果')
+    parser.add_argument('--output', type=str, default=None, help='把 JSON 结果追加到文件（每行一条）')
+    args = parser.parse_args()
+
+    result = asyncio.get_event_loop().run_until_complete(run(args))
+    report(result)
+    line = json.dumps(result, ensure_ascii=False)
+    if args.json:
+        print(line)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印服务器用户凭证验证
+- 验证器接口: async verify(username, password) -> bool，后端不可用时抛出异常
+- StubVerifier: 本地验证器（测试或离线部署使用）
+- ApiVerifier: 调用 Markdown 编辑器后端的登录接口验证账号密码
+- CachedVerifier: 进程内 LRU 缓存，成功结果缓存较长时间、失败结果只缓存很短时间，
+  缓存中只保存加盐哈希并使用常量时间比较，同一凭证的并发验证只请求一次后端
+- TokenSigner: 签发和验证 HMAC 签名的短期会话令牌，验证只需本地计算签名
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import urllib.request
+from collections import OrderedDict
+
+from print_logging import get_logger
+
+
+logger = get_logger('print_auth')
+
+DEFAULT_AUTH_URL = 'http://127.0.0.1:3000/api/auth/login'
+DEFAULT_TOKEN_TTL = 3600  # 会话令牌有效期（秒）
+TOKEN_SECRET_ENV = 'PRINT_TOKEN_SECRET'
+
+
+class StubVerifier:
+    """本地验证器：未指定用户表时接受所有凭证（与旧版本行为一致）"""
+
+    def __init__(self, users=None):
+        self.users = users  # username -> password
+        self.calls = 0
+
+    async def verify(self, username, password):
+        self.calls += 1
+        if self.users is None:
+            return True
+        if not username or not password:
+            return False
+        expected = self.users.get(username)
+        return expected is not None and hmac.compare_digest(expected.encode('utf-8'), password.encode('utf-8'))
+
+
+class ApiVerifier:
+    """通过 HTTP 登录接口验证，请求在线程池中执行，不阻塞事件循环"""
+
+    def __init__(self, url=DEFAULT_AUTH_URL, timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def _login(self, username, password):
+        body = json.dumps({'username': username, 'password': password}).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            result = json.loads(response.read().decode('utf-8'))
+        code = result.get('code')
+        if code == 200:
+            return True
+        if code in (400, 401):
+            return False
+        # 后端自身出错（如数据库不可用）不能当作密码错误
+        raise RuntimeError(f"登录接口返回错误: {result.get('message')}")
+
+    async def verify(self, username, password):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self._login, username, password)
+
+
+class CachedVerifier:
+    def __init__(self, backend, max_entries=10000, ttl=300, negative_ttl=10):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl  # 验证成功的缓存时间（秒）
+        self.negative_ttl = negative_ttl  # 验证失败的缓存时间（秒）
+        self._salt = os.urandom(16)  # 每个进程随机的盐，缓存中不保存明文密码
+        self._positive = OrderedDict()  # username -> (digest, expires_at)
+        self._negative = OrderedDict()  # (username, digest) -> expires_at
+        self._inflight = {}  # (username, digest) -> Future
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, username, password):
+        return hmac.new(self._salt, f'{username}\0{password}'.encode('utf-8'), hashlib.sha256).digest()
+
+    @staticmethod
+    def _store(cache, key, value, max_entries):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_entries:
+            cache.popitem(last=False)
+
+    def _lookup(self, username, digest, now):
+        entry = self._positive.get(username)
+        if entry is not None:
+            cached_digest, expires_at = entry
+            if expires_at <= now:
+                del self._positive[username]
+            elif hmac.compare_digest(cached_digest, digest):
+                self._positive.move_to_end(username)
+                return True
+        expires_at = self._negative.get((username, digest))
+        if expires_at is not None:
+            if expires_at > now:
+                return False
+            del self._negative[(username, digest)]
+        return None
+
+    async def verify(self, username, password):
+        if not username or not password:
+            return False
+        digest = self._digest(username, password)
+        cached = self._lookup(username, digest, time.monotonic())
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        key = (username, digest)
+        future = self._inflight.get(key)
+        if future is not None:
+            # 同一凭证已有验证请求在进行中，直接等待其结果
+            return await asyncio.shield(future)
+
+        future = asyncio.get_event_loop().create_future()
+        self._inflight[key] = future
+        try:
+            valid = bool(await self.backend.verify(username, password))
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            now = time.monotonic()
+            if valid:
+                self._negative.pop(key, None)
+                self._store(self._positive, username, (digest, now + self.ttl), self.max_entries)
+            else:
+                self._store(self._negative, key, now + self.negative_ttl, self.max_entries)
+            future.set_result(valid)
+            return valid
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, username):
+        """清除用户的缓存（例如修改密码后）"""
+        self._positive.pop(username, None)
+        for key in [key for key in self._negative if key[0] == username]:
+            del self._negative[key]
+
+
+def create_verifier(backend='api', url=DEFAULT_AUTH_URL, ttl=300, negative_ttl=10, max_entries=10000):
+    """根据 --auth-backend 参数创建带缓存的验证器: api 或 stub"""
+    if backend == 'stub':
+        verifier = StubVerifier()
+    elif backend == 'api':
+        verifier = ApiVerifier(url)
+    else:
+        raise ValueError(f"不支持的验证后端: {backend}")
+    return CachedVerifier(verifier, max_entries=max_entries, ttl=ttl, negative_ttl=negative_ttl)
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class TokenSigner:
+    """会话令牌: base64url(用户名\n过期时间).base64url(HMAC-SHA256 签名)
+
+    多个工作进程需要使用相同的密钥才能互相验证令牌
+    """
+
+    def __init__(self, secret=None, ttl=DEFAULT_TOKEN_TTL):
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        # 未配置密钥时使用随机密钥，重启后旧令牌失效，客户端需重新认证
+        self.secret = secret or os.urandom(32)
+        self.ttl = ttl
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload.encode('ascii'), hashlib.sha256).digest()
+
+    def issue(self, username):
+        """签发令牌，返回 (token, 有效秒数)"""
+        expires_at = int(time.time()) + int(self.ttl)
+        payload = _b64encode(f'{username}\n{expires_at}'.encode('utf-8'))
+        return f'{payload}.{_b64encode(self._sign(payload))}', int(self.ttl)
+
+    def verify(self, token):
+        """验证令牌，返回用户名；签名错误、格式错误或已过期时返回 None"""
+        if not isinstance(token, str) or token.count('.') != 1:
+            return None
+        payload, signature = token.split('.')
+        try:
+            if not hmac.compare_digest(_b64decode(signature), self._sign(payload)):
+                return None
+            username, expires_at = _b64decode(payload).decode('utf-8').rsplit('\n', 1)
+            if int(expires_at) <= time.time():
+                return None
+        except (ValueError, UnicodeError):
+            return None
+        return username
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印服务器多进程路由
+- 多个 print_server.py 工作进程共享监听端口时，记录每个用户的打印客户端在哪个进程上
+- 在工作进程之间转发打印任务和任务状态；Unix socket 中转回复消息是否已交给目标进程，
+  目标进程已退出时发送方改为加入离线队列
+- 默认后端：单进程（local）或由主进程提供的 Unix socket 中转（unix:路径）
+- 可选后端：Redis（redis://...），用于跨主机部署，需要安装 redis 库
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import struct
+
+from print_logging import get_logger
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+
+logger = get_logger('print_broker')
+
+_HEADER = struct.Struct('!I')  # 消息帧：4 字节长度 + JSON
+
+
+async def _read_frame(reader):
+    header = await reader.readexactly(_HEADER.size)
+    (length,) = _HEADER.unpack(header)
+    return json.loads(await reader.readexactly(length))
+
+
+def _write_frame(writer, message):
+    body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    writer.write(_HEADER.pack(len(body)) + body)
+
+
+class LocalBroker:
+    """单进程模式：没有其他工作进程，所有路由都在本进程内完成"""
+
+    def __init__(self, worker_id='0'):
+        self.worker_id = worker_id
+        self.on_message = None
+
+    async def start(self, on_message):
+        self.on_message = on_message
+
+    async def claim(self, username, client_id):
+        pass
+
+    async def release(self, username, client_id):
+        pass
+
+    async def owners(self, username):
+        """返回持有该用户打印客户端的其他工作进程"""
+        return []
+
+    async def send(self, worker_id, message):
+        return False
+
+    async def broadcast(self, message):
+        pass
+
+    async def close(self):
+        pass
+
+
+class BrokerHub:
+    """由主进程运行的 Unix socket 中转，保存 用户 → 工作进程 的路由表"""
+
+    def __init__(self, path):
+        self.path = path
+        self.server = None
+        self.writers = {}  # worker_id -> StreamWriter
+        self.claims = {}  # username -> {worker_id: 客户端数量}
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._handle_worker, path=self.path)
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _drop_worker(self, worker_id):
+        self.writers.pop(worker_id, None)
+        for username in list(self.claims):
+            workers = self.claims[username]
+            workers.pop(worker_id, None)
+            if not workers:
+                del self.claims[username]
+
+    async def _handle_worker(self, reader, writer):
+        worker_id = None
+        try:
+            while True:
+                message = await _read_frame(reader)
+                op = message.get('op')
+                if op == 'hello':
+                    worker_id = message['worker']
+                    # 工作进程重连时以其上报的绑定为准
+                    self._drop_worker(worker_id)
+                    self.writers[worker_id] = writer
+                    for username, count in message.get('claims', {}).items():
+                        self.claims.setdefault(username, {})[worker_id] = count
+                elif op == 'claim':
+                    workers = self.claims.setdefault(message['user'], {})
+                    workers[worker_id] = workers.get(worker_id, 0) + 1
+                elif op == 'release':
+                    workers = self.claims.get(message['user'], {})
+                    if worker_id in workers:
+                        workers[worker_id] -= 1
+                        if workers[worker_id] <= 0:
+                            del workers[worker_id]
+                    if not workers:
+                        self.claims.pop(message['user'], None)
+                elif op == 'owners':
+                    workers = [w for w in self.claims.get(message['user'], {}) if w != worker_id]
+                    _write_frame(writer, {'op': 'owners_reply', 'req': message['req'], 'workers': workers})
+                elif op == 'send':
+                    # 目标工作进程已退出时回复未送达，发送方改为加入离线队列
+                    target = self.writers.get(message['to'])
+                    if target is not None:
+                        _write_frame(target, {'op': 'message', 'msg': message['msg']})
+                    if 'req' in message:
+                        _write_frame(writer, {'op': 'send_reply', 'req': message['req'],
+                                              'delivered': target is not None})
+                elif op == 'broadcast':
+                    for target_id, target in list(self.writers.items()):
+                        if target_id != worker_id:
+                            _write_frame(target, {'op': 'message', 'msg': message['msg']})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if worker_id is not None and self.writers.get(worker_id) is writer:
+                self._drop_worker(worker_id)
+            writer.close()
+
+
+class UnixSocketBroker:
+    """工作进程通过主进程的 Unix socket 中转与其他工作进程通信"""
+
+    def __init__(self, path, worker_id, reconnect_delay=1.0, request_timeout=2.0):
+        self.path = path
+        self.worker_id = worker_id
+        self.reconnect_delay = reconnect_delay
+        self.request_timeout = request_timeout
+        self.on_message = None
+        self.writer = None
+        self._claims = {}  # username -> 本进程的客户端数量
+        self._pending = {}  # req -> Future
+        self._req_ids = itertools.count(1)
+        self._task = None
+        self._connected = asyncio.Event()
+
+    async def start(self, on_message):
+        self.on_message = on_message
+        self._task = asyncio.ensure_future(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ 无法连接到路由中转 %s，将在后台继续重试", self.path)
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                _write_frame(writer, {'op': 'hello', 'worker': self.worker_id, 'claims': dict(self._claims)})
+                self.writer = writer
+                self._connected.set()
+                while True:
+                    message = await _read_frame(reader)
+                    if message.get('op') in ('owners_reply', 'send_reply'):
+                        future = self._pending.pop(message['req'], None)
+                        if future is not None and not future.done():
+                            future.set_result(message.get('workers', message.get('delivered')))
+                    elif message.get('op') == 'message' and self.on_message:
+                        asyncio.ensure_future(self.on_message(message['msg']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("与路由中转的连接断开: %s，%s 秒后重连", e, self.reconnect_delay)
+            self._connected.clear()
+            self.writer = None
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_result(None)
+            self._pending.clear()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _write(self, message):
+        if self.writer is None:
+            return False
+        _write_frame(self.writer, message)
+        return True
+
+    async def claim(self, username, client_id):
+        self._claims[username] = self._claims.get(username, 0) + 1
+        self._write({'op': 'claim', 'user': username})
+
+    async def release(self, username, client_id):
+        count = self._claims.get(username, 0) - 1
+        if count > 0:
+            self._claims[username] = count
+        else:
+            self._claims.pop(username, None)
+        self._write({'op': 'release', 'user': username})
+
+    async def _request(self, message, default):
+        """发送需要中转回复的请求，未连接、连接断开或超时时返回 default"""
+        req = message['req'] = next(self._req_ids)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[req] = future
+        if not self._write(message):
+            self._pending.pop(req, None)
+            return default
+        try:
+            await self.writer.drain()
+            result = await asyncio.wait_for(future, timeout=self.request_timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(req, None)
+            return default
+        return default if result is None else result
+
+    async def owners(self, username):
+        return await self._request({'op': 'owners', 'user': username}, [])
+
+    async def send(self, worker_id, message):
+        """经中转发送给其他工作进程，返回中转是否已交给目标进程（目标进程已退出时为 False）"""
+        return await self._request({'op': 'send', 'to': worker_id, 'msg': message}, False)
+
+    async def broadcast(self, message):
+        if self._write({'op': 'broadcast', 'msg': message}):
+            await self.writer.drain()
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self.writer:
+            self.writer.close()
+
+
+class RedisBroker:
+    """基于 Redis 的路由：用户绑定保存在集合中，进程间消息通过发布/订阅转发"""
+
+    def __init__(self, url, worker_id, prefix='print_relay', alive_ttl=30):
+        if aioredis is None:
+            raise RuntimeError("使用 Redis 路由需要安装 redis 库: pip install redis")
+        self.url = url
+        self.worker_id = worker_id
+        self.prefix = prefix
+        self.alive_ttl = alive_ttl
+        self.on_message = None
+        self.redis = None
+        self.pubsub = None
+        self._claims = {}  # username -> 本进程的客户端数量
+        self._tasks = []
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix,) + parts)
+
+    async def start(self, on_message):
+        self.on_message = on_message
+        self.redis = aioredis.from_url(self.url, decode_responses=True)
+        await self.redis.set(self._key('alive', self.worker_id), 1, ex=self.alive_ttl)
+        self.pubsub = self.redis.pubsub()
+        await self.pubsub.subscribe(self._key('worker', self.worker_id), self._key('all'))
+        self._tasks = [asyncio.ensure_future(self._listen()), asyncio.ensure_future(self._keepalive())]
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.alive_ttl / 3)
+            try:
+                await self.redis.set(self._key('alive', self.worker_id), 1, ex=self.alive_ttl)
+            except Exception as e:
+                logger.warning("刷新 Redis 存活标记失败: %s", e)
+
+    async def _listen(self):
+        async for item in self.pubsub.listen():
+            if item.get('type') != 'message':
+                continue
+            try:
+                envelope = json.loads(item['data'])
+            except ValueError:
+                continue
+            if envelope.get('from') == self.worker_id:
+                continue
+            if self.on_message:
+                asyncio.ensure_future(self.on_message(envelope['msg']))
+
+    async def claim(self, username, client_id):
+        self._claims[username] = self._claims.get(username, 0) + 1
+        await self.redis.sadd(self._key('user', username), self.worker_id)
+
+    async def release(self, username, client_id):
+        count = self._claims.get(username, 0) - 1
+        if count > 0:
+            self._claims[username] = count
+            return
+        self._claims.pop(username, None)
+        await self.redis.srem(self._key('user', username), self.worker_id)
+
+    async def owners(self, username):
+        workers = [w for w in await self.redis.smembers(self._key('user', username)) if w != self.worker_id]
+        if not workers:
+            return []
+        # 过滤已经退出（存活标记过期）的工作进程
+        alive = await self.redis.mget([self._key('alive', w) for w in workers])
+        return [w for w, flag in zip(workers, alive) if flag]
+
+    async def send(self, worker_id, message):
+        envelope = json.dumps({'from': self.worker_id, 'msg': message}, ensure_ascii=False)
+        receivers = await self.redis.publish(self._key('worker', worker_id), envelope)
+        return receivers > 0
+
+    async def broadcast(self, message):
+        envelope = json.dumps({'from': self.worker_id, 'msg': message}, ensure_ascii=False)
+        await self.redis.publish(self._key('all'), envelope)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        try:
+            for username in list(self._claims):
+                await self.redis.srem(self._key('user', username), self.worker_id)
+            await self.redis.delete(self._key('alive', self.worker_id))
+            await self.pubsub.close()
+            await self.redis.close()
+        except Exception as e:
+            logger.warning("关闭 Redis 路由时出错: %s", e)
+
+
+def create_broker(spec, worker_id):
+    """根据 --broker 参数创建路由后端: local、unix:<路径>、redis://..."""
+    if not spec or spec == 'local':
+        return LocalBroker(worker_id)
+    if spec.startswith('unix:'):
+        return UnixSocketBroker(spec[len('unix:'):], worker_id)
+    if spec.startswith('redis://') or spec.startswith('rediss://'):
+        return RedisBroker(spec, worker_id)
+    raise ValueError(f"不支持的路由后端: {spec}")
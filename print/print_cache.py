@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载文件缓存
+- 按 URL 记录缓存项，文件按内容的 SHA-256 保存，不同 URL 的相同内容只保存一份
+- 缓存项在有效期内直接使用，不访问网络；过期后带 If-None-Match/If-Modified-Since 重新验证，
+  服务器返回 304 时继续使用缓存的文件
+- 有效期按响应的 Cache-Control（max-age、no-cache、no-store）或 Expires 计算，都没有时使用默认有效期
+- 总大小超过上限时按最近使用时间淘汰，最近使用过的文件（可能正在打印）不淘汰
+- 文件和索引都先写入临时文件再 os.replace，进程中断不会留下不完整的缓存
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from print_logging import get_logger
+
+logger = get_logger('print_cache')
+
+INDEX_FILE = 'index.json'
+IN_USE_SECONDS = 300  # 最近这段时间内使用过的文件不淘汰，避免删除正在打印的文件
+
+_MAX_AGE = re.compile(r'max-age\s*=\s*(\d+)')
+
+
+def freshness(cache_control, expires, default_ttl):
+    """根据响应头计算缓存有效期（秒）"""
+    directives = (cache_control or '').lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    match = _MAX_AGE.search(directives)
+    if match:
+        return int(match.group(1))
+    if expires:
+        try:
+            return max(0, parsedate_to_datetime(expires).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 0
+    return default_ttl
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadCache:
+    """下载文件的本地缓存，多个打印任务线程可以同时使用"""
+
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024, default_ttl=86400):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, 'objects')
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.entries = self._load_index()  # url -> {object, size, etag, last_modified, cache_control, expires, expires_at, last_used}
+        self._remove_orphans()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("读取下载缓存索引失败，清空缓存: %s", e)
+            return {}
+        return {url: entry for url, entry in entries.items()
+                if os.path.exists(os.path.join(self.objects_dir, entry['object']))}
+
+    def _save_index(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='index_', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.directory, INDEX_FILE))
+
+    def _remove_orphans(self):
+        """删除索引中没有记录的文件（如写入索引前中断留下的文件和临时文件）"""
+        referenced = {entry['object'] for entry in self.entries.values()}
+        for name in os.listdir(self.objects_dir):
+            if name not in referenced:
+                try:
+                    os.remove(os.path.join(self.objects_dir, name))
+                except OSError:
+                    pass
+
+    def path_for(self, entry):
+        return os.path.join(self.objects_dir, entry['object'])
+
+    def size(self):
+        """缓存文件的总字节数（相同内容只计算一次）"""
+        return sum({entry['object']: entry['size'] for entry in self.entries.values()}.values())
+
+    def fetch(self, url, downloader, report_status=None):
+        """返回 url 对应的本地文件路径：有效期内直接使用缓存，否则重新验证或下载"""
+        report = report_status or (lambda message: logger.info("%s", message))
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None and not os.path.exists(self.path_for(entry)):
+                del self.entries[url]
+                entry = None
+            if entry is not None and time.time() < entry['expires_at']:
+                entry['last_used'] = time.time()
+                self._save_index()
+                report(f"使用缓存的文件: {entry['object']}")
+                return self.path_for(entry)
+            etag = entry.get('etag') if entry else None
+            last_modified = entry.get('last_modified') if entry else None
+
+        # 保留扩展名，Windows 按扩展名选择打印文件的程序
+        suffix = os.path.splitext(urlsplit(url).path)[1][:16]
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_dir, prefix='download_', suffix='.tmp')
+        os.close(fd)
+        try:
+            info = downloader.fetch(url, tmp_path, report, etag=etag, last_modified=last_modified)
+            with self.lock:
+                if info['not_modified'] and entry is not None and os.path.exists(self.path_for(entry)):
+                    # 304 响应没有给出的缓存头沿用上次的
+                    for key in ('etag', 'last_modified', 'cache_control', 'expires'):
+                        entry[key] = info[key] or entry.get(key)
+                    entry['expires_at'] = time.time() + freshness(entry['cache_control'], entry['expires'],
+                                                                  self.default_ttl)
+                    entry['last_used'] = time.time()
+                    self.entries[url] = entry
+                    self._save_index()
+                    report("服务器上的文件未变化，使用缓存的文件")
+                    return self.path_for(entry)
+            if info['not_modified']:
+                # 重新验证期间缓存的文件被淘汰，重新下载
+                info = downloader.fetch(url, tmp_path, report)
+            name = file_digest(tmp_path) + suffix
+            path = os.path.join(self.objects_dir, name)
+            with self.lock:
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, path)
+                now = time.time()
+                previous = self.entries.get(url)
+                self.entries[url] = {
+                    'object': name,
+                    'size': info['size'],
+                    'etag': info['etag'],
+                    'last_modified': info['last_modified'],
+                    'cache_control': info['cache_control'],
+                    'expires': info['expires'],
+                    'expires_at': now + freshness(info['cache_control'], info['expires'], self.default_ttl),
+                    'last_used': now
+                }
+                if previous is not None and previous['object'] != name:
+                    self._release(previous)
+                self._evict()
+                self._save_index()
+            return path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _release(self, entry):
+        """URL 对应的内容已更新：旧文件没有其他 URL 使用且最近没有使用时删除，否则留到下次启动时清理"""
+        if any(other['object'] == entry['object'] for other in self.entries.values()):
+            return
+        if entry['last_used'] >= time.time() - IN_USE_SECONDS:
+            return
+        try:
+            os.remove(self.path_for(entry))
+        except OSError as e:
+            logger.warning("删除缓存文件失败: %s", e)
+
+    def _evict(self):
+        """总大小超过上限时删除最久未使用的文件"""
+        objects = {}  # 文件名 -> (最近使用时间, 大小)
+        for entry in self.entries.values():
+            last_used, _ = objects.get(entry['object'], (0, 0))
+            objects[entry['object']] = (max(last_used, entry['last_used']), entry['size'])
+        total = sum(size for _, size in objects.values())
+        if total <= self.max_bytes:
+            return
+        in_use_since = time.time() - IN_USE_SECONDS
+        for name, (last_used, size) in sorted(objects.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            if last_used >= in_use_since:
+                continue
+            try:
+                os.remove(os.path.join(self.objects_dir, name))
+            except OSError as e:
+                logger.warning("删除缓存文件失败: %s", e)
+                continue
+            total -= size
+            self.entries = {url: entry for url, entry in self.entries.items() if entry['object'] != name}
+            logger.debug("淘汰缓存文件: %s (%s 字节)", name, size)
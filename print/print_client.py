@@ -2,6 +2,12 @@
 # -*- coding: utf-8 -*-
 """
 云打印客户端
+- 收到的打印任务放入任务队列，由若干个工作协程在线程池中执行下载和打印，
+  连接循环（心跳、接收新任务、发送状态）不会被阻塞，多个任务可以同时进行
+- Linux/macOS 上文本内容通过标准输入交给 lpr，未启用下载缓存时文件URL边下载边写入 lpr，不生成临时文件；
+  失败时改用临时文件
+- 一台主机可以管理多台打印机：按任务 settings.printer 路由，每台打印机有单独的先进先出队列和并发数，
+  慢的打印机不会拖慢其他打印机；队列长度和进行中的任务数报告给服务器（client_load）
 """
 
 import asyncio
@@ -14,11 +20,27 @@ import platform
 import configparser
 import subprocess
 import ssl
-import urllib.request
 import tempfile
+import time
+import urllib.parse
 import argparse
+import logging
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from print_logging import setup_logging, get_logger, preview
+from print_protocol import (PROTOCOL_VERSION, MIN_PROTOCOL_VERSION, LOAD_VERSION, MAX_MESSAGE_SIZE, ProtocolError,
+                            decode_message, payload_header)
+from print_downloader import Downloader, DownloadError, DownloadInterrupted
+from print_cache import DownloadCache
+from print_stream import SpoolWriter, StreamError, STREAM_TYPES, DEFAULT_WINDOW
+from print_codec import (WireFormat, decode_frame, available_codecs, available_compression,
+                         CODEC_JSON, COMPRESSION_NONE, DEFAULT_COMPRESS_THRESHOLD)
+
+logger = get_logger('print_client')
+
 # Windows specific imports
 if platform.system() == 'Windows':
     try:
@@ -45,7 +67,7 @@ def register_startup(force=False):
     if not force and config.has_section('print_client') and config['print_client'].get('autostart') == 'true':
         return
 
-    print(f"\n正在配置开机自启 ({system})...")
+    logger.info("正在配置开机自启 (%s)...", system)
     
     try:
         if system == 'Windows':
@@ -53,7 +75,7 @@ def register_startup(force=False):
             key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Run", 0, winreg.KEY_SET_VALUE)
             winreg.SetValueEx(key, "CloudPrintClient", 0, winreg.REG_SZ, f'"{sys.executable}" "{script_path}"')
             winreg.CloseKey(key)
-            print("Windows开机自启设置成功")
+            logger.info("Windows开机自启设置成功")
             
         elif system == 'Linux':
             # Create .desktop file in ~/.config/autostart
@@ -73,7 +95,7 @@ Comment=Start Cloud Print Client
 """
             with open(desktop_file, 'w') as f:
                 f.write(content)
-            print(f"Linux开机自启设置成功: {desktop_file}")
+            logger.info("Linux开机自启设置成功: %s", desktop_file)
             
         elif system == 'Darwin': # macOS
             # Create launch agent plist
@@ -108,7 +130,7 @@ Comment=Start Cloud Print Client
                 subprocess.run(['launchctl', 'load', plist_path], check=False)
             except:
                 pass
-            print(f"macOS开机自启设置成功: {plist_path}")
+            logger.info("macOS开机自启设置成功: %s", plist_path)
             
         # Update config to remember setting
         if not config.has_section('print_client'):
@@ -118,11 +140,43 @@ Comment=Start Cloud Print Client
             config.write(f)
             
     except Exception as e:
-        print(f"设置开机自启失败: {e}")
+        logger.warning("设置开机自启失败: %s", e)
+
+
+# 客户端支持的协议能力，认证时告知服务器
+CLIENT_CAPABILITIES = ['ack', 'envelope', 'stream']
+
+
+# 可以直接通过标准输入交给 lpr 的文件类型（CUPS 按内容识别格式）
+STREAMABLE_EXTENSIONS = ('.pdf', '.ps', '.txt', '.png', '.jpg', '.jpeg')
+
+
+class PrinterQueue:
+    """一台打印机的任务队列：先进先出，最多同时打印 concurrency 个任务，使用单独的线程池"""
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue = asyncio.Queue()
+        self.inflight = 0
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='print_job')
+        self.tasks = []
+
+    def load(self):
+        return {'queued': self.queue.qsize(), 'inflight': self.inflight, 'concurrency': self.concurrency}
+
+    def close(self):
+        """停止工作协程，队列中尚未开始的任务不再处理"""
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False)
 
 
 class PrintClient:
-    def __init__(self, log_callback=None, status_callback=None):
+    def __init__(self, log_callback=None, status_callback=None, dedup_window=1000,
+                 codec=CODEC_JSON, compression=COMPRESSION_NONE, ping_interval=20.0, ping_timeout=20.0,
+                 workers=2, printer_concurrency=None, download_timeout=30.0, download_retries=3,
+                 cache_dir=None, cache_size=500 * 1024 * 1024, cache_ttl=86400):
         self.config_file = os.path.join(os.path.expanduser('~'), '.print_client_config.ini')
         self.username = None
         self.password = None
@@ -139,18 +193,185 @@ class PrintClient:
         self.temp_files = []
         import threading
         self.temp_files_lock = threading.Lock()
+        # 最近处理过的任务（job_id -> 最终结果消息），用于忽略服务器重复投递的任务
+        self.recent_jobs = OrderedDict()
+        self.dedup_window = dedup_window
+        # 服务器签发的会话令牌，重连时代替密码认证
+        self.session_token = None
+        self.session_username = None
+        self.session_expires_at = 0
+        # 进行中的分块传输: job_id -> (缓冲文件, print_begin 消息)
+        self.streams = {}
+        # 希望使用的编码格式（默认 JSON 文本帧，不参与协商）；wire 为本次连接协商的结果
+        self.codec = codec
+        self.compression = compression
+        self.wire = None
+        # 心跳：服务器超时无响应（如网络切换、NAT 超时）时断开并重新连接
+        self.ping_interval = ping_interval or None
+        self.ping_timeout = ping_timeout or None
+        # 服务器重启前建议的重连等待时间（秒），由 server_draining 消息给出
+        self.reconnect_after = None
+        # 每台打印机的任务队列（打印机名称 -> PrinterQueue），队列跨重连保留，结果通过当前连接发送
+        self.workers = max(1, workers)  # 未单独配置的打印机同时处理的任务数
+        self.printer_concurrency = dict(printer_concurrency or {})
+        self.printer_queues = {}
+        self._queue_loop = None
+        self._load_report_pending = False
+        self.websocket = None
+        self.protocol_version = MIN_PROTOCOL_VERSION  # 本次连接协商的协议版本
+        # 文件URL下载：超时、重试和断点续传
+        self.downloader = Downloader(timeout=download_timeout, retries=download_retries)
+        # 下载文件缓存：重复打印同一个文件时不再下载，cache_size 为 0 时不缓存
+        self.download_cache = None
+        if cache_size:
+            cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.print_client_cache')
+            try:
+                self.download_cache = DownloadCache(cache_dir, max_bytes=cache_size, default_ttl=cache_ttl)
+            except OSError as e:
+                self._log("无法使用下载缓存目录 %s: %s", cache_dir, e, level=logging.WARNING)
+
+    def _log(self, message, *args, level=logging.INFO):
+        """通用日志记录方法（延迟格式化），设置了 log_callback 时同时回调"""
+        logger.log(level, message, *args)
+        if self.log_callback and logger.isEnabledFor(level):
+            self.log_callback(message % args if args else message)
 
-    def _log(self, message):
-        """通用日志记录方法"""
-        if self.log_callback:
-            self.log_callback(message)
+    async def send_message(self, websocket, message):
+        """按本次连接协商的编码格式发送消息"""
+        if self.wire is None:
+            await websocket.send(json.dumps(message, ensure_ascii=False))
         else:
-            print(message)
+            await websocket.send(self.wire.encode(message))
+
+    @staticmethod
+    def decode_incoming(message):
+        """解码服务器发来的帧：二进制帧先解压/解码，信封帧的文档内容与头部字段合并"""
+        message = decode_frame(message)
+        if isinstance(message, dict):
+            return message
+        return decode_message(message)
+
+    def reconnect_delay(self, default):
+        """下次重连前等待的秒数：服务器给出建议时使用建议值（只使用一次），否则使用 default"""
+        delay, self.reconnect_after = self.reconnect_after, None
+        return default if delay is None else delay
+
+    def wire_offer(self):
+        """认证时提供的编码格式偏好，使用默认格式时不提供"""
+        if self.codec == CODEC_JSON and self.compression == COMPRESSION_NONE:
+            return {}
+        return {'codecs': [self.codec, CODEC_JSON], 'compression': [self.compression, COMPRESSION_NONE]}
+
+    def apply_wire(self, response_data):
+        """按认证回复中服务器选择的编码格式设置本次连接"""
+        codec = response_data.get('codec', CODEC_JSON)
+        compression = response_data.get('compression', COMPRESSION_NONE)
+        self.wire = None
+        if codec == CODEC_JSON and compression == COMPRESSION_NONE:
+            return
+        try:
+            self.wire = WireFormat(codec, compression,
+                                   response_data.get('compress_threshold', DEFAULT_COMPRESS_THRESHOLD))
+            self._log("使用编码 %s，压缩 %s", codec, compression, level=logging.DEBUG)
+        except ValueError as e:
+            self._log("服务器选择的编码格式不可用: %s，使用 JSON", e, level=logging.WARNING)
+
+    def printer_for(self, settings):
+        """任务使用的打印机：settings.printer 指定时使用该打印机，否则使用默认打印机"""
+        return settings.get('printer') or self.printer_name
+
+    def printer_queue(self, printer):
+        """获取打印机的任务队列，第一次使用时在当前事件循环中创建队列和工作协程"""
+        loop = asyncio.get_event_loop()
+        if self._queue_loop is not loop:
+            # GUI 重启服务时换用新的事件循环，原有队列随旧的事件循环失效
+            for queue in self.printer_queues.values():
+                queue.close()
+            self.printer_queues = {}
+            self._queue_loop = loop
+        queue = self.printer_queues.get(printer)
+        if queue is None:
+            queue = PrinterQueue(printer, self.printer_concurrency.get(printer, self.workers))
+            queue.tasks = [loop.create_task(self.job_worker(queue)) for _ in range(queue.concurrency)]
+            self.printer_queues[printer] = queue
+        return queue
+
+    def submit_job(self, job_id, printer, run):
+        """把打印任务放入打印机的队列；run 为同步函数，参数为状态回调，返回 (是否成功, 结果消息)"""
+        queue = self.printer_queue(printer)
+        queue.queue.put_nowait((job_id, run))
+        if queue.inflight >= queue.concurrency:
+            self._log("打印机 %s 正忙，任务 %s 排队等待（队列中 %s 个）", printer, job_id, queue.queue.qsize())
+        self.schedule_load_report()
+
+    async def job_worker(self, queue):
+        """工作协程：依次从打印机的队列取出任务，在线程池中执行，状态和结果发回服务器"""
+        loop = asyncio.get_event_loop()
+        while True:
+            job_id, run = await queue.queue.get()
+            queue.inflight += 1
+            self.schedule_load_report()
+            try:
+                def status_callback(msg, job_id=job_id):
+                    # 在线程池中调用，转交给事件循环发送
+                    loop.call_soon_threadsafe(
+                        asyncio.ensure_future, self.report({'type': 'print_status', 'job_id': job_id, 'message': msg}))
+
+                try:
+                    success, result_msg = await loop.run_in_executor(queue.executor, run, status_callback)
+                except Exception as e:
+                    success, result_msg = False, str(e)
+                self._log("打印结果: %s - %s", '成功' if success else '失败', result_msg)
+                result = {
+                    'type': 'print_queued' if success else 'error',
+                    'job_id': job_id,
+                    'message': result_msg
+                }
+                if job_id in self.recent_jobs:
+                    self._remember_job(job_id, result)
+                await self.report(result)
+            finally:
+                queue.inflight -= 1
+                queue.queue.task_done()
+                self.schedule_load_report()
+
+    async def stop_workers(self):
+        """退出前停止所有打印机的工作协程，队列中尚未开始的任务不再处理"""
+        queues, self.printer_queues = list(self.printer_queues.values()), {}
+        for queue in queues:
+            queue.close()
+        await asyncio.gather(*(task for queue in queues for task in queue.tasks), return_exceptions=True)
+
+    def schedule_load_report(self):
+        """队列变化后报告负载；同一轮事件循环内的多次变化合并为一条消息"""
+        if self._load_report_pending or self.websocket is None or self.protocol_version < LOAD_VERSION:
+            return
+        self._load_report_pending = True
+        asyncio.ensure_future(self.report_load())
+
+    async def report_load(self):
+        """报告每台打印机的队列长度和进行中的任务数，服务器据此分配指定打印机的任务"""
+        self._load_report_pending = False
+        await self.report({
+            'type': 'client_load',
+            'printers': {name: queue.load() for name, queue in self.printer_queues.items() if name}
+        })
+
+    async def report(self, message):
+        """通过当前连接发送任务状态或结果；断开期间不发送，最终结果已记录，服务器重复投递时再次发送"""
+        websocket = self.websocket
+        if websocket is None:
+            self._log("连接已断开，未发送 %s: %s", message['type'], message.get('job_id'), level=logging.DEBUG)
+            return
+        try:
+            await self.send_message(websocket, message)
+        except Exception as e:
+            self._log("发送状态更新失败: %s", e, level=logging.WARNING)
 
     def clean_temp_files(self):
         """清理临时文件（包括当前会话和历史遗留）"""
         temp_dir = os.environ.get('TEMP') or os.environ.get('TMPDIR') or '/tmp'
-        self._log(f"正在扫描临时目录: {temp_dir}")
+        self._log("正在扫描临时目录: %s", temp_dir)
         
         # 1. 获取当前会话记录的文件（线程安全）
         with self.temp_files_lock:
@@ -166,7 +387,7 @@ class PrintClient:
                     if full_path not in session_files:
                         historical_files.append(full_path)
         except Exception as e:
-            self._log(f"扫描历史临时文件失败: {e}")
+            self._log("扫描历史临时文件失败: %s", e, level=logging.WARNING)
 
         all_to_clean = list(session_files) + historical_files
         
@@ -174,7 +395,7 @@ class PrintClient:
             self._log("没有需要清理的临时文件")
             return 0
         
-        self._log(f"发现 {len(all_to_clean)} 个临时文件，正在清理...")
+        self._log("发现 %s 个临时文件，正在清理...", len(all_to_clean))
         cleaned_count = 0
         for file_path in all_to_clean:
             try:
@@ -186,18 +407,25 @@ class PrintClient:
                     if file_path in self.temp_files:
                         self.temp_files.remove(file_path)
             except Exception as e:
-                self._log(f"删除失败 {file_path}: {e}")
+                self._log("删除失败 %s: %s", file_path, e, level=logging.WARNING)
         
-        self._log(f"清理完成，共删除 {cleaned_count} 个文件")
+        self._log("清理完成，共删除 %s 个文件", cleaned_count)
         return cleaned_count
 
+    def _remember_job(self, job_id, result=None):
+        """记录已处理的任务，超出窗口大小时淘汰最早的记录"""
+        self.recent_jobs[job_id] = result
+        self.recent_jobs.move_to_end(job_id)
+        while len(self.recent_jobs) > self.dedup_window:
+            self.recent_jobs.popitem(last=False)
+
     def load_config(self):
         if os.path.exists(self.config_file):
             try:
                 with open(self.config_file, 'r', encoding='utf-8') as f:
                     self.config.read_file(f)
             except Exception as e:
-                self._log(f"读取配置文件失败: {e}")
+                self._log("读取配置文件失败: %s", e, level=logging.WARNING)
             if 'print_client' in self.config:
                 self.username = self.config['print_client'].get('username')
                 self.password = self.config['print_client'].get('password')
@@ -227,7 +455,7 @@ class PrintClient:
         self.username = username
         self.password = password
         self.save_config()
-        self._log(f"用户凭证已设置: {username}")
+        self._log("用户凭证已设置: %s", username)
 
     def get_printers(self):
         """获取系统可用打印机列表"""
@@ -237,7 +465,7 @@ class PrintClient:
                 printers = [printer[2] for printer in
                             win32print.EnumPrinters(win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS)]
             except Exception as e:
-                self._log(f"获取打印机列表失败: {e}")
+                self._log("获取打印机列表失败: %s", e, level=logging.WARNING)
         elif platform.system() in ('Darwin', 'Linux'):
             try:
                 result = subprocess.run(['lpstat', '-p'], capture_output=True, text=True)
@@ -247,7 +475,15 @@ class PrintClient:
                         printer_name = line.split(' ')[1]
                         printers.append(printer_name)
             except Exception as e:
-                self._log(f"获取打印机列表失败: {e}")
+                self._log("获取打印机列表失败: %s", e, level=logging.WARNING)
+        return printers
+
+    async def advertised_printers(self):
+        """认证时上报的打印机列表（已选择的打印机在前），查询在线程池中执行"""
+        loop = asyncio.get_event_loop()
+        printers = await loop.run_in_executor(None, self.get_printers)
+        if self.printer_name:
+            printers = [self.printer_name] + [name for name in printers if name != self.printer_name]
         return printers
 
     def select_printer(self):
@@ -265,7 +501,7 @@ class PrintClient:
                 if 1 <= choice <= len(printers):
                     self.printer_name = printers[choice - 1]
                     self.save_config()
-                    self._log(f"已选择打印机: {self.printer_name}")
+                    self._log("已选择打印机: %s", self.printer_name)
                     break
                 else:
                     print("错误: 无效的选择")
@@ -274,13 +510,13 @@ class PrintClient:
 
     def set_server_url(self):
         """设置服务器地址"""
-        self._log(f"\n当前服务器地址: {self.server_url or 'wss://print.yhsun.cn'}")
+        self._log("\n当前服务器地址: %s", self.server_url or 'wss://print.yhsun.cn')
         print("输入新的服务器地址（例如 ws://localhost:8770 或 wss://print.yhsun.cn）")
         new_url = input("请输入服务器地址（留空保持当前值）: ").strip()
         if new_url:
             self.server_url = new_url
             self.save_config()
-            self._log(f"服务器地址已设置为: {self.server_url}")
+            self._log("服务器地址已设置为: %s", self.server_url)
         else:
             self._log("保持当前服务器地址不变")
     
@@ -314,12 +550,13 @@ class PrintClient:
             if status_callback:
                 status_callback(msg)
 
-        if not self.printer_name:
+        printer = self.printer_for(settings)
+        if not printer:
             error_msg = "未配置打印机，请先在客户端设置中选择打印机"
             report_status(f"打印失败: {error_msg}")
             return False, error_msg
         
-        report_status(f"开始打印到打印机: {self.printer_name}")
+        report_status(f"开始打印到打印机: {printer}")
         report_status(f"打印设置: {json.dumps(settings, ensure_ascii=False)}")
 
         try:
@@ -348,6 +585,41 @@ class PrintClient:
             report_status(f"打印失败: {error_detail}")
             return False, error_detail
 
+    def print_file(self, file_path, settings, status_callback=None):
+        """打印本地文件（分块传输写入的缓冲文件）"""
+        def report_status(msg):
+            self._log(msg)
+            if status_callback:
+                status_callback(msg)
+
+        printer = self.printer_for(settings)
+        if not printer:
+            error_msg = "未配置打印机，请先在客户端设置中选择打印机"
+            report_status(f"打印失败: {error_msg}")
+            return False, error_msg
+
+        try:
+            report_status(f"开始打印文件: {file_path} ({os.path.getsize(file_path)} 字节) 到打印机: {printer}")
+            self._print_local_file(file_path, report_status, printer)
+            success_msg = "打印任务已成功提交到系统打印队列"
+            report_status(success_msg)
+            return True, success_msg
+        except Exception as e:
+            error_detail = str(e)
+            report_status(f"打印失败: {error_detail}")
+            return False, error_detail
+
+    def _print_local_file(self, file_path, report_status, printer):
+        """按系统平台打印已经在本地的文件"""
+        if platform.system() == 'Windows':
+            # 在Windows上使用默认应用程序打印
+            report_status(f"在Windows上打印文件: {file_path}")
+            os.startfile(file_path, "print")
+        elif platform.system() in ('Darwin', 'Linux'):
+            # 在Unix系统上使用lpr命令打印
+            report_status(f"在 {platform.system()} 上打印文件: {file_path} 到打印机: {printer}")
+            subprocess.run(['lpr', '-P', printer, file_path], check=True)
+
     def _print_windows(self, content, settings):
         """Windows打印实现"""
 
@@ -368,18 +640,18 @@ class PrintClient:
             # 尝试使用os.startfile
             os.startfile(temp_file, "print")
         except Exception as e:
-            self._log(f"os.startfile 失败: {e}")
+            self._log("os.startfile 失败: %s", e, level=logging.WARNING)
             try:
                 # 尝试使用subprocess.run
                 subprocess.run(['start', 'print', temp_file], shell=True, check=True)
             except Exception as e:
-                self._log(f"subprocess.run 失败: {e}")
+                self._log("subprocess.run 失败: %s", e, level=logging.WARNING)
                 try:
                     # 尝试使用默认文本编辑器打开文本文件
                     self._log("尝试使用默认文本编辑器打开文本文件")
                     win32api.ShellExecute(0, "open", temp_file, None, ".", 1)
                 except Exception as e:
-                    self._log(f"打开文件失败: {e}")
+                    self._log("打开文件失败: %s", e, level=logging.WARNING)
 
     def _print_file_url(self, file_url, settings, report_status=None):
         """打印文件URL"""
@@ -387,6 +659,15 @@ class PrintClient:
         if not report_status:
             report_status = self._log
 
+        if self.download_cache is not None:
+            cached_path = self.download_cache.fetch(file_url, self.downloader, report_status)
+            self._print_local_file(cached_path, report_status, self.printer_for(settings))
+            report_status(f"文件打印成功: {cached_path}")
+            return
+
+        if platform.system() in ('Darwin', 'Linux') and self._stream_url_to_lpr(file_url, settings, report_status):
+            return
+
         report_status(f"正在下载文件: {file_url}")
 
         # 获取文件扩展名
@@ -405,7 +686,7 @@ class PrintClient:
         try:
             # 下载文件
             report_status(f"开始下载文件: {file_url} 到 {temp_file_path}")
-            urllib.request.urlretrieve(file_url, temp_file_path)
+            self.downloader.download(file_url, temp_file_path, report_status)
             report_status(f"文件已下载到: {temp_file_path}")
 
             # 检查文件是否下载成功
@@ -415,14 +696,7 @@ class PrintClient:
             report_status(f"下载的文件大小: {os.path.getsize(temp_file_path)} 字节")
 
             # 根据系统平台打印文件
-            if platform.system() == 'Windows':
-                # 在Windows上使用默认应用程序打印
-                report_status(f"在Windows上打印文件: {temp_file_path}")
-                os.startfile(temp_file_path, "print")
-            elif platform.system() in ('Darwin', 'Linux'):
-                # 在Unix系统上使用lpr命令打印
-                report_status(f"在 {platform.system()} 上打印文件: {temp_file_path} 到打印机: {self.printer_name}")
-                subprocess.run(['lpr', '-P', self.printer_name, temp_file_path], check=True)
+            self._print_local_file(temp_file_path, report_status, self.printer_for(settings))
 
             report_status(f"文件打印成功: {temp_file_path}")
             report_status(f"临时文件已保留: {temp_file_path}")
@@ -433,8 +707,61 @@ class PrintClient:
             # 重新抛出异常，让调用者知道下载失败
             raise
 
+    def _stream_url_to_lpr(self, file_url, settings, report_status):
+        """边下载边写入 lpr 的标准输入，返回是否已提交；中断时终止 lpr（不会提交不完整的任务），
+        由调用方改用临时文件下载（支持重试和断点续传）
+        """
+        extension = os.path.splitext(urllib.parse.urlsplit(file_url).path)[1].lower()
+        if extension not in STREAMABLE_EXTENSIONS:
+            return False
+        printer = self.printer_for(settings)
+        report_status(f"正在下载文件并直接提交到打印机: {printer}")
+        try:
+            process = subprocess.Popen(['lpr', '-P', printer], stdin=subprocess.PIPE)
+        except OSError as e:
+            self._log("无法启动 lpr: %s，改用临时文件", e, level=logging.WARNING)
+            return False
+        try:
+            self.downloader.stream(file_url, process.stdin, report_status)
+        except BaseException as e:
+            self._kill_lpr(process)
+            if isinstance(e, (DownloadInterrupted, OSError)):
+                report_status(f"直接提交中断: {e}，改用临时文件下载")
+                return False
+            raise
+        try:
+            # 内容完整后才关闭标准输入，lpr 收到 EOF 后提交任务
+            process.stdin.close()
+        except OSError as e:
+            self._kill_lpr(process)
+            report_status(f"直接提交中断: {e}，改用临时文件下载")
+            return False
+        returncode = process.wait()
+        if returncode != 0:
+            report_status(f"lpr 返回错误 ({returncode})，改用临时文件下载")
+            return False
+        report_status("文件已提交到打印队列")
+        return True
+
+    @staticmethod
+    def _kill_lpr(process):
+        """终止 lpr 后再关闭标准输入：先关闭会让 lpr 收到 EOF，把不完整的内容提交为打印任务"""
+        process.kill()
+        process.wait()
+        try:
+            process.stdin.close()
+        except OSError:
+            # 缓冲区中未写出的内容无法再写入已退出的进程
+            pass
+
     def _print_unix(self, content, settings):
-        """Unix-like系统打印实现"""
+        """Unix-like系统打印实现：文本通过标准输入交给 lpr，失败时改用临时文件"""
+        try:
+            subprocess.run(['lpr', '-P', self.printer_for(settings)], input=content.encode('utf-8'), check=True)
+            return
+        except (OSError, subprocess.CalledProcessError) as e:
+            self._log("通过标准输入提交打印任务失败: %s，改用临时文件", e, level=logging.WARNING)
+
         # 临时文件路径
         temp_file = os.path.join('/tmp', f'print_{datetime.now().timestamp()}')
 
@@ -451,74 +778,153 @@ class PrintClient:
         with self.temp_files_lock:
             self.temp_files.append(temp_file)
         
-        self._log(f"正在打印文件: {temp_file}")
-        subprocess.run(['lpr', '-P', self.printer_name, temp_file], check=True)
+        self._log("正在打印文件: %s", temp_file)
+        subprocess.run(['lpr', '-P', self.printer_for(settings), temp_file], check=True)
+
+    async def handle_stream_message(self, websocket, data):
+        """处理分块传输：分块依次写入缓冲文件，每写入一块归还一个发送额度，结束后打印该文件"""
+        message_type = data['type']
+        job_id = data.get('job_id')
+
+        async def send(message):
+            await self.send_message(websocket, message)
+
+        if message_type == 'print_begin':
+            file_name = data.get('file_name') or ''
+            suffix = os.path.splitext(file_name)[1] or '.txt'
+            try:
+                writer = SpoolWriter(job_id, suffix=suffix, encoding=data.get('encoding', 'utf-8'), size=data.get('size'))
+            except StreamError as e:
+                await send({'type': 'error', 'job_id': job_id, 'message': e.message})
+                return
+            with self.temp_files_lock:
+                self.temp_files.append(writer.path)
+            self.streams[job_id] = (writer, data)
+            self._log("开始接收分块传输的文档: %s -> %s", job_id, writer.path)
+            await send({'type': 'print_credit', 'job_id': job_id, 'credits': DEFAULT_WINDOW})
+            return
+
+        stream = self.streams.get(job_id)
+        if stream is None:
+            if message_type != 'print_abort':
+                await send({'type': 'error', 'job_id': job_id, 'message': '没有进行中的分块传输'})
+            return
+        writer, begin = stream
+
+        if message_type == 'print_abort':
+            del self.streams[job_id]
+            writer.discard()
+            self._log("分块传输 %s 已取消: %s", job_id, data.get('message'))
+            return
+
+        try:
+            if message_type == 'print_chunk':
+                writer.write(data['seq'], data.get('data') or '')
+                await send({'type': 'print_credit', 'job_id': job_id, 'credits': 1})
+                return
+            # print_end
+            del self.streams[job_id]
+            path = writer.finish(data['chunks'], data.get('size'))
+        except StreamError as e:
+            self.streams.pop(job_id, None)
+            writer.discard()
+            await send({'type': 'error', 'job_id': job_id, 'message': e.message})
+            return
+
+        self._log("✅ 文档接收完成: %s (%s 字节)，加入打印队列", job_id, writer.written)
+        settings = dict(begin.get('settings') or {})
+        if begin.get('printer'):
+            settings['printer'] = begin['printer']
+        self.submit_job(job_id, self.printer_for(settings), functools.partial(self.print_file, path, settings))
+
+    def discard_streams(self):
+        """连接断开时删除未完成的缓冲文件"""
+        for writer, _ in self.streams.values():
+            writer.discard()
+        self.streams.clear()
 
     async def handle_connection(self, websocket):
         """处理WebSocket连接（消息监听循环）"""
         self.connected = True
+        self.websocket = websocket
+        if self.printer_queues:
+            # 重连前留在队列中的任务
+            self.schedule_load_report()
         self._log("=== 开始监听打印任务...")
         try:
             async for message in websocket:
-                self._log(f"=== 收到来自服务器的消息！ ===")
+                self._log("=== 收到来自服务器的消息！ ===", level=logging.DEBUG)
                 try:
-                    data = json.loads(message)
-                    self._log(f"消息类型: {data.get('type')}")
-                    self._log(f"完整消息内容: {data}")
-                    
-                    if data.get('type') == 'print_request':
+                    # 信封帧的文档内容与头部字段合并
+                    data = self.decode_incoming(message)
+                    self._log("消息类型: %s", data.get('type'), level=logging.DEBUG)
+                    self._log("完整消息内容: %s", preview(data), level=logging.DEBUG)
+
+                    if data.get('type') in STREAM_TYPES:
+                        await self.handle_stream_message(websocket, data)
+                    elif data.get('type') == 'server_draining':
+                        # 服务器即将重启，按建议的随机延迟重连，避免所有客户端同时重连
+                        self.reconnect_after = data.get('reconnect_after')
+                        self._log("服务器正在重启，%s 秒后重新连接", self.reconnect_after)
+                    elif data.get('type') == 'print_request':
+                        job_id = data.get('job_id', 'unknown')
+                        if 'job_id' in data:
+                            # 确认收到任务，服务器据此停止重新投递
+                            await self.send_message(websocket, {
+                                'type': 'print_ack',
+                                'job_id': job_id
+                            })
+                            if job_id in self.recent_jobs:
+                                self._log("任务 %s 已处理过，忽略重复投递", job_id)
+                                previous_result = self.recent_jobs[job_id]
+                                if previous_result:
+                                    await self.send_message(websocket, previous_result)
+                                continue
+                            self._remember_job(job_id)
+
                         self._log("✅ 收到打印请求！开始处理...")
                         content = data.get('content', '')
                         settings = data.get('settings', {})
-                        job_id = data.get('job_id', 'unknown')
                         
                         # 添加content_type到settings中
                         if 'content_type' in data:
                             settings['content_type'] = data['content_type']
+                        # 请求中指定的打印机，没有指定时使用默认打印机
+                        if data.get('printer'):
+                            settings['printer'] = data['printer']
                         
-                        # 定义一个内部回调函数，用于发送状态更新回服务器
-                        async def send_status(msg):
-                            await websocket.send(json.dumps({
-                                'type': 'print_status',
-                                'job_id': job_id,
-                                'message': msg
-                            }, ensure_ascii=False))
-
-                        self._log(f"准备打印内容: {content[:50]}...")
-                        
-                        # 同步调用打印逻辑，传入发送状态的回调
-                        # 注意：print_content 是同步的，但我们可以通过线程安全的方式或者简单的同步回调
-                        # 为了在同步代码中调用异步 websocket.send，我们需要一个特殊的处理
-                        
-                        def sync_status_callback(msg):
-                            # 使用 asyncio.get_event_loop().create_task 在异步循环中执行发送
-                            try:
-                                loop = asyncio.get_event_loop()
-                                if loop.is_running():
-                                    loop.create_task(send_status(msg))
-                            except Exception as e:
-                                self._log(f"发送状态更新失败: {e}")
-
-                        success, result_msg = self.print_content(content, settings, sync_status_callback)
-                        
-                        self._log(f"打印结果: {'成功' if success else '失败'} - {result_msg}")
-                        await websocket.send(json.dumps({
-                            'type': 'print_queued' if success else 'error',
-                            'job_id': job_id,
-                            'message': result_msg
-                        }, ensure_ascii=False))
+                        self._log("准备打印内容: %s", preview(content, limit=50), level=logging.DEBUG)
+                        # 下载和打印在线程池中执行，状态更新和结果由工作协程发送
+                        self.submit_job(job_id, self.printer_for(settings),
+                                        functools.partial(self.print_content, content, settings))
                 except json.JSONDecodeError:
-                    self._log("错误: 无效的JSON数据")
+                    self._log("错误: 无效的JSON数据", level=logging.WARNING)
+                except ProtocolError as e:
+                    # 信封帧的消息体试图覆盖路由字段：拒绝该任务，带上头部的 job_id 让服务器结束它
+                    self._log("拒绝消息: %s", e.message, level=logging.WARNING)
+                    reply = {'type': 'error', 'code': e.code, 'message': e.message}
+                    try:
+                        job_id = payload_header(decode_frame(message)).get('job_id')
+                    except (ProtocolError, ValueError):
+                        job_id = None
+                    if job_id is not None:
+                        # 先确认收到，服务器删除未确认记录，重连后不再重复投递
+                        await self.send_message(websocket, {'type': 'print_ack', 'job_id': job_id})
+                        reply['job_id'] = job_id
+                    await self.send_message(websocket, reply)
                 except Exception as e:
-                    self._log(f"处理消息时出错: {str(e)}")
-                    await websocket.send(json.dumps({
+                    self._log("处理消息时出错: %s", e, level=logging.WARNING)
+                    await self.send_message(websocket, {
                         'type': 'error',
                         'message': str(e)
-                    }, ensure_ascii=False))
+                    })
         except Exception as e:
-            self._log(f"连接错误: {str(e)}")
+            self._log("连接错误: %s", e, level=logging.WARNING)
         finally:
             self.connected = False
+            if self.websocket is websocket:
+                self.websocket = None
+            self.discard_streams()
             self._log("客户端已断开连接")
             if self.status_callback:
                 self.status_callback(False, "连接已断开")
@@ -526,26 +932,28 @@ class PrintClient:
     async def connect_and_listen(self):
         """连接到服务器，认证成功后持续监听"""
         server_url = self.server_url or "wss://print.yhsun.cn"
-        self._log(f"正在尝试建立连接: {server_url}")
+        self._log("正在尝试建立连接: %s", server_url)
         try:
             # 判断是否需要使用 SSL
             use_ssl = server_url.startswith('wss://')
             
             if use_ssl:
-                self._log("正在初始化 SSL 上下文...")
+                self._log("正在初始化 SSL 上下文...", level=logging.DEBUG)
                 ssl_context = ssl.create_default_context()
                 ssl_context.check_hostname = False
                 ssl_context.verify_mode = ssl.CERT_NONE
-                self._log("正在发起 WSS 连接请求...")
+                self._log("正在发起 WSS 连接请求...", level=logging.DEBUG)
                 websocket = await asyncio.wait_for(
-                    websockets.connect(server_url, ssl=ssl_context),
+                    websockets.connect(server_url, ssl=ssl_context, ping_interval=self.ping_interval,
+                                       ping_timeout=self.ping_timeout, max_size=MAX_MESSAGE_SIZE),
                     timeout=15
                 )
             else:
-                self._log("正在发起 WS 连接请求...")
+                self._log("正在发起 WS 连接请求...", level=logging.DEBUG)
                 # 连接本地服务器，不使用 SSL
                 websocket = await asyncio.wait_for(
-                    websockets.connect(server_url),
+                    websockets.connect(server_url, ping_interval=self.ping_interval,
+                                       ping_timeout=self.ping_timeout, max_size=MAX_MESSAGE_SIZE),
                     timeout=15
                 )
             
@@ -555,17 +963,35 @@ class PrintClient:
             auth_data = {
                 'type': 'client_auth',
                 'username': self.username,
-                'password': self.password,
-                'client_id': client_id
+                'client_id': client_id,
+                'capabilities': CLIENT_CAPABILITIES,
+                'protocol_version': PROTOCOL_VERSION,
+                # 同一账号有多台打印客户端时，服务器按打印机和负载分配任务
+                'printers': await self.advertised_printers()
             }
-            self._log(f"正在发送认证请求 (用户: {self.username})...")
-            await websocket.send(json.dumps(auth_data, ensure_ascii=False))
+            auth_data.update(self.wire_offer())
+            self.wire = None
+            # 令牌未过期时不再发送密码
+            use_token = (self.session_token is not None and self.session_username == self.username
+                         and time.time() < self.session_expires_at - 60)
+            if use_token:
+                auth_data['token'] = self.session_token
+            else:
+                auth_data['password'] = self.password
+            self._log("正在发送认证请求 (用户: %s)...", self.username)
+            await self.send_message(websocket, auth_data)
             
-            self._log("正在等待服务器响应认证结果...")
+            self._log("正在等待服务器响应认证结果...", level=logging.DEBUG)
             response = await asyncio.wait_for(websocket.recv(), timeout=10)
-            response_data = json.loads(response)
+            response_data = self.decode_incoming(response)
             
             if response_data.get('type') == 'auth_success':
+                if response_data.get('token'):
+                    self.session_token = response_data['token']
+                    self.session_username = self.username
+                    self.session_expires_at = time.time() + response_data.get('expires_in', 0)
+                self.apply_wire(response_data)
+                self.protocol_version = response_data.get('protocol_version', MIN_PROTOCOL_VERSION)
                 self._log("✅ 身份认证成功！已开启实时监听模式")
                 if self.status_callback:
                     self.status_callback(True, "已连接")
@@ -574,13 +1000,18 @@ class PrintClient:
                 return True
             else:
                 error_msg = response_data.get('message', '未知错误')
-                self._log(f"❌ 认证被服务器拒绝: {error_msg}")
+                self._log("❌ 认证被服务器拒绝: %s", error_msg, level=logging.WARNING)
+                if use_token:
+                    # 令牌失效（例如服务器重启更换了密钥），立即改用密码重新认证
+                    self.session_token = None
+                    await websocket.close()
+                    return await self.connect_and_listen()
                 return False
         except asyncio.TimeoutError:
-            self._log("❌ 连接过程超时 (请检查网络状况或服务器地址是否正确)")
+            self._log("❌ 连接过程超时 (请检查网络状况或服务器地址是否正确)", level=logging.WARNING)
             return False
         except Exception as e:
-            self._log(f"❌ 连接发生异常: {str(e)}")
+            self._log("❌ 连接发生异常: %s", e, level=logging.WARNING)
             # self._log(traceback.format_exc())
             return False
 
@@ -609,13 +1040,15 @@ class PrintClient:
                 try:
                     result = self.listen_task.result()
                     if result is False:
-                        print("连接失败，5秒后将尝试重新连接...")
+                        logger.warning("连接失败，5秒后将尝试重新连接...")
                         await asyncio.sleep(5)
+                    else:
+                        await asyncio.sleep(self.reconnect_delay(0))
                 except asyncio.CancelledError:
                     # 可能被用户取消，忽略
                     pass
                 except Exception as e:
-                    print(f"监听任务异常: {e}，5秒后重试...")
+                    logger.warning("监听任务异常: %s，5秒后重试...", e)
                     await asyncio.sleep(5)
                 # 继续循环，重新创建连接任务
                 continue
@@ -630,6 +1063,7 @@ class PrintClient:
                         await self.listen_task
                     except asyncio.CancelledError:
                         pass
+                    await self.stop_workers()
                     break
                 elif user_input == "":
                     # 用户按下回车，进入配置修改模式
@@ -659,12 +1093,24 @@ class PrintClient:
             await self.input_listener()
         except asyncio.CancelledError:
             # 处理Ctrl+C等取消
+            await self.stop_workers()
             if self.listen_task and not self.listen_task.done():
                 self.listen_task.cancel()
                 await self.listen_task
             raise
 
 
+def parse_concurrency(values):
+    """解析 打印机=任务数 形式的参数"""
+    concurrency = {}
+    for value in values:
+        name, sep, count = value.rpartition('=')
+        if not sep or not name or not count.isdigit():
+            raise SystemExit(f"无效的打印机并发数设置: {value}（格式为 打印机=任务数）")
+        concurrency[name] = int(count)
+    return concurrency
+
+
 async def main():
     print("=== 云打印客户端 ===")
     
@@ -672,7 +1118,24 @@ async def main():
     parser = argparse.ArgumentParser(description='云打印客户端')
     parser.add_argument('--server', type=str, help='打印服务器地址 (例如: ws://localhost:8770)')
     parser.add_argument('--local', action='store_true', help='使用本地服务器 (ws://localhost:8770)')
+    parser.add_argument('--log-level', type=str, default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='日志级别')
+    parser.add_argument('--codec', type=str, default=CODEC_JSON, choices=available_codecs(),
+                        help='希望使用的消息编码（服务器不支持时使用 json）')
+    parser.add_argument('--compression', type=str, default=COMPRESSION_NONE, choices=available_compression(),
+                        help='希望使用的压缩方式（服务器不支持时不压缩）')
+    parser.add_argument('--ping-interval', type=float, default=20.0, help='心跳间隔（秒），0 表示不发送心跳')
+    parser.add_argument('--ping-timeout', type=float, default=20.0, help='心跳超时（秒），超时后断开并重新连接')
+    parser.add_argument('--workers', type=int, default=2, help='每台打印机同时处理的任务数')
+    parser.add_argument('--download-timeout', type=float, default=30.0, help='下载文件时连接和读取的超时（秒）')
+    parser.add_argument('--download-retries', type=int, default=3, help='下载失败后的最多重试次数')
+    parser.add_argument('--cache-size', type=float, default=500, help='下载文件缓存的大小上限（MB），0 表示不缓存')
+    parser.add_argument('--cache-ttl', type=float, default=86400,
+                        help='服务器没有给出缓存时间时，缓存文件无需重新验证的时间（秒）')
+    parser.add_argument('--printer-concurrency', action='append', default=[], metavar='打印机=任务数',
+                        help='单独设置某台打印机同时处理的任务数，可重复')
     args = parser.parse_args()
+    setup_logging(args.log_level, fmt='%(asctime)s %(levelname)s %(message)s')
     
     # 检查wkhtmltopdf (已废弃，无需检查)
     # check_wkhtmltopdf()
@@ -705,7 +1168,11 @@ async def main():
         # 已配置且为true，确保注册
         register_startup(force=False)
     
-    client = PrintClient()
+    client = PrintClient(codec=args.codec, compression=args.compression,
+                         ping_interval=args.ping_interval, ping_timeout=args.ping_timeout,
+                         workers=args.workers, printer_concurrency=parse_concurrency(args.printer_concurrency),
+                         download_timeout=args.download_timeout, download_retries=args.download_retries,
+                         cache_size=int(args.cache_size * 1024 * 1024), cache_ttl=args.cache_ttl)
     
     # 处理命令行参数
     if args.local:
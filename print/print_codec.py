@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印服务消息编码
+- 默认使用 UTF-8 JSON 文本帧，与旧版本完全兼容
+- 连接可以协商 MessagePack 编码，以及超过阈值时使用 deflate/zstd 压缩
+- 非默认格式使用二进制帧，首字节标识编码（高 4 位）和压缩方式（低 4 位），
+  接收方按首字节解码，因此不同格式的帧可以混用（如转发的任务保持 JSON 文本只做压缩）
+- msgpack 和 zstandard 为可选依赖，未安装时不参与协商
+"""
+
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from print_protocol import ProtocolError
+
+
+CODEC_JSON = 'json'
+CODEC_MSGPACK = 'msgpack'
+COMPRESSION_NONE = 'none'
+COMPRESSION_DEFLATE = 'deflate'
+COMPRESSION_ZSTD = 'zstd'
+
+DEFAULT_COMPRESS_THRESHOLD = 1024  # 编码后小于该字节数的消息不压缩
+MAX_DECODED_SIZE = 64 * 1024 * 1024  # 解压后的最大字节数，防止压缩炸弹
+
+_CODEC_IDS = {CODEC_JSON: 0, CODEC_MSGPACK: 1}
+_COMPRESSION_IDS = {COMPRESSION_NONE: 0, COMPRESSION_DEFLATE: 1, COMPRESSION_ZSTD: 2}
+
+
+def available_codecs():
+    """当前环境可用的编码"""
+    return [CODEC_JSON] + ([CODEC_MSGPACK] if msgpack is not None else [])
+
+
+def available_compression():
+    """当前环境可用的压缩方式"""
+    return [COMPRESSION_NONE, COMPRESSION_DEFLATE] + ([COMPRESSION_ZSTD] if zstandard is not None else [])
+
+
+class WireFormat:
+    """一个连接协商后的编码与压缩方式"""
+
+    def __init__(self, codec=CODEC_JSON, compression=COMPRESSION_NONE, threshold=DEFAULT_COMPRESS_THRESHOLD):
+        if codec not in available_codecs():
+            raise ValueError(f"不可用的编码: {codec}")
+        if compression not in available_compression():
+            raise ValueError(f"不可用的压缩方式: {compression}")
+        self.codec = codec
+        self.compression = compression
+        self.threshold = threshold
+        self._compression_id = _COMPRESSION_IDS[compression]
+        self._zstd = zstandard.ZstdCompressor(level=3) if compression == COMPRESSION_ZSTD else None
+
+    @property
+    def plain(self):
+        """是否为默认的 JSON 文本帧"""
+        return self.codec == CODEC_JSON and self.compression == COMPRESSION_NONE
+
+    def encode(self, data):
+        """编码消息对象，返回文本帧（str）或二进制帧（bytes）"""
+        if self.codec == CODEC_JSON:
+            return self.pack_text(json.dumps(data, ensure_ascii=False))
+        return self._pack(_CODEC_IDS[CODEC_MSGPACK], msgpack.packb(data, use_bin_type=True))
+
+    def pack_text(self, text):
+        """已经编码好的 JSON 文本（如转发的任务、信封帧）不重新编码，只在超过阈值时压缩"""
+        if self._compression_id == 0 or len(text) < self.threshold:
+            return text
+        return self._pack(_CODEC_IDS[CODEC_JSON], text.encode('utf-8'))
+
+    def _pack(self, codec_id, raw):
+        compression_id = 0
+        if self._compression_id and len(raw) >= self.threshold:
+            if self._zstd is not None:
+                compressed = self._zstd.compress(raw)
+            else:
+                compressed = zlib.compress(raw, 6)
+            # 压缩后没有变小（如已压缩的内容）时按原样发送
+            if len(compressed) < len(raw):
+                raw, compression_id = compressed, self._compression_id
+        return bytes((codec_id << 4 | compression_id,)) + raw
+
+
+def _decompress(compression_id, raw, limit):
+    if compression_id == 1:
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(raw, limit)
+        if decompressor.unconsumed_tail:
+            raise ValueError("解压后的数据超过上限")
+        return result
+    if compression_id == 2:
+        if zstandard is None:
+            raise ValueError("未安装 zstandard，无法解压")
+        if zstandard.frame_content_size(raw) > limit:
+            raise ValueError("解压后的数据超过上限")
+        return zstandard.ZstdDecompressor().decompress(raw, max_output_size=limit)
+    raise ValueError(f"未知的压缩方式: {compression_id}")
+
+
+def decode_frame(message, limit=MAX_DECODED_SIZE):
+    """解码收到的帧：文本帧原样返回；二进制帧按首字节解压、解码，
+    返回 JSON 文本（可能是信封帧）或 MessagePack 解码后的对象
+    """
+    if isinstance(message, str):
+        return message
+    try:
+        flags = message[0]
+        codec_id, compression_id = flags >> 4, flags & 0x0F
+        raw = memoryview(message)[1:]
+        if compression_id:
+            raw = _decompress(compression_id, raw, limit)
+        if codec_id == _CODEC_IDS[CODEC_JSON]:
+            return bytes(raw).decode('utf-8')
+        if codec_id == _CODEC_IDS[CODEC_MSGPACK] and msgpack is not None:
+            return msgpack.unpackb(raw, raw=False)
+        raise ValueError(f"不支持的编码: {codec_id}")
+    except Exception as e:
+        raise ProtocolError('invalid_message', f"无法解码二进制帧: {e}")
+
+
+def negotiate_wire(data, codecs=None, compression=None, threshold=DEFAULT_COMPRESS_THRESHOLD):
+    """按客户端给出的 codecs/compression 偏好列表选择双方都支持的格式
+
+    codecs/compression 为服务器允许的列表（默认当前环境全部可用的格式）；客户端未提供时返回 None
+    """
+    offered_codecs = data.get('codecs')
+    offered_compression = data.get('compression')
+    if offered_codecs is None and offered_compression is None:
+        return None
+    allowed_codecs = [c for c in (codecs or available_codecs()) if c in available_codecs()]
+    allowed_compression = [c for c in (compression or available_compression()) if c in available_compression()]
+    codec = next((c for c in offered_codecs or () if c in allowed_codecs), CODEC_JSON)
+    chosen_compression = next((c for c in offered_compression or () if c in allowed_compression), COMPRESSION_NONE)
+    return WireFormat(codec, chosen_compression, threshold)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印文件下载
+- 按块流式写入本地文件（先写入 .part 文件，完成后改名），内存占用与文件大小无关
+- 连接和每次读取都有超时，另外可以设置整个下载的总时长上限
+- 网络错误、超时、5xx/429 响应时按指数退避（带随机抖动）重试，429/503 优先使用 Retry-After
+- 重试时用 Range 请求从已下载的位置继续，If-Range 保证文件在服务器上被替换时重新下载
+- 下载进度通过 report_status 回调报告，按时间间隔节流
+- 可以带 If-None-Match/If-Modified-Since 发起条件请求，文件未变化时（304）不下载
+- stream() 把响应内容直接写入输出（如 lpr 的标准输入），不落盘也不重试，中途出错由调用方改用 fetch()
+- 下载在打印任务的工作线程中执行，不阻塞客户端的事件循环
+"""
+
+import os
+import random
+import re
+import socket
+import time
+import urllib.error
+import urllib.request
+from http.client import HTTPException
+
+from print_logging import get_logger
+
+logger = get_logger('print_downloader')
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)  # 可以重试的 HTTP 状态码
+
+_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+_CONTENT_RANGE_UNSATISFIED = re.compile(r'bytes\s+\*/(\d+)')
+
+
+class DownloadError(Exception):
+    """下载失败（重试次数用完或不可重试的错误）"""
+
+
+class DownloadInterrupted(DownloadError):
+    """stream() 在写入部分内容后中断（网络错误、超时或内容不完整），可以改用 fetch() 重新下载"""
+
+
+class _Retry(Exception):
+    """本次请求失败，可以重试；delay 为服务器建议的等待时间"""
+
+    def __init__(self, message, delay=None):
+        super().__init__(message)
+        self.delay = delay
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+def _retry_after(headers):
+    value = headers.get('Retry-After') if headers is not None else None
+    if value and value.strip().isdigit():
+        return float(value.strip())
+    return None
+
+
+class Downloader:
+    """分块下载文件，支持超时、重试和断点续传"""
+
+    def __init__(self, timeout=30.0, retries=3, backoff=1.0, max_backoff=30.0, total_timeout=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, progress_interval=1.0):
+        self.timeout = timeout  # 连接和每次读取的超时（秒）
+        self.retries = retries  # 首次请求失败后最多重试的次数
+        self.backoff = backoff  # 第一次重试前的等待时间，之后每次翻倍
+        self.max_backoff = max_backoff
+        self.total_timeout = total_timeout  # 整个下载（包括重试等待）的时长上限，None 表示不限制
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval  # 进度报告的最小间隔（秒）
+
+    def retry_delay(self, attempt, suggested=None):
+        """第 attempt 次重试前等待的秒数"""
+        if suggested is not None:
+            return min(suggested, self.max_backoff)
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def download(self, url, path, report_status=None):
+        """下载 url 到 path，返回文件大小；失败时抛出 DownloadError"""
+        return self.fetch(url, path, report_status)['size']
+
+    def fetch(self, url, path, report_status=None, etag=None, last_modified=None):
+        """下载 url 到 path，返回响应信息 {size, not_modified, etag, last_modified, cache_control, expires}
+
+        提供 etag/last_modified 时发起条件请求，服务器返回 304 时 not_modified 为 True，不写入 path
+        """
+        report = report_status or (lambda message: logger.info("%s", message))
+        part_path = path + '.part'
+        state = {'validator': None, 'total': None, 'last_report': 0.0, 'headers': None, 'not_modified': False,
+                 'etag': etag, 'last_modified': last_modified}
+        deadline = time.monotonic() + self.total_timeout if self.total_timeout else None
+        if os.path.exists(part_path):
+            # 上次留下的部分文件无法确认是否对应同一个版本，从头下载
+            os.remove(part_path)
+
+        attempt = 0
+        while True:
+            try:
+                self._fetch(url, part_path, state, report, deadline)
+                break
+            except _Retry as e:
+                if attempt >= self.retries:
+                    raise DownloadError(f"下载失败（已重试 {attempt} 次）: {e}")
+                delay = self.retry_delay(attempt, e.delay)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise DownloadError(f"下载超时: {e}")
+                attempt += 1
+                done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                report(f"下载中断: {e}，{delay:.1f} 秒后从 {format_size(done)} 处继续（第 {attempt} 次重试）")
+                time.sleep(delay)
+
+        headers = state['headers']
+        info = {
+            'not_modified': state['not_modified'],
+            'size': None,
+            'etag': headers.get('ETag') or (etag if state['not_modified'] else None),
+            'last_modified': headers.get('Last-Modified') or (last_modified if state['not_modified'] else None),
+            'cache_control': headers.get('Cache-Control'),
+            'expires': headers.get('Expires')
+        }
+        if info['not_modified']:
+            return info
+        info['size'] = os.path.getsize(part_path)
+        os.replace(part_path, path)
+        report(f"下载完成: {format_size(info['size'])}")
+        return info
+
+    def stream(self, url, sink, report_status=None):
+        """下载 url 并把内容依次写入 sink（有 write 方法的对象），返回字节数
+
+        已经写入的内容无法撤回，所以只请求一次：HTTP 错误抛出 DownloadError，
+        其他中断抛出 DownloadInterrupted，调用方应丢弃已写入的内容后改用 fetch()
+        """
+        report = report_status or (lambda message: logger.info("%s", message))
+        state = {'total': None, 'last_report': 0.0}
+        deadline = time.monotonic() + self.total_timeout if self.total_timeout else None
+        request = urllib.request.Request(url, headers={'User-Agent': 'print-client'})
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            e.close()  # 错误响应的内容不需要，释放连接
+            if e.code in RETRY_STATUS:
+                raise DownloadInterrupted(f"HTTP {e.code}")
+            raise DownloadError(f"HTTP {e.code}: {e.reason}")
+        except (urllib.error.URLError, socket.timeout, ConnectionError, HTTPException) as e:
+            raise DownloadInterrupted(getattr(e, 'reason', None) or str(e) or type(e).__name__)
+
+        received = 0
+        with response:
+            length = response.headers.get('Content-Length')
+            state['total'] = int(length) if length and length.isdigit() else None
+            while True:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise DownloadInterrupted("下载超时")
+                try:
+                    chunk = response.read(self.chunk_size)
+                except (socket.timeout, ConnectionError, HTTPException) as e:
+                    raise DownloadInterrupted(str(e) or type(e).__name__)
+                if not chunk:
+                    break
+                sink.write(chunk)
+                received += len(chunk)
+                self._report_progress(report, state, received)
+        if state['total'] is not None and received < state['total']:
+            raise DownloadInterrupted(f"连接提前关闭（{format_size(received)} / {format_size(state['total'])}）")
+        report(f"下载完成: {format_size(received)}")
+        return received
+
+    def _request(self, url, offset, state):
+        headers = {'User-Agent': 'print-client'}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if state['validator']:
+                headers['If-Range'] = state['validator']
+        elif state['headers'] is None:
+            # 条件请求只在还没有收到响应时发送，续传的请求不再携带
+            if state['etag']:
+                headers['If-None-Match'] = state['etag']
+            if state['last_modified']:
+                headers['If-Modified-Since'] = state['last_modified']
+        return urllib.request.Request(url, headers=headers)
+
+    def _fetch(self, url, part_path, state, report, deadline):
+        """发起一次请求，把响应追加到部分文件；可以重试的错误抛出 _Retry"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        try:
+            response = urllib.request.urlopen(self._request(url, offset, state), timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            e.close()  # 错误响应的内容不需要，释放连接
+            if e.code == 304 and state['headers'] is None and (state['etag'] or state['last_modified']):
+                state['headers'], state['not_modified'] = e.headers, True
+                return
+            if e.code == 416 and offset:
+                # 请求的起始位置超出文件大小：已经下载完整，或者文件变小了
+                match = _CONTENT_RANGE_UNSATISFIED.match(e.headers.get('Content-Range', ''))
+                if match and int(match.group(1)) == offset:
+                    return
+                os.remove(part_path)
+                raise _Retry("服务器上的文件已变化")
+            if e.code in RETRY_STATUS:
+                raise _Retry(f"HTTP {e.code}", _retry_after(e.headers))
+            raise DownloadError(f"HTTP {e.code}: {e.reason}")
+        except (urllib.error.URLError, socket.timeout, ConnectionError, HTTPException) as e:
+            raise _Retry(getattr(e, 'reason', None) or str(e) or type(e).__name__)
+
+        with response:
+            headers = state['headers'] = response.headers
+            if response.status == 206:
+                match = _CONTENT_RANGE.match(headers.get('Content-Range', ''))
+                if not match or int(match.group(1)) != offset:
+                    os.remove(part_path)
+                    raise _Retry("服务器返回的范围与请求不一致")
+                if match.group(3) != '*':
+                    state['total'] = int(match.group(3))
+                mode = 'ab'
+            else:
+                # 服务器不支持 Range 或文件已变化（If-Range 不匹配），从头下载
+                if offset:
+                    report("服务器不支持断点续传或文件已变化，从头下载")
+                offset = 0
+                length = headers.get('Content-Length')
+                state['total'] = int(length) if length and length.isdigit() else None
+                mode = 'wb'
+            # 只有强校验的 ETag 或 Last-Modified 可以用于 If-Range
+            etag = headers.get('ETag')
+            state['validator'] = etag if etag and not etag.startswith('W/') else headers.get('Last-Modified')
+
+            received = offset
+            with open(part_path, mode) as f:
+                while True:
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise DownloadError("下载超时")
+                    try:
+                        chunk = response.read(self.chunk_size)
+                    except (socket.timeout, ConnectionError, HTTPException) as e:
+                        raise _Retry(str(e) or type(e).__name__)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    received += len(chunk)
+                    self._report_progress(report, state, received)
+
+        total = state['total']
+        if total is not None and received < total:
+            raise _Retry(f"连接提前关闭（{format_size(received)} / {format_size(total)}）")
+
+    def _report_progress(self, report, state, received):
+        now = time.monotonic()
+        if now - state['last_report'] < self.progress_interval:
+            return
+        state['last_report'] = now
+        total = state['total']
+        if total:
+            report(f"下载进度: {format_size(received)} / {format_size(total)} ({received * 100 // total}%)")
+        else:
+            report(f"下载进度: {format_size(received)}")
@@ -26,15 +26,33 @@ import qdarkstyle
 # 导入原有的打印逻辑
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from print_client import PrintClient, register_startup
+from print_logging import setup_logging, get_logger
+
+logger = get_logger('print_gui')
+
+
+class LogSignals(QObject):
+    """日志信号（由日志后台线程发出，在主线程中显示）"""
+    log_received = Signal(str)
+
+
+class QtLogHandler(logging.Handler):
+    """把日志记录转发到界面的日志处理器"""
+    def __init__(self, level=logging.INFO):
+        super().__init__(level)
+        self.signals = LogSignals()
+        self.setFormatter(logging.Formatter('%(message)s'))
+
+    def emit(self, record):
+        try:
+            self.signals.log_received.emit(self.format(record))
+        except Exception:
+            self.handleError(record)
 
-# 设置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
 
 class PrintWorkerSignals(QObject):
     """打印工作线程信号"""
     status_changed = Signal(bool, str)  # connected, message
-    log_received = Signal(str)
     print_task_received = Signal(str, dict)  # content, settings
     error_occurred = Signal(str)
 
@@ -52,26 +70,13 @@ class PrintWorker(QThread):
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
         
-        # 包装 PrintClient 的日志和状态输出
-        import builtins
-        original_print = builtins.print
-        
-        def gui_log_callback(msg):
-            self.signals.log_received.emit(str(msg))
-            
+        # 客户端日志由 QtLogHandler 显示，这里只需要转发连接状态
         def gui_status_callback(connected, msg):
             self.signals.status_changed.emit(connected, msg)
             
         # 设置客户端回调，通过信号传递到主线程
-        self.client.log_callback = gui_log_callback
         self.client.status_callback = gui_status_callback
 
-        def gui_print(*args, **kwargs):
-            msg = " ".join(map(str, args))
-            self.signals.log_received.emit(msg)
-        
-        builtins.print = gui_print
-
         try:
             # 创建并运行主任务
             self.main_task = self.loop.create_task(self.start_client())
@@ -84,7 +89,6 @@ class PrintWorker(QThread):
             if self._is_running:
                 self.signals.error_occurred.emit(str(e))
         finally:
-            builtins.print = original_print
             # 确保取消所有剩余任务
             pending = asyncio.all_tasks(self.loop)
             if pending:
@@ -114,13 +118,14 @@ class PrintWorker(QThread):
                 else:
                     # 如果从 connect_and_listen 返回，说明连接已正常结束或断开
                     if self._is_running:
-                        self.signals.status_changed.emit(False, "连接已断开，准备重连...")
-                        await asyncio.sleep(2)
+                        delay = self.client.reconnect_delay(2)
+                        self.signals.status_changed.emit(False, f"连接已断开，{delay:.0f} 秒后重连...")
+                        await asyncio.sleep(delay)
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 if self._is_running:
-                    self.signals.log_received.emit(f"发生错误: {str(e)}")
+                    logger.warning("发生错误: %s", e)
                     self.signals.status_changed.emit(False, f"错误: {str(e)}")
                     await asyncio.sleep(5)
                 else:
@@ -136,7 +141,11 @@ class PrintWorker(QThread):
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.client = PrintClient(log_callback=self.on_log_received)
+        # 所有日志（包括打印客户端的日志）通过后台线程写到控制台并显示在界面上
+        self.log_handler = QtLogHandler()
+        self.log_handler.signals.log_received.connect(self.on_log_received)
+        setup_logging(handlers=[logging.StreamHandler(), self.log_handler])
+        self.client = PrintClient()
         self.worker = None
         
         self.init_ui()
@@ -379,7 +388,6 @@ class MainWindow(QMainWindow):
             
         self.worker = PrintWorker(self.client)
         self.worker.signals.status_changed.connect(self.on_status_changed)
-        self.worker.signals.log_received.connect(self.on_log_received)
         self.worker.signals.error_occurred.connect(self.on_error)
         self.worker.start()
         
@@ -391,8 +399,7 @@ class MainWindow(QMainWindow):
             self.worker.stop()
             self.worker = None
         
-        # 重置客户端回调为本地方法
-        self.client.log_callback = self.on_log_received
+        # 重置客户端状态回调
         self.client.status_callback = None
         
         self.on_status_changed(False, "服务已停止")
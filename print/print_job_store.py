@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印任务持久化队列
+- 打印客户端离线时保存用户的待打印任务（SQLite WAL 模式）
+- 任务带有过期时间，过期后自动清理
+- 客户端重新认证后按批次认领并转发，认领在一个写事务中完成，多个进程不会取到同一批任务
+- 记录已投递未确认（inflight）的任务，客户端确认后删除，断线后重新投递
+"""
+
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_JOB_TTL = 24 * 3600  # 默认任务保留 24 小时
+
+STATE_PENDING = 'pending'  # 等待投递
+STATE_INFLIGHT = 'inflight'  # 已投递，等待客户端确认
+
+
+class JobStore:
+    def __init__(self, data_dir, ttl=DEFAULT_JOB_TTL):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, 'print_jobs.db')
+        self.ttl = ttl
+        self._conn = None
+        # sqlite 连接只在这个单线程执行器中使用，避免阻塞事件循环
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='print-job-store')
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(self.data_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    job_id TEXT,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    client_id TEXT
+                )
+            ''')
+            # 兼容旧版本创建的表
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            if 'state' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN state TEXT NOT NULL DEFAULT 'pending'")
+            if 'client_id' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN client_id TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_username ON jobs (username, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_job_id ON jobs (username, job_id)')
+            self._conn = conn
+        return self._conn
+
+    def _enqueue(self, username, job_id, payload, client_id=None):
+        now = time.time()
+        state = STATE_PENDING if client_id is None else STATE_INFLIGHT
+        cursor = self._connection().execute(
+            'INSERT INTO jobs (username, job_id, payload, created_at, expires_at, state, client_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (username, job_id, payload, now, now + self.ttl, state, client_id)
+        )
+        return cursor.lastrowid
+
+    def _claim_batch(self, username, client_id, limit):
+        conn = self._connection()
+        # BEGIN IMMEDIATE 立即取得写锁，查询和标记之间其他进程无法认领同一批任务
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                'SELECT id, job_id, payload FROM jobs WHERE username = ? AND state = ? AND expires_at > ? '
+                'ORDER BY id LIMIT ?',
+                (username, STATE_PENDING, time.time(), limit)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE jobs SET state = ?, client_id = ? WHERE id = ? AND state = ?',
+                [(STATE_INFLIGHT, client_id, row[0], STATE_PENDING) for row in rows]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def _ack(self, username, job_id):
+        cursor = self._connection().execute(
+            'DELETE FROM jobs WHERE username = ? AND job_id = ? AND state = ?',
+            (username, job_id, STATE_INFLIGHT)
+        )
+        return cursor.rowcount
+
+    def _release(self, client_id=None):
+        conn = self._connection()
+        if client_id is None:
+            cursor = conn.execute(
+                'UPDATE jobs SET state = ?, client_id = NULL WHERE state = ?', (STATE_PENDING, STATE_INFLIGHT)
+            )
+        else:
+            cursor = conn.execute(
+                'UPDATE jobs SET state = ?, client_id = NULL WHERE state = ? AND client_id = ?',
+                (STATE_PENDING, STATE_INFLIGHT, client_id)
+            )
+        return cursor.rowcount
+
+    def _delete(self, ids):
+        if not ids:
+            return 0
+        conn = self._connection()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('DELETE FROM jobs WHERE id = ?', [(row_id,) for row_id in ids])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(ids)
+
+    def _purge_expired(self):
+        cursor = self._connection().execute('DELETE FROM jobs WHERE expires_at <= ?', (time.time(),))
+        return cursor.rowcount
+
+    def _count_pending(self, username=None):
+        conn = self._connection()
+        if username is None:
+            row = conn.execute('SELECT COUNT(*) FROM jobs WHERE expires_at > ?', (time.time(),)).fetchone()
+        else:
+            row = conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE username = ? AND expires_at > ?', (username, time.time())
+            ).fetchone()
+        return row[0]
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def enqueue(self, username, job_id, payload, client_id=None):
+        """保存一个打印任务，返回记录ID；指定 client_id 时记为已投递到该客户端"""
+        return await self._run(self._enqueue, username, job_id, payload, client_id)
+
+    async def claim_batch(self, username, client_id, limit):
+        """按提交顺序认领用户未过期的待投递任务并标记为已投递到该客户端，返回 [(id, job_id, payload), ...]"""
+        return await self._run(self._claim_batch, username, client_id, limit)
+
+    async def ack(self, username, job_id):
+        """客户端确认收到任务后删除记录，返回删除数量"""
+        return await self._run(self._ack, username, job_id)
+
+    async def release(self, client_id=None):
+        """将客户端（未指定时为全部）未确认的任务重新标记为待投递"""
+        return await self._run(self._release, client_id)
+
+    async def delete(self, ids):
+        """在一个事务中删除已转发的任务"""
+        return await self._run(self._delete, list(ids))
+
+    async def purge_expired(self):
+        """清理过期任务，返回删除数量"""
+        return await self._run(self._purge_expired)
+
+    async def count_pending(self, username=None):
+        return await self._run(self._count_pending, username)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
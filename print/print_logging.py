@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印服务日志
+- 基于标准库 logging，日志记录先放入队列，由后台线程格式化并写出，不阻塞事件循环
+- 使用 logger.info('... %s', 参数) 的延迟格式化，级别未开启时不做任何格式化
+- preview() 生成长度受限的消息预览，隐藏密码、令牌，文档内容只显示长度
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+
+
+DEFAULT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# 日志中隐藏的字段：密码和令牌完全隐藏，文档内容只保留长度
+SECRET_KEYS = frozenset(('password', 'token', 'auth_token', 'secret'))
+CONTENT_KEYS = frozenset(('content', 'data', 'body'))
+
+_listener = None
+_queue_handler = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """同一进程内的队列不需要序列化，记录原样入队，格式化在后台线程完成"""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level='INFO', handlers=None, fmt=DEFAULT_FORMAT):
+    """配置根日志：记录进入队列，由后台线程交给 handlers（默认输出到标准错误）"""
+    global _listener, _queue_handler
+    stop_logging()
+    if handlers is None:
+        handlers = [logging.StreamHandler()]
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(logging.Formatter(fmt))
+
+    log_queue = queue.Queue(-1)
+    _queue_handler = _QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def get_logger(name):
+    return logging.getLogger(name)
+
+
+def _redact(value, depth=0):
+    if isinstance(value, dict) and depth < 4:
+        result = {}
+        for key, item in value.items():
+            if key in SECRET_KEYS:
+                result[key] = '***'
+            elif key in CONTENT_KEYS and isinstance(item, (str, bytes)):
+                result[key] = f'<{len(item)} 字符>'
+            else:
+                result[key] = _redact(item, depth + 1)
+        return result
+    if isinstance(value, (list, tuple)) and depth < 4:
+        return [_redact(item, depth + 1) for item in value]
+    return value
+
+
+class preview:
+    """消息预览，只有日志实际输出时才序列化
+
+    创建时对字典做浅拷贝，避免后台线程格式化时字典已被修改
+    """
+
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=200):
+        self.value = dict(value) if isinstance(value, dict) else value
+        self.limit = limit
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, bytes):
+            text = f'<{len(value)} 字节>'
+        elif isinstance(value, str):
+            text = value
+        else:
+            try:
+                text = json.dumps(_redact(value), ensure_ascii=False, default=str)
+            except Exception:
+                text = repr(value)
+        if len(text) > self.limit:
+            text = f'{text[:self.limit]}...(共 {len(text)} 字符)'
+        return text
+
+    __repr__ = __str__
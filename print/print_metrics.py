@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印服务器监控指标
+- 计数器、仪表和直方图，输出 Prometheus 文本格式
+- 在独立端口上提供 HTTP 接口（GET /metrics），不依赖 websockets 版本
+- 按任务ID记录请求时间，用于统计转发和提交到打印队列的耗时
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.func = func  # 采集时调用，返回当前值（无标签）
+        self._values = {}  # 标签值元组 -> 值
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        if self.func is not None:
+            return [('', (), self.func())]
+        return [('', key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, value, *extra in self.samples():
+            labels = _format_labels(self.labelnames, key, extra[0] if extra else None)
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = state[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        samples = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', key, cumulative, ('le', _format_value(float(bound)))))
+            samples.append(('_sum', key, total))
+            samples.append(('_count', key, count))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = OrderedDict()
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"指标已存在: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), func=None):
+        return self._register(Counter(name, documentation, labelnames, func))
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self._register(Gauge(name, documentation, labelnames, func))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """输出 Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f'# {metric.name} 采集失败: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+class JobTimer:
+    """按任务记录收到请求的时间，任务结束或超出容量时移除"""
+
+    def __init__(self, max_jobs=10000):
+        self.max_jobs = max_jobs
+        self._started = OrderedDict()  # (username, job_id) -> 收到请求的时间
+
+    def start(self, username, job_id):
+        key = (username, job_id)
+        self._started[key] = time.monotonic()
+        self._started.move_to_end(key)
+        while len(self._started) > self.max_jobs:
+            # 一直没有结果的任务不能无限占用内存
+            self._started.popitem(last=False)
+
+    def elapsed(self, username, job_id):
+        started = self._started.get((username, job_id))
+        return None if started is None else time.monotonic() - started
+
+    def finish(self, username, job_id):
+        """移除任务，返回从收到请求到现在的秒数（未记录时返回 None）"""
+        started = self._started.pop((username, job_id), None)
+        return None if started is None else time.monotonic() - started
+
+    def __len__(self):
+        return len(self._started)
+
+
+async def serve_metrics(registry, host, port, reuse_port=False):
+    """启动监控指标 HTTP 服务（只处理 GET /metrics）"""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # 读完请求头
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/metrics', '/'):
+                status, body = '200 OK', registry.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    # 平滑重启时新旧进程的监控端口会短暂重叠
+    return await asyncio.start_server(handle, host, port, reuse_port=reuse_port or None)
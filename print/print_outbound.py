@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+连接发送队列
+- 每个连接一个有界发送队列，由独立的写协程按顺序发送
+- 处理协程只负责入队，慢速连接不会阻塞其他连接和消息处理
+- 队列满时按策略处理：丢弃最早的状态消息、合并同一任务的状态消息或断开连接
+"""
+
+import asyncio
+from collections import deque
+
+
+POLICY_DROP_OLDEST = 'drop_oldest'  # 丢弃最早的可丢弃状态消息
+POLICY_COALESCE = 'coalesce'  # 同一状态键只保留最新一条，仍然溢出时丢弃最早的状态消息
+POLICY_DISCONNECT = 'disconnect'  # 直接断开慢速连接
+OVERFLOW_POLICIES = (POLICY_DROP_OLDEST, POLICY_COALESCE, POLICY_DISCONNECT)
+
+CLOSE_CODE_SLOW_CONSUMER = 1013  # Try Again Later
+
+
+class QueueClosed(Exception):
+    """发送队列已关闭（连接断开或因发送过慢被断开）"""
+
+
+class OutboundQueue:
+    def __init__(self, websocket, maxsize=256, policy=POLICY_DROP_OLDEST, send_timeout=5.0, on_evict=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {policy}")
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.on_evict = on_evict
+        self.closed = False
+        # 队列元素: [message, key, future]；key 不为 None 的是可丢弃/可合并的状态消息
+        self._items = deque()
+        self._keyed = {}  # key -> 队列中对应的元素（合并策略使用）
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+        # 统计数据
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._writer())
+        return self
+
+    @property
+    def depth(self):
+        return len(self._items)
+
+    def put(self, message, key=None, wait=False):
+        """入队一条消息，不会阻塞
+
+        key 不为 None 表示可丢弃的状态消息（如任务进度），队列满时可被丢弃或合并。
+        wait=True 时返回一个 Future，消息实际写出后完成，失败时抛出异常；否则返回是否入队成功。
+        """
+        future = asyncio.get_event_loop().create_future() if wait else None
+        if self.closed:
+            if future is not None:
+                future.set_exception(QueueClosed())
+                return future
+            return False
+
+        if self.policy == POLICY_COALESCE and key is not None and key in self._keyed:
+            # 用最新的状态替换队列中尚未发送的旧状态
+            item = self._keyed[key]
+            item[0] = message
+            self.coalesced += 1
+            if future is not None:
+                future.set_result(None)
+                return future
+            return True
+
+        if len(self._items) >= self.maxsize and not self._make_room():
+            self.evict('发送队列已满')
+            if future is not None:
+                future.set_exception(QueueClosed())
+                return future
+            return False
+
+        item = [message, key, future]
+        self._items.append(item)
+        if key is not None and self.policy == POLICY_COALESCE:
+            self._keyed[key] = item
+        if len(self._items) > self.max_depth:
+            self.max_depth = len(self._items)
+        self._idle.clear()
+        self._wakeup.set()
+        return future if future is not None else True
+
+    def _make_room(self):
+        """按溢出策略腾出一个位置，返回是否成功"""
+        if self.policy == POLICY_DISCONNECT:
+            return False
+        for index, item in enumerate(self._items):
+            if item[1] is not None:
+                del self._items[index]
+                if self._keyed.get(item[1]) is item:
+                    del self._keyed[item[1]]
+                if item[2] is not None and not item[2].done():
+                    item[2].set_result(None)
+                self.dropped += 1
+                return True
+        # 队列中都是不能丢弃的消息（如打印任务），只能断开连接
+        return False
+
+    async def _writer(self):
+        try:
+            while True:
+                if not self._items:
+                    self._idle.set()
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                item = self._items.popleft()
+                message, key, future = item
+                if key is not None and self._keyed.get(key) is item:
+                    del self._keyed[key]
+                try:
+                    await asyncio.wait_for(self.websocket.send(message), self.send_timeout)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                    self.evict(f'发送失败: {e.__class__.__name__}')
+                    return
+                self.sent += 1
+                if future is not None and not future.done():
+                    future.set_result(None)
+        finally:
+            self._fail_pending()
+            self._idle.set()
+
+    def _fail_pending(self):
+        while self._items:
+            future = self._items.popleft()[2]
+            if future is not None and not future.done():
+                future.set_exception(QueueClosed())
+        self._keyed.clear()
+
+    def evict(self, reason):
+        """断开慢速或失效的连接"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._task is not None and asyncio.current_task() is not self._task:
+            self._task.cancel()
+        self._fail_pending()
+        self._idle.set()
+        asyncio.ensure_future(self._close_websocket(reason))
+        if self.on_evict:
+            self.on_evict(self, reason)
+
+    async def _close_websocket(self, reason):
+        try:
+            await asyncio.wait_for(self.websocket.close(CLOSE_CODE_SLOW_CONSUMER, reason), self.send_timeout)
+        except Exception:
+            pass
+
+    async def drained(self):
+        """等待队列中的消息全部发送（或队列关闭）"""
+        await self._idle.wait()
+
+    def close(self):
+        """连接已断开，停止写协程"""
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+        self._fail_pending()
+        self._idle.set()
+
+    def stats(self):
+        return {
+            'depth': len(self._items),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced
+        }
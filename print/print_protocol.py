@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印服务消息协议
+- 每种消息类型对应一个预编译的字段校验函数，只检查必需字段和字段类型
+- 校验在处理消息之前完成，格式错误的消息直接拒绝
+- 协议版本协商：客户端在 hello、client_auth 或 auth 中携带 protocol_version，
+  服务器选择双方都支持的最高版本；未协商的连接按版本 1 处理
+- 信封帧（版本 3）：一行 JSON 头部 + 换行 + 消息体（JSON 对象文本），
+  服务器只解析头部，消息体原样转发给打印客户端；消息体不能包含路由字段，合并时以头部为准
+- 分块传输（版本 4）：print_begin / print_chunk / print_end，打印客户端通过 print_credit 控制发送速度
+- 负载报告（版本 5）：打印客户端通过 client_load 报告每台打印机的队列长度和进行中的任务数
+"""
+
+import json
+import re
+
+
+PROTOCOL_VERSION = 5  # 当前协议版本
+MIN_PROTOCOL_VERSION = 1  # 仍然兼容的最低版本
+ENVELOPE_VERSION = 3  # 支持信封帧的最低版本
+STREAM_VERSION = 4  # 支持分块传输的最低版本
+LOAD_VERSION = 5  # 支持负载报告的最低版本
+
+ENVELOPE_TYPES = frozenset(('print_request', 'print_chunk'))  # 可以使用信封帧的消息类型
+# 服务器检查和改写过的头部字段，信封帧的消息体不能包含
+ROUTING_KEYS = frozenset(('type', 'job_id', 'username', 'envelope', 'printer'))
+MAX_HEADER_SIZE = 64 * 1024  # 只在前 64KB 内查找头部结束位置，普通消息的检测开销有上限
+# 单条消息的上限（字节），服务器和打印客户端都显式设置，不依赖 websockets 默认的 1MB
+# 前端超过 512KB（UTF-8 字节数）的文档分块传输，这里为没有分块传输能力时整篇发送的文档留出余量
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+_ID_TYPES = (str, int)
+_CREDENTIALS = {'username': str, 'password': str, 'token': str, 'protocol_version': int}
+_WIRE = {'codecs': list, 'compression': list}  # 客户端提供的编码格式偏好（见 print_codec）
+# JSON 字符串中的引号都经过转义，未转义的 "type": 只能是对象的键
+_ROUTING_KEY = re.compile(r'"(%s)"\s*:' % '|'.join(sorted(ROUTING_KEYS)))
+
+
+class ProtocolError(Exception):
+    """消息格式错误或协议版本不兼容，code 用于回复给客户端"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def compile_schema(required=None, optional=None):
+    """把字段定义编译为校验函数: validate(data) -> 错误信息，合法时返回 None
+
+    required/optional 为 字段名 -> 类型（或类型元组），可选字段的值为 None 时视为未提供
+    """
+    required = tuple((required or {}).items())
+    optional = tuple((optional or {}).items())
+
+    def validate(data):
+        for name, types in required:
+            value = data.get(name)
+            if value is None:
+                return f"缺少字段: {name}"
+            if not isinstance(value, types):
+                return f"字段类型错误: {name}"
+        for name, types in optional:
+            value = data.get(name)
+            if value is not None and not isinstance(value, types):
+                return f"字段类型错误: {name}"
+        return None
+
+    return validate
+
+
+# 消息类型 -> 校验函数
+SCHEMAS = {
+    'hello': compile_schema(optional=dict(_WIRE, protocol_version=int, versions=list)),
+    'client_auth': compile_schema(
+        required={'client_id': str},
+        optional=dict(_CREDENTIALS, capabilities=list, printers=list, **_WIRE)
+    ),
+    'auth': compile_schema(optional=dict(_CREDENTIALS, **_WIRE)),
+    'check_client_status': compile_schema(optional=_CREDENTIALS),
+    'print_request': compile_schema(
+        optional=dict(_CREDENTIALS, job_id=_ID_TYPES, content=str, settings=dict, printer=str)
+    ),
+    'print_begin': compile_schema(
+        optional=dict(_CREDENTIALS, job_id=_ID_TYPES, settings=dict, printer=str, content_type=str,
+                      file_name=str, encoding=str, size=int)
+    ),
+    'print_chunk': compile_schema(required={'job_id': _ID_TYPES, 'seq': int}, optional={'data': str}),
+    'print_end': compile_schema(required={'job_id': _ID_TYPES, 'chunks': int}, optional={'size': int}),
+    'print_abort': compile_schema(required={'job_id': _ID_TYPES}, optional={'message': str}),
+    'print_credit': compile_schema(required={'job_id': _ID_TYPES, 'credits': int}),
+    'print_ack': compile_schema(required={'job_id': _ID_TYPES}),
+    'print_status': compile_schema(optional={'job_id': _ID_TYPES, 'message': str}),
+    'print_queued': compile_schema(optional={'job_id': _ID_TYPES, 'message': str}),
+    'error': compile_schema(optional={'job_id': _ID_TYPES, 'message': str}),
+    'client_load': compile_schema(required={'printers': dict}),
+}
+
+
+def validate_frame(data):
+    """校验解码后的消息，返回消息类型；格式错误时抛出 ProtocolError"""
+    if not isinstance(data, dict):
+        raise ProtocolError('invalid_message', '消息必须是 JSON 对象')
+    message_type = data.get('type')
+    validate = SCHEMAS.get(message_type) if isinstance(message_type, str) else None
+    if validate is None:
+        raise ProtocolError('unknown_type', '未知请求类型')
+    error = validate(data)
+    if error is not None:
+        raise ProtocolError('invalid_message', error)
+    return message_type
+
+
+def negotiate_version(data):
+    """根据客户端提供的 protocol_version（最高支持版本）或 versions 列表选择协议版本
+
+    客户端未提供时返回 None（保持当前版本），没有共同支持的版本时抛出 ProtocolError
+    """
+    versions = data.get('versions')
+    if versions is None:
+        requested = data.get('protocol_version')
+        if requested is None:
+            return None
+        versions = [min(requested, PROTOCOL_VERSION)]
+    common = [v for v in versions if isinstance(v, int) and MIN_PROTOCOL_VERSION <= v <= PROTOCOL_VERSION]
+    if not common:
+        raise ProtocolError('unsupported_version',
+                            f"不支持的协议版本，服务器支持 {MIN_PROTOCOL_VERSION}-{PROTOCOL_VERSION}")
+    return max(common)
+
+
+def split_envelope(message):
+    """拆分信封帧，返回 (头部字典, 消息体文本)；不是信封帧时返回 None
+
+    普通 JSON 消息由 json.dumps/JSON.stringify 生成，不含换行；带缩进的 JSON 第一行无法解析为对象，同样按普通消息处理
+    """
+    if not isinstance(message, str):
+        return None
+    index = message.find('\n', 0, MAX_HEADER_SIZE)
+    if index <= 0:
+        return None
+    try:
+        header = json.loads(message[:index])
+    except ValueError:
+        return None
+    if not isinstance(header, dict) or not header.get('envelope'):
+        return None
+    return header, message[index + 1:]
+
+
+def check_envelope_body(body):
+    """消息体必须是 JSON 对象文本且不能包含路由字段，只检查首尾字符并查找键名，不解析内容"""
+    if body[:1] != '{' or body[-1:] != '}':
+        raise ProtocolError('invalid_message', '信封帧的消息体必须是 JSON 对象')
+    match = _ROUTING_KEY.search(body)
+    if match:
+        raise ProtocolError('invalid_message', f"信封帧的消息体不能包含路由字段: {match.group(1)}")
+
+
+def make_envelope(header, body):
+    """生成信封帧"""
+    return json.dumps(dict(header, envelope=1), ensure_ascii=False) + '\n' + body
+
+
+def envelope_to_json(header, body):
+    """把信封帧拼接为普通 JSON 消息（供不支持信封帧的客户端），不解析消息体
+
+    头部字段放在后面，字段重复时 JSON 解析以后出现的为准，消息体不能覆盖头部字段
+    """
+    head = json.dumps({k: v for k, v in header.items() if k != 'envelope'}, ensure_ascii=False)
+    if head == '{}':
+        return body
+    if len(body) < 16 and body[1:-1].strip() == '':
+        return head
+    return body[:-1] + ', ' + head[1:]
+
+
+def payload_header(payload):
+    """任务内容的头部字段：信封帧只解析头部，普通消息解析全文"""
+    envelope = split_envelope(payload)
+    if envelope is not None:
+        return envelope[0]
+    return json.loads(payload)
+
+
+def decode_message(message):
+    """解码收到的消息，信封帧的消息体字段合并到头部字段中"""
+    envelope = split_envelope(message)
+    if envelope is None:
+        return json.loads(message)
+    header, body = envelope
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ProtocolError('invalid_message', '信封帧的消息体必须是 JSON 对象')
+    routing = ROUTING_KEYS.intersection(data)
+    if routing:
+        raise ProtocolError('invalid_message', f"信封帧的消息体不能包含路由字段: {', '.join(sorted(routing))}")
+    # 与 envelope_to_json 一致：字段重复时以头部为准
+    data.update((k, v) for k, v in header.items() if k != 'envelope')
+    return data
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+限流与准入控制
+- 令牌桶：按 rate（每秒补充的令牌数）匀速补充，最多积累 burst 个，每个请求消耗一个令牌
+- 每个前端连接一个令牌桶，在消息分派前检查，单个连接的大量消息不会占满事件循环
+- 每个用户一个令牌桶（打印请求和状态查询），同一用户打开多个连接也共享额度
+- 全局进行中任务数上限，超过时回复 busy，由前端按 retry_after 稍后重试
+- rate 为 0 表示不限制
+"""
+
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def take(self, now=None):
+        """消耗一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """按键（如用户名）分别限流，最多保留 max_keys 个令牌桶，最久未使用的先移除"""
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def bucket(self):
+        """创建单独的令牌桶（如每个连接一个，随连接释放），不限制时返回 None"""
+        return TokenBucket(self.rate, self.burst) if self.enabled else None
+
+    def check(self, key):
+        """消耗 key 的一个令牌，允许时返回 0，否则返回建议的重试等待秒数"""
+        if not self.enabled:
+            return 0
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_keys:
+                # 被移除的令牌桶已空闲较久，重新创建时是满的，不会误拒绝
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take()
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印客户端连接注册表
+- 维护 websocket → client_id → username 的正反向映射
+- 同一用户可以绑定多台打印客户端，记录每台客户端的打印机列表与未完成任务
+- 认证、重新绑定、断开连接时保持各映射一致
+- 记录每台打印客户端最近一次收到消息或心跳的时间，用于清理失联的连接
+- 维护用户订阅集合与 job_id → 发起连接的路由表
+- 所有查询均为常数时间
+"""
+
+import time
+from datetime import datetime
+
+
+class ConnectionRegistry:
+    def __init__(self):
+        self.clients = {}  # client_id -> 客户端信息
+        self.user_bindings = {}  # username -> 在线 client_id 集合
+        self._client_by_websocket = {}  # websocket -> client_id（反向索引）
+        self._subscribers = {}  # username -> 订阅该用户状态的前端连接集合
+        self._subscriptions = {}  # websocket -> 该连接订阅的用户集合
+        self._job_origins = {}  # (username, job_id) -> 发起任务的前端连接
+        self._jobs_by_websocket = {}  # websocket -> 该连接发起的 (username, job_id) 集合
+        self._remote_origins = {}  # (username, job_id) -> 发起任务的其他工作进程
+        self.job_count = 0  # 所有客户端未完成的任务总数
+
+    def bind(self, client_id, websocket, username, capabilities=(), printers=()):
+        """绑定打印客户端，返回客户端信息"""
+        # 同一连接重新认证为其他 client_id 时，先移除旧的绑定
+        old_client_id = self._client_by_websocket.get(websocket)
+        if old_client_id is not None and old_client_id != client_id:
+            self._remove_client(old_client_id)
+
+        jobs = set()  # 已发送但客户端尚未报告结果的 job_id
+        old_info = self.clients.get(client_id)
+        if old_info is not None:
+            if old_info['websocket'] is websocket:
+                # 同一连接重新认证：已发送的任务仍由该连接报告结果，保留负载记录
+                jobs = old_info['jobs']
+            else:
+                # 从新连接重新认证：旧连接的反向索引失效，旧连接上的任务不会再收到结果
+                self._client_by_websocket.pop(old_info['websocket'], None)
+                self.job_count -= len(old_info['jobs'])
+            if old_info['username'] != username:
+                self._unbind_user(old_info['username'], client_id)
+
+        info = {
+            'websocket': websocket,
+            'connected_at': datetime.now(),
+            'username': username,
+            'capabilities': frozenset(capabilities or ()),
+            'printers': frozenset(printers or ()),
+            'jobs': jobs,
+            'printer_load': {},  # 客户端报告的每台打印机负载: 打印机 -> {queued, inflight, concurrency}
+            'last_seen': time.monotonic()  # 最近一次收到消息或心跳响应的时间
+        }
+        self.clients[client_id] = info
+        self._client_by_websocket[websocket] = client_id
+        self.user_bindings.setdefault(username, set()).add(client_id)
+        return info
+
+    def _unbind_user(self, username, client_id):
+        client_ids = self.user_bindings.get(username)
+        if client_ids is not None:
+            client_ids.discard(client_id)
+            if not client_ids:
+                del self.user_bindings[username]
+
+    def unbind_websocket(self, websocket):
+        """移除连接对应的打印客户端，返回被移除的 client_id"""
+        client_id = self._client_by_websocket.get(websocket)
+        if client_id is None:
+            return None
+        self._remove_client(client_id)
+        return client_id
+
+    def _remove_client(self, client_id):
+        info = self.clients.pop(client_id, None)
+        if info is None:
+            return
+        self.job_count -= len(info['jobs'])
+        if self._client_by_websocket.get(info['websocket']) == client_id:
+            del self._client_by_websocket[info['websocket']]
+        self._unbind_user(info['username'], client_id)
+
+    def client_id_for(self, websocket):
+        """根据连接查找 client_id"""
+        return self._client_by_websocket.get(websocket)
+
+    def username_for(self, websocket):
+        """根据连接查找所属用户"""
+        client_id = self._client_by_websocket.get(websocket)
+        if client_id is None:
+            return None
+        return self.clients[client_id]['username']
+
+    def get_client(self, client_id):
+        """获取客户端信息"""
+        return self.clients.get(client_id)
+
+    def clients_for_user(self, username):
+        """返回用户所有在线的 [(client_id, 客户端信息), ...]"""
+        return [(client_id, self.clients[client_id]) for client_id in self.user_bindings.get(username, ())]
+
+    def client_for_user(self, username):
+        """返回用户最早连接的在线客户端 (client_id, 客户端信息)，没有则返回 (None, None)"""
+        candidates = self.clients_for_user(username)
+        if not candidates:
+            return None, None
+        return min(candidates, key=lambda item: item[1]['connected_at'])
+
+    def touch(self, websocket):
+        """收到打印客户端的消息或心跳响应，更新最近活跃时间"""
+        client_id = self._client_by_websocket.get(websocket)
+        if client_id is not None:
+            self.clients[client_id]['last_seen'] = time.monotonic()
+
+    def update_load(self, websocket, printers, limit=64):
+        """记录打印客户端报告的每台打印机负载（queued/inflight/concurrency），忽略格式错误的项"""
+        client_id = self._client_by_websocket.get(websocket)
+        if client_id is None:
+            return
+        load = {}
+        for name, item in list(printers.items())[:limit]:
+            if not isinstance(item, dict):
+                continue
+            values = [item.get(key, 0) for key in ('queued', 'inflight', 'concurrency')]
+            if all(isinstance(value, int) and value >= 0 for value in values):
+                load[name] = dict(zip(('queued', 'inflight', 'concurrency'), values))
+        self.clients[client_id]['printer_load'] = load
+
+    def idle_clients(self, idle_for):
+        """返回超过 idle_for 秒没有任何活动的 [(client_id, 客户端信息), ...]"""
+        deadline = time.monotonic() - idle_for
+        return [(client_id, info) for client_id, info in self.clients.items() if info['last_seen'] < deadline]
+
+    def assign_job(self, client_id, job_id):
+        """记录发送给客户端的任务，计入该客户端的负载"""
+        info = self.clients.get(client_id)
+        if info is not None and job_id not in info['jobs']:
+            info['jobs'].add(job_id)
+            self.job_count += 1
+
+    def complete_job(self, client_id, job_id):
+        """客户端报告任务结果或发送失败后，从负载中移除"""
+        info = self.clients.get(client_id)
+        if info is not None and job_id in info['jobs']:
+            info['jobs'].discard(job_id)
+            self.job_count -= 1
+
+    def subscribe(self, websocket, username):
+        """前端连接订阅用户的打印状态"""
+        self._subscribers.setdefault(username, set()).add(websocket)
+        self._subscriptions.setdefault(websocket, set()).add(username)
+
+    def subscribers(self, username):
+        """返回订阅该用户的前端连接集合"""
+        return self._subscribers.get(username, ())
+
+    def track_job(self, username, job_id, websocket):
+        """记录任务由哪个前端连接发起"""
+        key = (username, job_id)
+        old_websocket = self._job_origins.get(key)
+        if old_websocket is not None and old_websocket is not websocket:
+            self._discard_job(old_websocket, key)
+        self._job_origins[key] = websocket
+        self._jobs_by_websocket.setdefault(websocket, set()).add(key)
+
+    def job_origin(self, username, job_id):
+        """返回发起任务的前端连接，未知时返回 None"""
+        return self._job_origins.get((username, job_id))
+
+    def track_remote_job(self, username, job_id, worker_id):
+        """记录由其他工作进程转发过来的任务"""
+        self._remote_origins[(username, job_id)] = worker_id
+
+    def remote_origin(self, username, job_id):
+        """返回发起任务的工作进程，未知时返回 None"""
+        return self._remote_origins.get((username, job_id))
+
+    def finish_job(self, username, job_id):
+        """任务结束后移除路由记录"""
+        key = (username, job_id)
+        self._remote_origins.pop(key, None)
+        websocket = self._job_origins.pop(key, None)
+        if websocket is not None:
+            self._discard_job(websocket, key)
+
+    def _discard_job(self, websocket, key):
+        jobs = self._jobs_by_websocket.get(websocket)
+        if jobs is not None:
+            jobs.discard(key)
+            if not jobs:
+                del self._jobs_by_websocket[websocket]
+
+    def forget_websocket(self, websocket):
+        """连接断开时清除其订阅与任务路由记录"""
+        for username in self._subscriptions.pop(websocket, ()):
+            subscribers = self._subscribers.get(username)
+            if subscribers is not None:
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self._subscribers[username]
+        for key in self._jobs_by_websocket.pop(websocket, ()):
+            if self._job_origins.get(key) is websocket:
+                del self._job_origins[key]
+
+    def is_client(self, websocket):
+        return websocket in self._client_by_websocket
+
+    def client_ids(self):
+        return list(self.clients.keys())
+
+    def __len__(self):
+        return len(self.clients)
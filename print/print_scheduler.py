@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印任务调度
+- 同一用户可以绑定多台打印客户端，按策略选择接收任务的客户端
+- least_loaded: 选择负载最低的客户端，负载统一为每个并发槽位的未完成任务数；任务指定打印机且客户端
+  报告了该打印机的负载时只计算该打印机，慢的打印机不影响其他打印机的任务分配；
+  没有报告负载的旧客户端按并发数 1 计算
+- affinity: 优先选择拥有任务指定打印机的客户端，其次按负载选择
+- round_robin: 按连接顺序轮流分配
+- 返回完整的候选顺序，首选客户端发送失败时依次换下一个
+"""
+
+
+POLICY_LEAST_LOADED = 'least_loaded'
+POLICY_AFFINITY = 'affinity'
+POLICY_ROUND_ROBIN = 'round_robin'
+SCHEDULE_POLICIES = (POLICY_LEAST_LOADED, POLICY_AFFINITY, POLICY_ROUND_ROBIN)
+
+
+def client_load(info, printer=None):
+    """客户端的负载：未完成的任务数除以并发数
+
+    未完成的任务包括已发送但客户端还未加入本地队列的任务，以及客户端报告的排队和进行中的任务；
+    指定打印机且客户端报告了该打印机时只计算该打印机，否则合计所有打印机；没有报告时并发数按 1 计算
+    """
+    printers = info.get('printer_load', {})
+    if printer in printers:
+        printers = {printer: printers[printer]}
+    outstanding = len(info['jobs']) + sum(load['queued'] + load['inflight'] for load in printers.values())
+    concurrency = sum(load['concurrency'] for load in printers.values())
+    return outstanding / max(concurrency, 1)
+
+
+def job_printer(data):
+    """任务指定的打印机（请求的 printer 字段或 settings.printer）"""
+    printer = data.get('printer')
+    if not printer and isinstance(data.get('settings'), dict):
+        printer = data['settings'].get('printer')
+    return printer or None
+
+
+class JobScheduler:
+    def __init__(self, policy=POLICY_LEAST_LOADED):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"未知的调度策略: {policy}")
+        self.policy = policy
+        self._cursors = {}  # username -> 轮询位置
+
+    def order(self, username, candidates, printer=None):
+        """返回按优先级排序的候选客户端 [(client_id, 客户端信息), ...]"""
+        candidates = list(candidates)
+        if len(candidates) <= 1:
+            return candidates
+
+        if self.policy == POLICY_ROUND_ROBIN:
+            candidates.sort(key=lambda item: item[1]['connected_at'])
+            start = self._cursors.get(username, 0) % len(candidates)
+            self._cursors[username] = start + 1
+            return candidates[start:] + candidates[:start]
+
+        by_load = sorted(candidates, key=lambda item: (client_load(item[1], printer), item[1]['connected_at']))
+        if self.policy == POLICY_AFFINITY and printer:
+            matched = [item for item in by_load if printer in item[1]['printers']]
+            others = [item for item in by_load if printer not in item[1]['printers']]
+            return matched + others
+        return by_load
+
+    def forget(self, username):
+        """用户没有在线客户端时清除轮询位置"""
+        self._cursors.pop(username, None)
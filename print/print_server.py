@@ -5,8 +5,26 @@
 - 接收前端的打印请求
 - 转发到本地打印客户端
 - 提供WebSocket连接
-- 使用账号密码进行认证
+- 使用账号密码进行认证（通过 Markdown 编辑器后端验证，结果缓存在进程内）
+- 认证成功后签发短期会话令牌，之后的消息只需携带令牌或在同一连接上直接发送
 - 提供API接口验证客户端连接
+- 打印客户端离线时持久化任务，客户端上线后自动转发
+- 支持确认的客户端按至少一次语义投递，断线重连后重新投递未确认的任务
+- 同一用户可以绑定多台打印客户端，按负载（包括客户端报告的每台打印机队列长度）、打印机或轮询选择客户端，发送失败时换下一台
+- 多进程模式：多个工作进程共享监听端口，通过路由后端把任务转发到持有打印客户端的进程
+- 每个连接使用有界发送队列，慢速连接按溢出策略丢弃/合并状态消息或被断开
+- 可选的 Prometheus 监控指标接口（连接数、消息数、任务转发耗时）
+- 消息按类型分派到处理函数，处理前按预编译的规则校验字段，支持协议版本协商
+- 信封帧格式的打印请求只解析头部，文档内容原样转发，不重新编码
+- 大文档可以分块传输，服务器按打印客户端给出的额度逐块转发，不缓存整个文档
+- 每个连接可以协商 MessagePack 编码和 deflate/zstd 压缩，未协商的连接仍使用 JSON 文本帧
+- 定期检查打印客户端的活跃时间，向空闲的客户端发送心跳，超时无响应的连接立即移除并重新分配任务
+- 前端连接和用户分别按令牌桶限流，全局进行中任务数超过上限时回复 busy，避免单个用户拖慢所有人
+- 收到 SIGTERM/SIGINT 后进入排空模式：停止监听、拒绝新任务、等待进行中的任务转发完成，
+  再通知客户端在随机延迟（reconnect_after）后重连，避免所有客户端同时重连
+- 平滑重启：SIGHUP 时把监听 socket 交给新启动的进程（文件描述符继承）后排空；
+  多进程模式下主进程逐个启动新工作进程并排空旧进程，重启期间不中断监听
+- 日志通过后台线程写出，消息内容只记录隐藏密码和文档内容后的预览
 """
 
 import asyncio
@@ -18,6 +36,50 @@ import argparse
 from datetime import datetime, timedelta
 import ssl
 import socket
+import signal
+import random
+import subprocess
+import uuid
+
+from print_registry import ConnectionRegistry
+from print_job_store import JobStore, DEFAULT_JOB_TTL
+from print_broker import BrokerHub, LocalBroker, create_broker
+from print_scheduler import JobScheduler, SCHEDULE_POLICIES, POLICY_LEAST_LOADED, job_printer
+from print_outbound import OutboundQueue, QueueClosed, OVERFLOW_POLICIES, POLICY_DROP_OLDEST
+from print_metrics import MetricsRegistry, JobTimer, serve_metrics
+from print_logging import setup_logging, get_logger, preview
+from print_protocol import (ProtocolError, SCHEMAS, validate_frame, negotiate_version,
+                            PROTOCOL_VERSION, MIN_PROTOCOL_VERSION, ENVELOPE_TYPES,
+                            split_envelope, check_envelope_body, make_envelope, envelope_to_json,
+                            payload_header, MAX_MESSAGE_SIZE)
+from print_stream import (StreamError, StreamState, StreamTable, STREAM_TYPES, STREAM_CAPABILITY,
+                          ENCODINGS)
+from print_codec import (WireFormat, decode_frame, negotiate_wire, available_codecs, available_compression,
+                         DEFAULT_COMPRESS_THRESHOLD)
+from print_ratelimit import RateLimiter
+from print_auth import (CachedVerifier, StubVerifier, TokenSigner, create_verifier,
+                        DEFAULT_AUTH_URL, DEFAULT_TOKEN_TTL, TOKEN_SECRET_ENV)
+
+
+logger = get_logger('print_server')
+
+DEFAULT_DATA_DIR = os.path.join(os.path.expanduser('~'), '.print_server')
+WORKER_START_GRACE = 1.0  # 平滑重启时新工作进程开始监听所需的时间（秒）
+STREAM_FOLLOW_TYPES = ('print_chunk', 'print_end', 'print_abort')  # 分块传输开始后的消息
+HANDSHAKE_GRACE = 0.5  # 排空时停止接受连接后，等待已接受的连接完成握手的时间（秒）
+
+
+class ClientConnection:
+    """单个 WebSocket 连接的状态"""
+
+    __slots__ = ('websocket', 'client_type', 'protocol', 'streams', 'bucket')
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.client_type = "前端客户端"
+        self.protocol = MIN_PROTOCOL_VERSION  # 未协商时按最早的协议版本处理
+        self.streams = {}  # 该连接发起的分块传输: job_id -> username
+        self.bucket = None  # 前端连接的令牌桶（不限流时为 None）
 
 
 def is_port_available(host, port):
@@ -42,324 +104,1481 @@ def find_available_port(host, start_port, max_port=9000):
 
 
 class PrintServer:
-    def __init__(self, host='127.0.0.1', port=8770, auto_find_port=False):
+    def __init__(self, host='127.0.0.1', port=8770, auto_find_port=False,
+                 data_dir=None, job_ttl=DEFAULT_JOB_TTL, drain_batch=50,
+                 worker_id=None, broker=None, reuse_port=False, requeue_on_start=True,
+                 send_timeout=5.0, outbound_queue_size=256, overflow_policy=POLICY_DROP_OLDEST,
+                 metrics_host='127.0.0.1', metrics_port=None, verifier=None, token_signer=None,
+                 schedule=POLICY_LEAST_LOADED, codecs=None, compression=None,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD, ping_interval=20.0, ping_timeout=20.0,
+                 listen_fd=None, drain_timeout=10.0, reconnect_jitter=5.0,
+                 user_rate=20.0, user_burst=50, conn_rate=20.0, conn_burst=50, max_inflight=1000,
+                 busy_retry_after=1.0):
         self.host = host
-        # 如果端口被占用且允许自动查找，则查找可用端口
-        if not is_port_available(host, port):
+        # 继承的监听 socket（平滑重启或 systemd socket 激活）和共享端口的工作进程不检查端口
+        # 旧进程进入排空模式时会立即关闭监听，重启时无需等待端口释放
+        if listen_fd is None and not reuse_port and not is_port_available(host, port):
             if auto_find_port:
                 original_port = port
                 port = find_available_port(host, port)
-                print(f"端口 {original_port} 已被占用，自动使用可用端口: {port}")
+                logger.info("端口 %s 已被占用，自动使用可用端口: %s", original_port, port)
             else:
-                # 即使不允许自动查找，也尝试等待一下（可能是 PM2 快速重启导致旧进程还没释放）
-                print(f"端口 {port} 已被占用，等待 2 秒后重试...")
-                import time
-                time.sleep(2)
-                if not is_port_available(host, port):
-                    print(f"❌ 端口 {port} 仍然被占用，请检查是否有其他进程正在使用该端口。")
-                    print(f"可以使用 'lsof -i :{port}' 或 'netstat -nlp | grep {port}' 检查。")
-                    # 抛出异常，让程序失败而不是静默切换到错误端口
-                    raise OSError(f"端口 {port} 已被占用")
+                logger.error("❌ 端口 %s 已被占用，请检查是否有其他进程正在使用该端口。", port)
+                logger.error("可以使用 'lsof -i :%s' 或 'netstat -nlp | grep %s' 检查。", port, port)
+                # 抛出异常，让程序失败而不是静默切换到错误端口
+                raise OSError(f"端口 {port} 已被占用")
         
         self.port = port
         self.local_client_url = "ws://localhost:8771"  # 默认新客户端端口
         self.connections = set()
-        self.clients = {}  # 存储已绑定的打印客户端
-        self.user_bindings = {}  # 存储用户与客户端的永久绑定关系
-        print(f"初始化打印服务器: {host}:{port}")
-
-    def validate_user_credentials(self, username, password):
-        """验证用户凭证"""
-        # 这里可以添加更复杂的用户验证逻辑
-        # 目前我们假设所有提供的用户名和密码都是有效的
-        # 实际应用中应该与用户系统集成
-        return True
+        self.registry = ConnectionRegistry()  # 已绑定的打印客户端及用户绑定关系
+        self.scheduler = JobScheduler(schedule)  # 同一用户有多台打印客户端时选择接收任务的客户端
+        # 离线任务队列（未指定数据目录时不启用）
+        self.job_store = JobStore(data_dir, ttl=job_ttl) if data_dir else None
+        self.drain_batch = drain_batch
+        self._draining_users = set()
+        # 多进程路由（单进程时所有路由都在本进程内完成）
+        self.worker_id = worker_id
+        self.broker = broker or LocalBroker(worker_id or '0')
+        self.reuse_port = reuse_port
+        self.requeue_on_start = requeue_on_start
+        self.send_timeout = send_timeout  # 单个连接的发送超时（秒），超时视为慢速连接
+        # 每个连接的发送队列
+        self.outbound = {}  # websocket -> OutboundQueue
+        self.outbound_queue_size = outbound_queue_size
+        self.overflow_policy = overflow_policy
+        self.outbound_totals = {'sent': 0, 'dropped': 0, 'coalesced': 0, 'evicted': 0}
+        # 监控指标（指定端口时才对外提供）
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.job_timer = JobTimer()
+        # 用户凭证验证（未指定时使用接受所有凭证的本地验证器）
+        self.verifier = verifier or CachedVerifier(StubVerifier())
+        self.token_signer = token_signer or TokenSigner()
+        self.sessions = {}  # websocket -> 已通过 auth 认证的用户名
+        self.streams = StreamTable()  # 进行中的分块传输
+        # 允许协商的编码和压缩方式（默认当前环境全部可用的格式）
+        self.codecs = codecs or available_codecs()
+        self.compression = compression or available_compression()
+        self.compress_threshold = compress_threshold
+        self.wire_formats = {}  # websocket -> 协商后的 WireFormat，未协商的连接使用 JSON 文本帧
+        # 心跳：空闲超过 ping_interval 秒的打印客户端发送 ping，再过 ping_timeout 秒仍无响应视为失联
+        self.ping_interval = ping_interval or None
+        self.ping_timeout = ping_timeout or None
+        self.clients_evicted = 0
+        self._probing = set()  # 正在等待心跳响应的连接
+        # 限流与准入控制
+        self.user_limiter = RateLimiter(user_rate, user_burst)  # 每个用户的打印请求和状态查询
+        self.conn_limiter = RateLimiter(conn_rate, conn_burst)  # 每个前端连接的消息
+        self.max_inflight = max_inflight  # 全局进行中任务数上限，0 表示不限制
+        self.busy_retry_after = busy_retry_after
+        # 排空与平滑重启
+        self.listen_fd = listen_fd
+        self.drain_timeout = drain_timeout  # 排空时等待进行中任务的最长时间（秒）
+        self.reconnect_jitter = reconnect_jitter  # 通知客户端重连的随机延迟上限（秒）
+        self.draining = False
+        self.allow_handoff = False  # 是否响应 SIGHUP 把监听 socket 交给新进程（多进程模式的工作进程不响应）
+        self._stopping = None
+        self._handoff = False
+        self.setup_metrics()
+        self.setup_dispatch()
+        logger.info("初始化打印服务器: %s:%s", host, port)
+        if worker_id is not None:
+            logger.info("工作进程: %s", worker_id)
+        if self.job_store:
+            logger.info("离线任务队列: %s (保留 %s 秒)", self.job_store.path, job_ttl)
+
+    def setup_metrics(self):
+        """注册监控指标"""
+        self.metrics = MetricsRegistry()
+        m = self.metrics
+        m.gauge('print_relay_connections', '当前 WebSocket 连接数', func=lambda: len(self.connections))
+        m.gauge('print_relay_clients', '当前已认证的打印客户端数', func=lambda: len(self.registry))
+        m.gauge('print_relay_client_jobs', '已发送给打印客户端、尚未报告结果的任务数',
+                func=lambda: self.registry.job_count)
+        m.gauge('print_relay_client_queued', '打印客户端报告的本地队列中等待打印的任务数',
+                func=lambda: sum(load['queued'] for info in self.registry.clients.values()
+                                 for load in info['printer_load'].values()))
+        m.gauge('print_relay_rate_limited_users', '正在跟踪限流额度的用户数', func=lambda: len(self.user_limiter))
+        self.rejected_total = m.counter('print_relay_rejected_total', '被限流、准入控制或排空拒绝的请求数', ['reason'])
+        m.gauge('print_relay_streams', '进行中的分块传输数', func=lambda: len(self.streams))
+        m.gauge('print_relay_jobs_in_progress', '已收到请求、尚未提交到打印队列的任务数',
+                func=lambda: len(self.job_timer))
+        self.messages_total = m.counter('print_relay_messages_total', '收到的消息数（按类型）', ['type'])
+        self.jobs_total = m.counter('print_relay_jobs_total', '打印请求的处理结果', ['route'])
+        self.forward_seconds = m.histogram('print_relay_job_forward_seconds',
+                                           '从收到打印请求到发送给打印客户端（或转发、入队）的耗时', ['route'])
+        m.counter('print_relay_auth_cache_hits_total', '凭证验证命中缓存的次数',
+                  func=lambda: getattr(self.verifier, 'hits', 0))
+        m.counter('print_relay_auth_cache_misses_total', '凭证验证请求后端的次数',
+                  func=lambda: getattr(self.verifier, 'misses', 0))
+        self.queued_seconds = m.histogram('print_relay_job_queued_seconds',
+                                          '从收到打印请求到客户端回报 print_queued 的耗时')
+        m.gauge('print_relay_outbound_depth', '所有连接发送队列中积压的消息数',
+                func=lambda: self.outbound_stats()['depth'])
+        m.gauge('print_relay_outbound_max_depth', '当前连接中发送队列的最大积压',
+                func=lambda: self.outbound_stats()['max_depth'])
+        m.counter('print_relay_outbound_dropped_total', '发送队列溢出时丢弃的状态消息数',
+                  func=lambda: self.outbound_stats()['dropped'])
+        m.counter('print_relay_outbound_coalesced_total', '发送队列中被合并的状态消息数',
+                  func=lambda: self.outbound_stats()['coalesced'])
+        m.counter('print_relay_outbound_evicted_total', '因发送过慢被断开的连接数',
+                  func=lambda: self.outbound_stats()['evicted'])
+        m.counter('print_relay_clients_evicted_total', '因心跳超时被移除的打印客户端数',
+                  func=lambda: self.clients_evicted)
+
+    def record_forward(self, username, job_id, route):
+        """记录打印请求的处理结果及耗时"""
+        self.jobs_total.inc(route=route)
+        elapsed = self.job_timer.elapsed(username, job_id)
+        if elapsed is not None:
+            self.forward_seconds.observe(elapsed, route=route)
+        if route in ('queued', 'failed'):
+            # 离线排队的任务不计入提交到打印队列的耗时
+            self.job_timer.finish(username, job_id)
+
+    async def authenticate(self, websocket, data):
+        """确定消息所属用户，返回用户名，认证失败返回 None
+
+        依次使用：消息中的会话令牌（只做本地签名校验）、账号密码、连接上已完成的 auth 认证
+        """
+        token = data.get('token')
+        if token is not None:
+            return self.token_signer.verify(token)
+        username = data.get('username')
+        if data.get('password') is not None:
+            if await self.validate_user_credentials(username, data.get('password')):
+                return username
+            return None
+        return self.sessions.get(websocket)
+
+    def auth_reply(self, username, message, protocol_version=MIN_PROTOCOL_VERSION):
+        """认证成功的回复，附带新的会话令牌和协商后的协议版本"""
+        token, expires_in = self.token_signer.issue(username)
+        return {
+            'type': 'auth_success',
+            'username': username,
+            'token': token,
+            'expires_in': expires_in,
+            'protocol_version': protocol_version,
+            'message': message
+        }
+
+    async def validate_user_credentials(self, username, password):
+        """验证用户凭证，验证服务不可用时视为验证失败"""
+        try:
+            return await self.verifier.verify(username, password)
+        except Exception as e:
+            logger.warning("验证用户 %s 的凭证时出错: %s", username, e)
+            return False
 
     async def notify_frontend_clients(self):
         """通知所有前端客户端打印客户端状态变化"""
-        client_connected = len(self.clients) > 0
+        client_connected = len(self.registry) > 0
         status_data = {
             'type': 'client_status',
             'connected': client_connected,
-            'clients': list(self.clients.keys()),
+            'clients': self.registry.client_ids(),
             'message': '打印客户端已连接' if client_connected else '打印客户端已断开'
         }
 
-        for connection in list(self.connections):
+        failed = self.broadcast_json(self.connections, status_data, key=('client_status',))
+        if failed:
+            logger.warning("通知前端客户端时有 %s 个连接发送失败，已移除", len(failed))
+
+    def open_outbound(self, websocket):
+        """为连接创建发送队列并启动写协程"""
+        queue = OutboundQueue(websocket, maxsize=self.outbound_queue_size, policy=self.overflow_policy,
+                              send_timeout=self.send_timeout, on_evict=self._on_outbound_evict)
+        self.outbound[websocket] = queue.start()
+        return queue
+
+    def close_outbound(self, websocket):
+        """连接断开后停止写协程，并把该连接的统计计入总数"""
+        queue = self.outbound.pop(websocket, None)
+        if queue is None:
+            return
+        queue.close()
+        for name in ('sent', 'dropped', 'coalesced'):
+            self.outbound_totals[name] += getattr(queue, name)
+
+    def _on_outbound_evict(self, queue, reason):
+        self.outbound_totals['evicted'] += 1
+        self.connections.discard(queue.websocket)
+        logger.warning("⚠️ 慢速连接已断开: %s，原因: %s（积压 %s 条）", queue.websocket.remote_address, reason, queue.depth)
+
+    def outbound_stats(self):
+        """发送队列统计：当前积压、历史最大积压、丢弃/合并的状态消息及断开的慢速连接数"""
+        queues = list(self.outbound.values())
+        stats = dict(self.outbound_totals)
+        for name in ('sent', 'dropped', 'coalesced'):
+            stats[name] += sum(getattr(queue, name) for queue in queues)
+        stats['queues'] = len(queues)
+        stats['depth'] = sum(queue.depth for queue in queues)
+        stats['max_depth'] = max((queue.max_depth for queue in queues), default=0)
+        return stats
+
+    def send_frame(self, websocket, message, key=None, packed=False):
+        """把消息放入连接的发送队列，不等待发送；key 不为 None 的状态消息在溢出时可被丢弃或合并
+
+        message 为 JSON 文本，按连接协商的格式压缩；packed 为 True 时表示已经按该连接的格式编码
+        """
+        queue = self.outbound.get(websocket)
+        if queue is None:
+            return False
+        wire = self.wire_formats.get(websocket)
+        if wire is not None and not packed:
+            message = wire.pack_text(message)
+        return queue.put(message, key)
+
+    def send_json(self, websocket, data, key=None):
+        wire = self.wire_formats.get(websocket)
+        if wire is None:
+            return self.send_frame(websocket, json.dumps(data, ensure_ascii=False), key)
+        return self.send_frame(websocket, wire.encode(data), key, packed=True)
+
+    async def deliver_frame(self, websocket, message):
+        """把消息放入发送队列并等待实际写出，失败时抛出异常（用于投递打印任务）"""
+        queue = self.outbound.get(websocket)
+        if queue is None:
+            raise QueueClosed()
+        wire = self.wire_formats.get(websocket)
+        if wire is not None:
+            message = wire.pack_text(message)
+        await queue.put(message, wait=True)
+
+    def broadcast_frame(self, connections, message, key=None):
+        """把同一帧（只序列化一次）放入多个连接的发送队列
+
+        返回入队失败（连接已关闭或因积压被断开）的连接
+        """
+        failed = []
+        for connection in list(connections):
+            if not self.send_frame(connection, message, key):
+                failed.append(connection)
+                self.connections.discard(connection)
+        return failed
+
+    def broadcast_json(self, connections, data, key=None):
+        """广播消息对象：每种协商格式只编码一次，未协商的连接共用同一个 JSON 文本帧"""
+        text = json.dumps(data, ensure_ascii=False)
+        encoded = {}
+        failed = []
+        for connection in list(connections):
+            wire = self.wire_formats.get(connection)
+            if wire is None:
+                sent = self.send_frame(connection, text, key)
+            else:
+                fmt = (wire.codec, wire.compression, wire.threshold)
+                if fmt not in encoded:
+                    encoded[fmt] = wire.encode(data)
+                sent = self.send_frame(connection, encoded[fmt], key, packed=True)
+            if not sent:
+                failed.append(connection)
+                self.connections.discard(connection)
+        return failed
+
+    def job_payload(self, data, body=None):
+        """转发给打印客户端及持久化的任务内容（不包含用户密码和令牌）
+
+        信封帧只重新生成头部，消息体（文档内容）原样保留
+        """
+        fields = {k: v for k, v in data.items() if k not in ('password', 'token')}
+        if body is not None:
+            return make_envelope(fields, body)
+        return json.dumps(fields, ensure_ascii=False)
+
+    @staticmethod
+    def frame_for(client_info, payload):
+        """按打印客户端的能力选择发送格式：不支持信封帧的客户端收到拼接后的普通 JSON"""
+        if 'envelope' in client_info['capabilities']:
+            return payload
+        envelope = split_envelope(payload)
+        if envelope is None:
+            return payload
+        return envelope_to_json(*envelope)
+
+    async def track_delivery(self, username, client_id, client_info, job_id, payload):
+        """投递前为支持确认的客户端记录未确认任务，返回是否已记录"""
+        if not self.job_store or 'ack' not in client_info['capabilities']:
+            return False
+        try:
+            await self.job_store.enqueue(username, job_id, payload, client_id=client_id)
+            return True
+        except Exception as e:
+            logger.warning("记录未确认任务失败: %s", e)
+            return False
+
+    async def queue_offline_job(self, username, job_id, payload):
+        """打印客户端离线时保存任务，返回是否成功"""
+        if not self.job_store:
+            return False
+        try:
+            await self.job_store.enqueue(username, job_id, payload)
+            logger.info("打印任务已加入离线队列: 用户 %s, 任务 %s", username, job_id)
+            return True
+        except Exception as e:
+            logger.warning("保存离线任务失败: %s", e)
+            return False
+
+    async def dispatch_job(self, username, job_id, payload, data, stream=False):
+        """按调度策略把任务发送给本进程内该用户的打印客户端，发送失败时依次换下一台
+
+        stream 为 True 时只选择支持分块传输的客户端，且不记录未确认任务（文档内容不经过服务器保存）
+        返回接收任务的 client_id；没有在线客户端或全部发送失败时返回 None
+        """
+        candidates = self.registry.clients_for_user(username)
+        if stream:
+            candidates = [item for item in candidates if STREAM_CAPABILITY in item[1]['capabilities']]
+        candidates = self.scheduler.order(username, candidates, job_printer(data))
+        for client_id, client_info in candidates:
+            # 支持确认的客户端先记录为未确认任务，确认后删除
+            tracked = not stream and await self.track_delivery(username, client_id, client_info, job_id, payload)
+            self.registry.assign_job(client_id, job_id)
             try:
-                await connection.send(json.dumps(status_data, ensure_ascii=False))
+                await self.deliver_frame(client_info['websocket'], self.frame_for(client_info, payload))
+                return client_id
             except Exception as e:
-                print(f"通知前端客户端时出错: {str(e)}")
+                logger.warning("发送打印任务 %s 到客户端 %s 失败: %s", job_id, client_id, str(e) or e.__class__.__name__)
+                self.registry.complete_job(client_id, job_id)
+                if tracked:
+                    # 任务改由其他客户端处理，撤销对该客户端的未确认记录，避免其重连后重复打印
+                    await self.job_store.ack(username, job_id)
+        return None
+
+    async def drain_offline_jobs(self, username, client_id):
+        """客户端认证后按批次转发离线队列及未确认的任务"""
+        client_info = self.registry.get_client(client_id)
+        if not self.job_store or client_info is None or username in self._draining_users:
+            return
+        websocket = client_info['websocket']
+        ack_enabled = 'ack' in client_info['capabilities']
+        self._draining_users.add(username)
+        total = 0
+        try:
+            while True:
+                # 整批认领并标记为已投递到该客户端，其他进程不会再取到这些任务；
+                # 支持确认的客户端确认后删除，发送失败的任务在断线后重新投递
+                batch = await self.job_store.claim_batch(username, client_id, self.drain_batch)
+                if not batch:
+                    break
+                sent_ids = []
+                failed = False
+                # 整批放入发送队列，由写协程按顺序发送
+                results = await asyncio.gather(
+                    *(self.deliver_frame(websocket, self.frame_for(client_info, payload)) for _, _, payload in batch),
+                    return_exceptions=True
+                )
+                for (row_id, job_id, payload), result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        logger.warning("转发离线任务 %s 失败: %s", job_id, str(result) or result.__class__.__name__)
+                        failed = True
+                        break
+                    sent_ids.append(row_id)
+                    self.registry.assign_job(client_id, job_id)
+                if not ack_enabled:
+                    # 不支持确认的客户端：整批已转发的任务在一个事务中删除，未发送的在断线后重新投递
+                    await self.job_store.delete(sent_ids)
+                total += len(sent_ids)
+                for row_id, job_id, payload in batch[:len(sent_ids)]:
+                    await self.route_job_status(username, {
+                        'type': 'print_status',
+                        'job_id': job_id,
+                        'message': '打印客户端已上线，离线任务已发送，等待处理...'
+                    })
+                if failed or len(batch) < self.drain_batch:
+                    break
+        except Exception as e:
+            logger.warning("转发离线任务时出错: %s", e)
+        finally:
+            self._draining_users.discard(username)
+        if total:
+            logger.info("✅ 已向用户 %s 的客户端转发 %s 个离线任务", username, total)
+
+    async def purge_expired_jobs(self, interval=600):
+        """定期清理过期的离线任务"""
+        while True:
+            try:
+                removed = await self.job_store.purge_expired()
+                if removed:
+                    logger.info("已清理 %s 个过期的离线任务", removed)
+            except Exception as e:
+                logger.warning("清理过期离线任务失败: %s", e)
+            await asyncio.sleep(interval)
+
+    async def probe_client(self, websocket):
+        """向空闲的打印客户端发送心跳，收到响应后更新活跃时间"""
+        try:
+            pong = await websocket.ping()
+            await asyncio.wait_for(pong, self.ping_timeout)
+        except Exception:
+            return  # 没有响应，由清理任务在超时后移除
+        finally:
+            self._probing.discard(websocket)
+        self.registry.touch(websocket)
+
+    async def reap_stale_clients(self):
+        """定期检查打印客户端：空闲超过心跳间隔的发送心跳，超过心跳间隔加超时仍无响应的立即移除"""
+        period = max(min(self.ping_interval, self.ping_timeout) / 2, 0.5)
+        while True:
+            await asyncio.sleep(period)
+            try:
+                for client_id, info in self.registry.idle_clients(self.ping_interval + self.ping_timeout):
+                    await self.evict_client(client_id, info['websocket'])
+                for _, info in self.registry.idle_clients(self.ping_interval):
+                    websocket = info['websocket']
+                    if websocket not in self._probing:
+                        self._probing.add(websocket)
+                        asyncio.ensure_future(self.probe_client(websocket))
+            except Exception as e:
+                logger.warning("检查打印客户端心跳失败: %s", e)
+
+    async def evict_client(self, client_id, websocket):
+        """移除失联的打印客户端：立即停止向其路由任务并重新分配，然后直接关闭底层连接（不等待关闭握手）"""
+        logger.warning("⚠️ 打印客户端 %s 超过 %s 秒无响应，断开连接并重新分配任务",
+                       client_id, self.ping_interval + self.ping_timeout)
+        self.clients_evicted += 1
+        await self.release_print_client(websocket)
+        transport = getattr(websocket, 'transport', None)
+        if transport is not None:
+            transport.abort()
+
+    async def release_print_client(self, websocket):
+        """打印客户端断开或失联后移除其绑定：中止发往它的分块传输，释放未确认的任务，
+        交给该用户的其他在线客户端或等待重连；返回被移除的 client_id
+        """
+        # 通过反向索引移除断开连接的打印客户端
+        username = self.registry.username_for(websocket)
+        client_id = self.registry.unbind_websocket(websocket)
+        if client_id is None:
+            return None
+        logger.info("打印客户端已断开连接: %s", client_id)
+        for state in self.streams.for_client(client_id):
+            await self.abort_stream(state, '打印客户端已断开连接，文档传输中断', 'stream_failed')
+        try:
+            await self.broker.release(username, client_id)
+        except Exception as e:
+            logger.warning("释放路由绑定失败: %s", e)
+        if self.job_store:
+            # 未确认的任务重新标记为待投递，客户端重连后重新发送
+            try:
+                released = await self.job_store.release(client_id)
+                if released:
+                    logger.info("客户端 %s 有 %s 个未确认任务，将在重连后重新投递", client_id, released)
+            except Exception as e:
+                logger.warning("重置未确认任务失败: %s", e)
+        candidates = self.scheduler.order(username, self.registry.clients_for_user(username))
+        if candidates:
+            # 该用户还有其他在线客户端，未确认的任务立即交给负载最低的一台
+            await self.drain_offline_jobs(username, candidates[0][0])
+        else:
+            self.scheduler.forget(username)
+        # 通知前端
+        await self.notify_frontend_clients()
+        return client_id
+
+    async def forward_to_worker(self, username, job_id, payload):
+        """用户的打印客户端连接在其他工作进程上时，通过路由后端转发任务
+
+        返回接收任务的工作进程标识，没有可用的工作进程时返回 None
+        """
+        try:
+            workers = await self.broker.owners(username)
+        except Exception as e:
+            logger.warning("查询用户 %s 的路由失败: %s", username, e)
+            return None
+        for worker_id in workers:
+            try:
+                if await self.broker.send(worker_id, {
+                    'op': 'deliver',
+                    'username': username,
+                    'job_id': job_id,
+                    'payload': payload,
+                    'origin': self.broker.worker_id
+                }):
+                    logger.info("打印任务 %s 已转发到工作进程 %s", job_id, worker_id)
+                    return worker_id
+            except Exception as e:
+                logger.warning("转发任务到工作进程 %s 失败: %s", worker_id, e)
+        return None
+
+    async def on_broker_message(self, message):
+        """处理其他工作进程转发来的消息"""
+        try:
+            op = message.get('op')
+            if op == 'deliver':
+                await self.deliver_forwarded_job(message)
+            elif op in ('job_status', 'user_status'):
+                await self.route_job_status(message['username'], message['data'], from_broker=True)
+        except Exception as e:
+            logger.warning("处理工作进程消息时出错: %s", e)
+
+    async def deliver_forwarded_job(self, message):
+        """投递其他工作进程转发来的任务，客户端已不在本进程时加入离线队列"""
+        username = message['username']
+        job_id = message['job_id']
+        payload = message['payload']
+        self.registry.track_remote_job(username, job_id, message['origin'])
+
+        header = payload_header(payload)
+        if header.get('type') in STREAM_TYPES:
+            await self.relay_forwarded_stream(username, job_id, payload, header)
+            return
+
+        client_id = await self.dispatch_job(username, job_id, payload, header)
+        if client_id is not None:
+            logger.info("✅ 转发来的打印任务已发送到客户端: %s", client_id)
+            return
+
+        if await self.queue_offline_job(username, job_id, payload):
+            await self.route_job_status(username, {
+                'type': 'print_status',
+                'job_id': job_id,
+                'queued': True,
+                'message': '打印客户端当前离线，任务已加入队列，客户端上线后将自动打印'
+            })
+        else:
+            await self.route_job_status(username, {
+                'type': 'error',
+                'job_id': job_id,
+                'message': '无法连接到打印客户端，请确保客户端已启动并使用您的账号密码绑定'
+            })
+
+    async def relay_forwarded_stream(self, username, job_id, frame, header):
+        """转发其他工作进程发来的分块传输消息，额度与序号由接收发送方连接的进程检查"""
+        message_type = header['type']
+        if message_type == 'print_begin':
+            state = StreamState(username, job_id)
+            try:
+                self.streams.open(state)
+            except StreamError as e:
+                await self.route_job_status(username, {'type': 'error', 'job_id': job_id, 'code': e.code, 'message': e.message})
+                return
+            state.client_id = await self.dispatch_job(username, job_id, frame, header, stream=True)
+            if state.client_id is None:
+                self.streams.close(username, job_id)
+                await self.route_job_status(username, {
+                    'type': 'error',
+                    'job_id': job_id,
+                    'code': 'stream_unavailable',
+                    'message': '没有在线的支持分块传输的打印客户端，请改用普通打印请求'
+                })
+            return
+
+        state = self.streams.get(username, job_id)
+        if state is None:
+            return
+        if message_type in ('print_end', 'print_abort'):
+            self.streams.close(username, job_id)
+        if message_type == 'print_abort':
+            await self.forward_stream_frame(state, frame)
+            await self.release_stream_job(state)
+        elif not await self.forward_stream_frame(state, frame):
+            await self.abort_stream(state, '与打印客户端的连接中断', 'stream_failed')
+
+    async def forward_stream_frame(self, state, frame):
+        """把分块传输的消息转发给目标打印客户端（本进程内或其他工作进程），返回是否成功"""
+        if state.worker is not None:
+            return await self.broker.send(state.worker, {
+                'op': 'deliver',
+                'username': state.username,
+                'job_id': state.job_id,
+                'payload': frame,
+                'origin': self.broker.worker_id
+            })
+        client_info = self.registry.get_client(state.client_id) if state.client_id is not None else None
+        if client_info is None:
+            return False
+        try:
+            await self.deliver_frame(client_info['websocket'], frame)
+            return True
+        except Exception as e:
+            logger.warning("转发分块传输 %s 失败: %s", state.job_id, str(e) or e.__class__.__name__)
+            return False
+
+    async def abort_stream(self, state, message, code='stream_aborted', notify=True):
+        """中止分块传输：通知打印客户端删除缓冲文件，notify 为 True 时向发送方报告错误"""
+        self.streams.close(state.username, state.job_id)
+        await self.forward_stream_frame(state, json.dumps({
+            'type': 'print_abort',
+            'job_id': state.job_id,
+            'message': message
+        }, ensure_ascii=False))
+        await self.release_stream_job(state)
+        if notify:
+            await self.route_job_status(state.username, {
+                'type': 'error',
+                'job_id': state.job_id,
+                'code': code,
+                'message': message
+            })
+
+    async def release_stream_job(self, state):
+        """中止的分块传输不会再收到打印客户端的结果，释放它占用的客户端负载和未确认记录"""
+        if state.client_id is not None:
+            self.registry.complete_job(state.client_id, state.job_id)
+        if self.job_store:
+            await self.job_store.ack(state.username, state.job_id)
+
+    async def route_job_status(self, username, data, from_broker=False):
+        """将打印客户端的任务状态发送给任务的发起连接，未知任务则发送给该用户的订阅者"""
+        job_id = data.get('job_id')
+        origin = self.registry.job_origin(username, job_id) if job_id is not None else None
+        remote_worker = None
+        if origin is None and job_id is not None and not from_broker:
+            remote_worker = self.registry.remote_origin(username, job_id)
+        if data.get('type') == 'print_credit':
+            # 打印客户端归还的额度记在接收发送方连接的进程上，再转发给发送方
+            state = self.streams.get(username, job_id)
+            if state is not None and state.origin is not None:
+                state.credits += data['credits']
+        if data.get('type') in ('print_queued', 'error') and job_id is not None:
+            # 任务已结束，移除路由记录
+            self.registry.finish_job(username, job_id)
+            self.streams.close(username, job_id)
+            elapsed = self.job_timer.finish(username, job_id)
+            if elapsed is not None and data.get('type') == 'print_queued':
+                self.queued_seconds.observe(elapsed)
+
+        if origin is not None:
+            targets = [origin]
+        else:
+            targets = list(self.registry.subscribers(username))
+            if remote_worker is not None:
+                # 任务由其他工作进程发起，交给该进程转发给前端
+                if await self.broker.send(remote_worker, {'op': 'job_status', 'username': username, 'data': data}):
+                    return
+            elif not from_broker:
+                # 未知任务：其他工作进程上订阅该用户的前端也需要收到
+                await self.broker.broadcast({'op': 'user_status', 'username': username, 'data': data})
+
+        if not targets:
+            logger.info("用户 %s 没有订阅状态的连接，丢弃状态消息", username)
+            return
+
+        failed = self.broadcast_json(targets, data, key=self.status_key(data))
+        if failed:
+            logger.warning("转发状态消息时有 %s 个连接发送失败", len(failed))
+
+    @staticmethod
+    def status_key(data):
+        """可丢弃/合并的状态消息的键：同一任务的进度消息只需保留最新一条"""
+        if data.get('type') == 'print_status' and data.get('job_id') is not None:
+            return ('print_status', data['job_id'])
+        return None
+
+    def negotiate(self, conn, data):
+        """按消息中的 protocol_version/versions 协商连接的协议版本，按 codecs/compression 协商编码格式"""
+        version = negotiate_version(data)
+        if version is not None:
+            conn.protocol = version
+        wire = negotiate_wire(data, self.codecs, self.compression, self.compress_threshold)
+        if wire is not None:
+            if wire.plain:
+                self.wire_formats.pop(conn.websocket, None)
+            else:
+                self.wire_formats[conn.websocket] = wire
+            logger.debug("连接 %s 使用编码 %s，压缩 %s", conn.websocket.remote_address, wire.codec, wire.compression)
+
+    def wire_fields(self, websocket):
+        """回复中告知客户端协商后的编码格式"""
+        wire = self.wire_formats.get(websocket)
+        if wire is None:
+            return {'codec': 'json', 'compression': 'none'}
+        return {'codec': wire.codec, 'compression': wire.compression, 'compress_threshold': wire.threshold}
+
+    async def on_hello(self, conn, data):
+        """协议版本协商"""
+        self.negotiate(conn, data)
+        self.send_json(conn.websocket, dict({
+            'type': 'hello',
+            'protocol_version': conn.protocol,
+            'min_version': MIN_PROTOCOL_VERSION,
+            'max_version': PROTOCOL_VERSION,
+            'supported_codecs': self.codecs,
+            'supported_compression': self.compression
+        }, **self.wire_fields(conn.websocket)))
 
-    async def handle_client(self, websocket, path):
+    async def on_client_auth(self, conn, data):
+        """打印客户端认证"""
+        websocket = conn.websocket
+        logger.debug("=== 收到打印客户端认证请求 ===")
+        self.negotiate(conn, data)
+        client_id = data['client_id']
+        # 打印客户端重连时可以使用上次认证得到的令牌
+        username = await self.authenticate(websocket, data)
+
+        logger.debug("客户端ID: %s", client_id)
+        logger.debug("用户名: %s", username)
+
+        if username is None:
+            logger.warning("❌ 打印客户端认证失败，用户名: %s", data.get('username'))
+            self.send_json(websocket, {
+                'type': 'auth_error',
+                'message': '用户名或密码错误，请使用Markdown编辑器的账号密码'
+            })
+            return
+
+        # 认证成功后才按打印客户端处理，认证失败的连接仍受前端连接的限流
+        conn.client_type = "打印客户端"
+        conn.bucket = None  # 打印客户端的消息不限流
+        # 同一连接重新认证时先释放原有的路由绑定
+        previous_username = self.registry.username_for(websocket)
+        if previous_username is not None:
+            await self.broker.release(previous_username, self.registry.client_id_for(websocket))
+        previous = self.registry.get_client(client_id)
+        if previous is not None and previous['websocket'] is not websocket:
+            # 同一 client_id 从新连接重新认证（旧连接尚未断开）：按旧连接断开处理，
+            # 中止发往旧连接的分块传输，未确认的任务重新标记为待投递，认证完成后重新发送
+            await self.release_print_client(previous['websocket'])
+        # 认证成功，建立绑定（同时更新反向索引）
+        self.registry.bind(client_id, websocket, username, data.get('capabilities'), data.get('printers'))
+        await self.broker.claim(username, client_id)
+
+        self.send_json(websocket, dict(self.auth_reply(username, '认证成功，已连接到打印服务器并永久绑定', conn.protocol),
+                                       **self.wire_fields(websocket)))
+        logger.info("✅ 打印客户端认证成功: %s", client_id)
+        logger.info("✅ 客户端绑定关系已建立: 用户 %s -> 客户端 %s", username, client_id)
+
+        # 通知所有前端客户端
+        await self.notify_frontend_clients()
+        # 转发客户端离线期间排队的任务
+        await self.drain_offline_jobs(username, client_id)
+
+    async def on_auth(self, conn, data):
+        """前端认证：换取会话令牌，同一连接上之后的消息无需再携带密码"""
+        websocket = conn.websocket
+        self.negotiate(conn, data)
+        username = await self.authenticate(websocket, data)
+        if username is not None:
+            self.sessions[websocket] = username
+            self.send_json(websocket, dict(self.auth_reply(username, '认证成功', conn.protocol),
+                                           **self.wire_fields(websocket)))
+        else:
+            self.sessions.pop(websocket, None)
+            self.send_json(websocket, {
+                'type': 'auth_error',
+                'code': 'auth_failed',
+                'message': '用户名或密码错误，或登录已过期'
+            })
+
+    def reconnect_after(self):
+        """建议客户端重连前等待的秒数，随机分散避免重启后所有客户端同时重连"""
+        return round(random.uniform(0.5, 0.5 + self.reconnect_jitter), 1)
+
+    def inflight_jobs(self):
+        """进行中的任务数：已发送给本进程打印客户端但尚未报告结果的任务和分块传输"""
+        return self.registry.job_count + len(self.streams)
+
+    def reject(self, websocket, data, code, retry_after, reason, message):
+        """回复限流/繁忙错误，附带建议的重试等待时间"""
+        self.rejected_total.inc(reason=reason)
+        self.send_json(websocket, {
+            'type': 'error',
+            'code': code,
+            'job_id': data.get('job_id'),
+            'retry_after': round(retry_after, 2),
+            'message': message
+        })
+
+    def admit(self, websocket, username, data, job=True):
+        """准入控制：按用户限流，打印任务还要检查全局进行中任务数；拒绝时回复并返回 False"""
+        wait = self.user_limiter.check(username)
+        if wait:
+            self.reject(websocket, data, 'rate_limited', wait, 'user_rate', f'请求过于频繁，请 {wait:.1f} 秒后重试')
+            return False
+        if job and self.max_inflight and self.inflight_jobs() >= self.max_inflight:
+            logger.warning("进行中的任务数达到上限 %s，拒绝用户 %s 的任务", self.max_inflight, username)
+            self.reject(websocket, data, 'busy', self.busy_retry_after, 'busy', '打印服务器繁忙，请稍后重试')
+            return False
+        return True
+
+    def reject_draining(self, websocket, data):
+        """排空期间拒绝新任务，返回是否已拒绝（进行中的分块传输不受影响）"""
+        if not self.draining:
+            return False
+        self.rejected_total.inc(reason='draining')
+        delay = self.reconnect_after()
+        self.send_json(websocket, {
+            'type': 'error',
+            'code': 'draining',
+            'job_id': data.get('job_id'),
+            'reconnect_after': delay,
+            'message': f'打印服务器正在重启，请 {delay:.0f} 秒后重试'
+        })
+        return True
+
+    def reject_unauthenticated(self, websocket):
+        self.send_json(websocket, {
+            'type': 'error',
+            'code': 'auth_required',
+            'message': '用户名或密码错误，或登录已过期'
+        })
+
+    async def on_check_client_status(self, conn, data):
+        """检查用户的打印客户端连接状态"""
+        websocket = conn.websocket
+        username = await self.authenticate(websocket, data)
+        if username is None:
+            self.reject_unauthenticated(websocket)
+            return
+        if not self.admit(websocket, username, data, job=False):
+            return
+        # 订阅该用户的打印状态
+        self.registry.subscribe(websocket, username)
+        # 检查用户是否有绑定的客户端
+        client_id, _ = self.registry.client_for_user(username)
+        client_count = len(self.registry.clients_for_user(username))
+        client_connected = client_id is not None
+        if not client_connected:
+            # 打印客户端可能连接在其他工作进程上
+            client_connected = bool(await self.broker.owners(username))
+
+        self.send_json(websocket, {
+            'type': 'client_status',
+            'connected': client_connected,
+            'client_id': client_id if client_connected else None,
+            'client_count': client_count
+        })
+
+    async def on_print_ack(self, conn, data):
+        """打印客户端确认收到任务，删除未确认记录"""
+        username = self.registry.username_for(conn.websocket)
+        if username and self.job_store:
+            await self.job_store.ack(username, data['job_id'])
+
+    async def on_client_load(self, conn, data):
+        """打印客户端报告每台打印机的队列长度和进行中的任务数，调度时按打印机比较负载"""
+        self.registry.update_load(conn.websocket, data['printers'])
+
+    async def on_client_status(self, conn, data):
+        """打印客户端发来的任务状态，只转发给发起任务的前端或订阅该用户的前端"""
+        websocket = conn.websocket
+        logger.debug("=== 转发打印客户端状态消息: %s ===", data['type'])
+        # 通过反向索引找到当前连接所属用户
+        username = self.registry.username_for(websocket)
+        if username:
+            if data['type'] in ('print_queued', 'error'):
+                # 任务已结束，不再计入该客户端的负载
+                self.registry.complete_job(self.registry.client_id_for(websocket), data.get('job_id'))
+            await self.route_job_status(username, data)
+
+    async def on_print_request(self, conn, data, body=None):
+        """前端的打印请求：发送给用户的打印客户端、转发到其他工作进程或加入离线队列
+
+        信封帧的 data 只包含头部字段，body 为未解析的文档内容
+        """
+        websocket = conn.websocket
+        logger.debug("=== 收到打印请求 ===")
+        if self.reject_draining(websocket, data):
+            return
+        # 验证令牌或用户凭证
+        username = await self.authenticate(websocket, data)
+        logger.debug("用户: %s, 请求: %s", username, preview(data))
+        logger.debug("当前已连接的客户端数: %s", len(self.registry))
+
+        if username is None:
+            logger.warning("用户凭证验证失败: %s", data.get('username'))
+            # 只拒绝本次请求，不断开前端连接
+            self.reject_unauthenticated(websocket)
+            return
+        if not self.admit(websocket, username, data):
+            return
+        # 只携带令牌的请求由令牌确定用户名，转发给打印客户端的任务中保持原有字段
+        data['username'] = username
+
+        # 没有 job_id 的任务由服务器生成，用于确认和去重
+        job_id = data.get('job_id')
+        if job_id is None:
+            job_id = data['job_id'] = f"job_{uuid.uuid4().hex}"
+        self.job_timer.start(username, job_id)
+
+        # 订阅该用户的打印状态，并记录任务的发起连接
+        self.registry.subscribe(websocket, username)
+        self.registry.track_job(username, job_id, websocket)
+
+        payload = self.job_payload(data, body)
+        # 按调度策略选择本进程内该用户的打印客户端，发送失败时换下一台
+        client_id = await self.dispatch_job(username, job_id, payload, data)
+
+        if client_id is not None:
+            logger.info("✅ 打印任务已成功发送到客户端: %s", client_id)
+            self.record_forward(username, job_id, 'local')
+            # 发送一个初始状态给前端，而不是直接发送 print_queued
+            self.send_json(websocket, {
+                'type': 'print_status',
+                'job_id': job_id,
+                'message': '打印任务已成功发送到绑定的打印客户端，等待处理...'
+            })
+
+        elif await self.forward_to_worker(username, job_id, payload):
+            # 打印客户端连接在其他工作进程上，任务已转发
+            self.record_forward(username, job_id, 'worker')
+            self.send_json(websocket, {
+                'type': 'print_status',
+                'job_id': job_id,
+                'message': '打印任务已成功发送到绑定的打印客户端，等待处理...'
+            })
+
+        elif await self.queue_offline_job(username, job_id, payload):
+            # 客户端离线，任务已持久化，等待客户端上线后转发
+            self.record_forward(username, job_id, 'queued')
+            self.send_json(websocket, {
+                'type': 'print_status',
+                'job_id': job_id,
+                'queued': True,
+                'message': '打印客户端当前离线，任务已加入队列，客户端上线后将自动打印'
+            })
+
+        else:
+            logger.warning("❌ 未找到用户 %s 绑定的客户端！", username)
+            self.record_forward(username, job_id, 'failed')
+            self.send_json(websocket, {
+                'type': 'error',
+                'message': '无法连接到打印客户端，请确保客户端已启动并使用您的账号密码绑定'
+            })
+
+    async def on_print_begin(self, conn, data):
+        """分块传输开始：选择支持分块传输的打印客户端并转发任务信息，文档内容随后按块发送"""
+        websocket = conn.websocket
+        if self.reject_draining(websocket, data):
+            return
+        username = await self.authenticate(websocket, data)
+        if username is None:
+            self.reject_unauthenticated(websocket)
+            return
+        if not self.admit(websocket, username, data):
+            return
+        if data.get('encoding', 'utf-8') not in ENCODINGS:
+            raise ProtocolError('invalid_message', f"不支持的分块编码: {data.get('encoding')}")
+        data['username'] = username
+        job_id = data.get('job_id')
+        if job_id is None:
+            job_id = data['job_id'] = f"job_{uuid.uuid4().hex}"
+
+        # 先登记传输状态：打印客户端可能在任务信息发送完成前就归还了初始额度
+        state = self.streams.open(StreamState(username, job_id, origin=websocket))
+        conn.streams[job_id] = username
+        self.job_timer.start(username, job_id)
+        self.registry.subscribe(websocket, username)
+        self.registry.track_job(username, job_id, websocket)
+
+        payload = self.job_payload(data)
+        state.client_id = await self.dispatch_job(username, job_id, payload, data, stream=True)
+        if state.client_id is None:
+            state.worker = await self.forward_to_worker(username, job_id, payload)
+        if state.client_id is None and state.worker is None:
+            logger.warning("用户 %s 没有支持分块传输的打印客户端", username)
+            self.record_forward(username, job_id, 'failed')
+            self.streams.close(username, job_id)
+            conn.streams.pop(job_id, None)
+            await self.route_job_status(username, {
+                'type': 'error',
+                'job_id': job_id,
+                'code': 'stream_unavailable',
+                'message': '没有在线的支持分块传输的打印客户端，请改用普通打印请求'
+            })
+            return
+
+        self.record_forward(username, job_id, 'local' if state.client_id is not None else 'worker')
+        logger.info("分块传输 %s 开始: 用户 %s -> %s", job_id, username, state.client_id or state.worker)
+        self.send_json(websocket, {
+            'type': 'print_status',
+            'job_id': job_id,
+            'message': '打印客户端已准备接收文档，正在分块传输...'
+        })
+
+    def stream_for(self, conn, job_id):
+        """该连接发起的进行中的分块传输"""
+        username = conn.streams.get(job_id)
+        state = self.streams.get(username, job_id) if username is not None else None
+        if state is None:
+            conn.streams.pop(job_id, None)
+            raise ProtocolError('stream_unknown', f"任务 {job_id} 没有进行中的分块传输")
+        return state
+
+    async def on_print_chunk(self, conn, data, body=None):
+        """转发一个分块：检查序号和额度，信封帧的消息体原样转发"""
+        state = self.stream_for(conn, data['job_id'])
+        try:
+            state.accept(data['seq'], len(body) if body is not None else len(data.get('data') or ''))
+        except StreamError as e:
+            conn.streams.pop(state.job_id, None)
+            await self.abort_stream(state, e.message, e.code)
+            return
+        frame = make_envelope(data, body) if body is not None else json.dumps(data, ensure_ascii=False)
+        if not await self.forward_stream_frame(state, frame):
+            conn.streams.pop(state.job_id, None)
+            await self.abort_stream(state, '与打印客户端的连接中断', 'stream_failed')
+
+    async def on_print_end(self, conn, data):
+        """分块传输结束，打印客户端校验块数后打印"""
+        state = self.stream_for(conn, data['job_id'])
+        conn.streams.pop(state.job_id, None)
+        if data['chunks'] != state.next_seq:
+            await self.abort_stream(state, f"分块数量不符: 声明 {data['chunks']}，已转发 {state.next_seq}",
+                                    'stream_incomplete')
+            return
+        self.streams.close(state.username, state.job_id)
+        if not await self.forward_stream_frame(state, json.dumps(data, ensure_ascii=False)):
+            await self.abort_stream(state, '与打印客户端的连接中断', 'stream_failed')
+
+    async def on_print_abort(self, conn, data):
+        """发送方取消分块传输"""
+        state = self.stream_for(conn, data['job_id'])
+        conn.streams.pop(state.job_id, None)
+        await self.abort_stream(state, data.get('message') or '发送方已取消传输', notify=False)
+        self.registry.finish_job(state.username, state.job_id)
+        self.job_timer.finish(state.username, state.job_id)
+
+    def setup_dispatch(self):
+        """消息类型 -> (处理协程, 是否只接受打印客户端发送, 处理出错时回复的消息)"""
+        self.dispatch = {
+            'hello': (self.on_hello, False, '协商协议版本失败'),
+            'client_auth': (self.on_client_auth, False, '认证处理失败'),
+            'auth': (self.on_auth, False, '认证处理失败'),
+            'check_client_status': (self.on_check_client_status, False, '检查状态失败'),
+            'print_request': (self.on_print_request, False, '处理打印请求失败'),
+            'print_begin': (self.on_print_begin, False, '处理打印请求失败'),
+            'print_chunk': (self.on_print_chunk, False, '转发分块失败'),
+            'print_end': (self.on_print_end, False, '转发分块失败'),
+            'print_abort': (self.on_print_abort, False, '取消传输失败'),
+            'print_credit': (self.on_client_status, True, '处理请求失败'),
+            'client_load': (self.on_client_load, True, '处理请求失败'),
+            'print_ack': (self.on_print_ack, True, '处理请求失败'),
+            'print_status': (self.on_client_status, True, '处理请求失败'),
+            'print_queued': (self.on_client_status, True, '处理请求失败'),
+            'error': (self.on_client_status, True, '处理请求失败'),
+        }
+        missing = set(self.dispatch) ^ set(SCHEMAS)
+        if missing:
+            raise RuntimeError(f"消息类型缺少处理函数或校验规则: {sorted(missing)}")
+
+    def throttle(self, conn, data):
+        """前端连接的消息在校验和分派前限流（包括格式错误的消息），返回是否已拒绝；
+        分块传输的后续消息由打印客户端的额度控制，不计入
+        """
+        if conn.bucket is None or not isinstance(data, dict) or data.get('type') in STREAM_FOLLOW_TYPES:
+            return False
+        wait = conn.bucket.take()
+        if not wait:
+            return False
+        self.reject(conn.websocket, data, 'rate_limited', wait, 'connection_rate', f'请求过于频繁，请 {wait:.1f} 秒后重试')
+        return True
+
+    async def handle_message(self, conn, message):
+        """解码、校验并分派一条消息，格式错误的消息在处理前拒绝"""
+        websocket = conn.websocket
+        # 二进制帧先按首字节解压/解码：JSON 编码得到文本，继续按文本帧处理；MessagePack 直接得到消息对象
+        try:
+            message = decode_frame(message)
+        except ProtocolError as e:
+            logger.warning("错误: %s", e.message)
+            self.messages_total.inc(type='invalid')
+            self.send_json(websocket, {'type': 'error', 'code': e.code, 'message': e.message})
+            return
+        # 信封帧只解析头部，消息体留给打印客户端解析
+        envelope = split_envelope(message)
+        if envelope is not None:
+            data, body = envelope
+        elif not isinstance(message, str):
+            data, body = message, None
+        else:
+            body = None
+            try:
+                data = json.loads(message)
+            except json.JSONDecodeError:
+                if self.throttle(conn, {}):
+                    return
+                logger.warning("错误: 无效的JSON数据")
+                self.messages_total.inc(type='invalid')
+                self.send_json(websocket, {
+                    'type': 'error',
+                    'code': 'invalid_json',
+                    'message': '无效的JSON数据'
+                })
+                return
+        if self.throttle(conn, data):
+            return
+
+        try:
+            message_type = validate_frame(data)
+            if body is not None:
+                if message_type not in ENVELOPE_TYPES:
+                    raise ProtocolError('invalid_message', f"{message_type} 消息不能使用信封帧")
+                check_envelope_body(body)
+        except ProtocolError as e:
+            self.messages_total.inc(type='invalid' if e.code == 'invalid_message' else 'other')
+            logger.debug("拒绝消息: %s (%s)", e.message, preview(data))
+            self.send_json(websocket, {'type': 'error', 'code': e.code, 'message': e.message})
+            return
+        self.messages_total.inc(type=message_type)
+        logger.debug("收到请求: %s", message_type)
+
+        handler, client_only, error_message = self.dispatch[message_type]
+        if client_only and conn.client_type != "打印客户端":
+            self.send_json(websocket, {
+                'type': 'error',
+                'code': 'unknown_type',
+                'message': '未知请求类型'
+            })
+            return
+        try:
+            if body is None:
+                await handler(conn, data)
+            else:
+                await handler(conn, data, body)
+        except ProtocolError as e:
+            self.send_json(websocket, {'type': 'error', 'code': e.code, 'message': e.message})
+        except Exception as e:
+            logger.warning("处理 %s 消息时出错: %s", message_type, e)
+            logger.debug("处理消息出错的详细信息", exc_info=True)
+            self.send_json(websocket, {
+                'type': 'error',
+                'message': error_message
+            })
+
+    async def handle_client(self, websocket, path=None):
         """处理客户端连接（前端或打印客户端）"""
         self.connections.add(websocket)
-        client_type = "前端客户端"
+        self.open_outbound(websocket)
+        conn = ClientConnection(websocket)
+        conn.bucket = self.conn_limiter.bucket()
 
         try:
             async for message in websocket:
-                try:
-                    data = json.loads(message)
-                    print(f"收到请求: {data.get('type')}")
-
-                    if data.get('type') == 'client_auth':
-                        print(f"=== 收到打印客户端认证请求 ===")
-                        # 处理打印客户端认证
-                        try:
-                            client_type = "打印客户端"
-                            username = data.get('username')
-                            password = data.get('password')
-                            client_id = data.get('client_id')
-
-                            print(f"客户端ID: {client_id}")
-                            print(f"用户名: {username}")
-
-                            if self.validate_user_credentials(username, password):
-                                print(f"✅ 用户凭证验证成功")
-                                # 认证成功，建立永久绑定
-                                self.clients[client_id] = {
-                                    'websocket': websocket,
-                                    'connected_at': datetime.now(),
-                                    'username': username,
-                                    'password': password
-                                }
-                                # 建立用户与客户端的永久绑定
-                                self.user_bindings[username] = client_id
-                                print(f"✅ 客户端已添加到 clients 字典")
-                                print(f"✅ 用户绑定关系已更新: {self.user_bindings}")
-
-                                await websocket.send(json.dumps({
-                                    'type': 'auth_success',
-                                    'message': '认证成功，已连接到打印服务器并永久绑定'
-                                }, ensure_ascii=False))
-                                print(f"✅ 打印客户端认证成功: {client_id}")
-                                print(f"✅ 客户端绑定关系已建立: 用户 {username} -> 客户端 {client_id}")
-                                print(f"当前所有绑定关系: {self.user_bindings}")
-
-                                # 通知所有前端客户端
-                                await self.notify_frontend_clients()
-                            else:
-                                print(f"❌ 用户凭证验证失败")
-                                # 认证失败
-                                await websocket.send(json.dumps({
-                                    'type': 'auth_error',
-                                    'message': '用户名或密码错误，请使用Markdown编辑器的账号密码'
-                                }, ensure_ascii=False))
-                                print(f"❌ 打印客户端认证失败，用户名: {username}")
-                        except Exception as e:
-                            print(f"处理客户端认证时出错: {str(e)}")
-                            await websocket.send(json.dumps({
-                                'type': 'error',
-                                'message': '认证处理失败'
-                            }, ensure_ascii=False))
-
-                    elif data.get('type') == 'check_client_status':
-                        # 检查客户端连接状态
-                        try:
-                            username = data.get('username')
-                            password = data.get('password')
-                            
-                            # 验证用户凭证
-                            if self.validate_user_credentials(username, password):
-                                # 检查用户是否有绑定的客户端
-                                client_id = self.user_bindings.get(username)
-                                client_connected = client_id and client_id in self.clients
-                                
-                                await websocket.send(json.dumps({
-                                    'type': 'client_status',
-                                    'connected': client_connected,
-                                    'client_id': client_id if client_connected else None
-                                }, ensure_ascii=False))
-                            else:
-                                await websocket.send(json.dumps({
-                                    'type': 'error',
-                                    'message': '用户名或密码错误'
-                                }, ensure_ascii=False))
-                        except Exception as e:
-                            print(f"检查客户端状态时出错: {str(e)}")
-                            await websocket.send(json.dumps({
-                                'type': 'error',
-                                'message': '检查状态失败'
-                            }, ensure_ascii=False))
-
-                    elif data.get('type') in ['print_status', 'print_queued', 'error'] and client_type == "打印客户端":
-                        # 打印客户端发来的任务状态，需要转发给对应的所有前端
-                        print(f"=== 转发打印客户端状态消息: {data.get('type')} ===")
-                        # 找到当前 client_id
-                        current_client_id = None
-                        for cid, info in self.clients.items():
-                            if info['websocket'] == websocket:
-                                current_client_id = cid
-                                break
-                        
-                        if current_client_id:
-                            username = self.clients[current_client_id].get('username')
-                            if username:
-                                print(f"转发消息到用户 {username} 的所有连接...")
-                                # 广播给所有可能是这个用户的连接 (这里简单处理为广播，前端会根据 job_id 过滤)
-                                for connection in list(self.connections):
-                                    if connection != websocket: # 不发回给客户端自己
-                                        try:
-                                            await connection.send(json.dumps(data, ensure_ascii=False))
-                                        except Exception as e:
-                                            print(f"转发消息到连接出错: {e}")
-
-                    elif data.get('type') == 'print_request':
-                        print(f"=== 收到打印请求 ===")
-                        
-                        try:
-                            username = data.get('username')
-                            password = data.get('password')
-                            
-                            print(f"用户: {username}")
-                            print(f"当前用户绑定关系: {self.user_bindings}")
-                            print(f"当前已连接的客户端: {list(self.clients.keys())}")
-
-                            # 验证用户凭证
-                            if not self.validate_user_credentials(username, password):
-                                print(f"用户凭证验证失败: {username}")
-                                await websocket.send(json.dumps({
-                                    'type': 'error',
-                                    'message': '用户名或密码错误'
-                                }, ensure_ascii=False))
-                                return
-
-                            # 通过用户名映射找到客户端ID
-                            client_id = self.user_bindings.get(username)
-                            print(f"查找用户 {username} 绑定的客户端: {client_id}")
-
-                            if client_id and client_id in self.clients:
-                                client_info = self.clients[client_id]
-                                print(f"找到客户端 {client_id}，准备发送打印任务...")
-
-                                try:
-                                    await client_info['websocket'].send(json.dumps(data, ensure_ascii=False))
-                                    print(f"✅ 打印任务已成功发送到客户端: {client_id}")
-
-                                    # 发送一个初始状态给前端，而不是直接发送 print_queued
-                                    await websocket.send(json.dumps({
-                                        'type': 'print_status',
-                                        'job_id': data.get('job_id'),
-                                        'message': '打印任务已成功发送到绑定的打印客户端，等待处理...'
-                                    }, ensure_ascii=False))
-
-                                except Exception as e:
-                                    print(f"❌ 发送打印任务失败: {str(e)}")
-                                    import traceback
-                                    traceback.print_exc()
-                                    await websocket.send(json.dumps({
-                                        'type': 'error',
-                                        'message': '发送打印任务失败'
-                                    }, ensure_ascii=False))
-
-                            else:
-                                print(f"❌ 未找到用户 {username} 绑定的客户端！")
-                                # 没有找到绑定的客户端
-
-                                await websocket.send(json.dumps({
-
-                                    'type': 'error',
-
-                                    'message': '无法连接到打印客户端，请确保客户端已启动并使用您的账号密码绑定'
-
-                                }, ensure_ascii=False))
-
-                        except Exception as e:
-
-                            print(f"处理打印请求时出错: {str(e)}")
-
-                            await websocket.send(json.dumps({
-
-                                'type': 'error',
-
-                                'message': '处理打印请求失败'
-
-                            }, ensure_ascii=False))
-
-                    else:
-                        # 未知请求类型
-                        await websocket.send(json.dumps({
-                            'type': 'error',
-                            'message': '未知请求类型'
-                        }, ensure_ascii=False))
-
-                except json.JSONDecodeError:
-                    print("错误: 无效的JSON数据")
-                    await websocket.send(json.dumps({
-                        'type': 'error',
-                        'message': '无效的JSON数据'
-                    }, ensure_ascii=False))
-                except Exception as e:
-                    print(f"处理消息时出错: {str(e)}")
-                    await websocket.send(json.dumps({
-                        'type': 'error',
-                        'message': '处理请求失败'
-                    }, ensure_ascii=False))
+                # 打印客户端的任何消息都说明连接仍然可用
+                self.registry.touch(websocket)
+                await self.handle_message(conn, message)
 
         except Exception as e:
-            print(f"{client_type}连接错误: {str(e)}")
+            logger.warning("%s连接错误: %s", conn.client_type, e)
         finally:
+            # 发送方断开时中止其未完成的分块传输，打印客户端删除缓冲文件
+            for job_id, username in list(conn.streams.items()):
+                state = self.streams.get(username, job_id)
+                if state is not None and state.origin is websocket:
+                    await self.abort_stream(state, '发送方已断开连接', notify=False)
             # 清理客户端连接
-            if client_type == "打印客户端":
-                # 移除断开连接的打印客户端
-                for client_id, info in list(self.clients.items()):
-                    if info['websocket'] == websocket:
-                        del self.clients[client_id]
-                        print(f"打印客户端已断开连接: {client_id}")
-                        # 通知前端
-                        await self.notify_frontend_clients()
-                        break
-            self.connections.remove(websocket)
-            print(f"{client_type}已断开连接: {websocket.remote_address}")
+            if conn.client_type == "打印客户端":
+                # 已因心跳超时被移除的客户端不会重复处理
+                await self.release_print_client(websocket)
+            self.registry.forget_websocket(websocket)
+            self.sessions.pop(websocket, None)
+            self.wire_formats.pop(websocket, None)
+            self._probing.discard(websocket)
+            self.connections.discard(websocket)
+            self.close_outbound(websocket)
+            logger.info("%s已断开连接: %s", conn.client_type, websocket.remote_address)
+
+    def inflight(self):
+        """进行中的工作：分块传输、已发送给本进程打印客户端但尚未报告结果的任务、发送队列中的消息"""
+        return self.inflight_jobs() + self.outbound_stats()['depth']
+
+    def request_stop(self, handoff=False):
+        """信号处理：SIGTERM/SIGINT 排空后退出，SIGHUP 先把监听 socket 交给新进程再排空"""
+        if self._stopping is None or self._stopping.is_set():
+            return
+        self._handoff = handoff
+        self._stopping.set()
+
+    def spawn_successor(self, server):
+        """启动新的服务器进程并通过文件描述符继承把监听 socket 交给它
+
+        socket 上排队的连接由新进程继续接受，重启期间不会拒绝连接
+        新进程不重新投递未确认的任务（本进程排空时仍在处理），令牌密钥通过继承的环境变量共享
+        """
+        sockets = list(server.sockets or ())
+        if not sockets:
+            logger.warning("⚠️ 没有可以交接的监听 socket")
+            return None
+        if len(sockets) > 1:
+            logger.warning("⚠️ 监听了 %s 个地址，只交接第一个: %s", len(sockets), sockets[0].getsockname())
+        fd = sockets[0].fileno()
+        os.set_inheritable(fd, True)
+        argv = []
+        skip = False
+        for arg in sys.argv[1:]:
+            # 去掉上一次交接时添加的参数
+            if skip:
+                skip = False
+            elif arg == '--listen-fd':
+                skip = True
+            elif not arg.startswith('--listen-fd=') and arg != '--no-requeue':
+                argv.append(arg)
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__)] + argv +
+                                   ['--listen-fd', str(fd), '--no-requeue'], pass_fds=(fd,))
+        logger.info("已启动新的服务器进程 (PID %s)，监听 socket 已交接", process.pid)
+        return process
+
+    async def drain(self, server):
+        """排空：停止接受新连接和新任务，等待进行中的任务转发完成后通知客户端稍后重连并关闭连接"""
+        self.draining = True
+        loop = asyncio.get_event_loop()
+        if self.listen_fd is not None or self._handoff:
+            # 监听 socket 与其他进程共享：先停止接受新连接（排队的连接由其他进程接受），
+            # 已接受的连接完成握手后再关闭服务器，避免握手中的连接被 503 拒绝
+            for sock in server.sockets or ():
+                try:
+                    loop.remove_reader(sock.fileno())
+                except Exception:
+                    pass
+            await asyncio.sleep(HANDSHAKE_GRACE)
+        # SO_REUSEPORT 的各进程有各自的连接队列，立即关闭监听，内核不再把新连接分配给本进程
+        server.close(close_connections=False)
+        logger.info("开始排空: %s 个连接，%s 项进行中的工作（最多等待 %s 秒）",
+                    len(self.connections), self.inflight(), self.drain_timeout)
+        deadline = loop.time() + self.drain_timeout
+        while self.inflight() and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        remaining = self.inflight()
+        if remaining:
+            logger.warning("⚠️ 排空超时，仍有 %s 项进行中的工作", remaining)
+
+        connections = list(self.connections)
+        for websocket in connections:
+            self.send_json(websocket, {
+                'type': 'server_draining',
+                'code': 'draining',
+                'reconnect_after': self.reconnect_after(),
+                'message': '打印服务器正在重启，稍后将自动重连'
+            })
+        # 等待重连通知写出后关闭连接（1012: 服务重启）
+        while self.outbound_stats()['depth'] and loop.time() < deadline + 1:
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*(websocket.close(1012, 'service restart') for websocket in connections),
+                             return_exceptions=True)
+        await server.wait_closed()
+        logger.info("排空完成，已关闭 %s 个连接", len(connections))
 
     async def forward_to_local_client(self, print_data):
         """转发打印请求到本地客户端"""
-        print(f"转发打印请求到本地客户端: {self.local_client_url}")
+        logger.info("转发打印请求到本地客户端: %s", self.local_client_url)
 
         try:
             async with websockets.connect(self.local_client_url, timeout=5) as websocket:
                 # 发送打印数据
                 await websocket.send(json.dumps(print_data, ensure_ascii=False))
-                print("打印请求已发送到本地客户端")
+                logger.info("打印请求已发送到本地客户端")
 
                 # 等待响应
                 response = await asyncio.wait_for(websocket.recv(), timeout=10)
                 response_data = json.loads(response)
-                print(f"收到本地客户端响应: {response_data.get('type')}")
+                logger.info("收到本地客户端响应: %s", response_data.get('type'))
 
                 if response_data.get('type') == 'print_queued':
-                    print("本地客户端接收打印任务成功")
+                    logger.info("本地客户端接收打印任务成功")
                     return True
                 else:
-                    print(f"本地客户端拒绝打印任务: {response_data.get('message')}")
+                    logger.info("本地客户端拒绝打印任务: %s", response_data.get('message'))
                     return False
 
         except asyncio.TimeoutError:
-            print("错误: 连接本地客户端超时")
+            logger.warning("错误: 连接本地客户端超时")
             return False
         except websockets.exceptions.ConnectionClosedError:
-            print("错误: 本地客户端连接已关闭")
+            logger.warning("错误: 本地客户端连接已关闭")
             return False
         except Exception as e:
-            print(f"连接本地客户端时出错: {str(e)}")
+            logger.warning("连接本地客户端时出错: %s", e)
             return False
 
     async def start_server(self):
         """启动WebSocket服务器"""
-        print(f"启动打印服务器...")
-        print(f"服务器地址: ws://{self.host}:{self.port}")
-        print(f"本地客户端地址: {self.local_client_url}")
-        print("按 Ctrl+C 停止服务器")
+        logger.info("启动打印服务器...")
+        logger.info("服务器地址: ws://%s:%s", self.host, self.port)
+        logger.info("本地客户端地址: %s", self.local_client_url)
+        logger.info("按 Ctrl+C 停止服务器")
+
+        purge_task = None
+        if self.job_store:
+            if self.requeue_on_start:
+                # 上次运行时未确认的任务全部重新投递（多进程模式下由主进程统一处理）
+                released = await self.job_store.release()
+                if released:
+                    logger.info("%s 个未确认的任务将在客户端重连后重新投递", released)
+            purge_task = asyncio.ensure_future(self.purge_expired_jobs())
+        reap_task = None
+        if self.ping_interval and self.ping_timeout:
+            reap_task = asyncio.ensure_future(self.reap_stale_clients())
+
+        await self.broker.start(self.on_broker_message)
+        metrics_server = None
+        if self.metrics_port:
+            metrics_server = await serve_metrics(self.metrics, self.metrics_host, self.metrics_port,
+                                                 reuse_port=self.reuse_port)
+            logger.info("监控指标地址: http://%s:%s/metrics", self.metrics_host, self.metrics_port)
+        # 协议层心跳使用相同的间隔和超时，失联的前端连接也会被关闭
+        serve_kwargs = {'ping_interval': self.ping_interval, 'ping_timeout': self.ping_timeout,
+                        'max_size': MAX_MESSAGE_SIZE}
+        host, port = self.host, self.port
+        if self.listen_fd is not None:
+            # 使用继承的监听 socket（平滑重启或 systemd socket 激活）
+            serve_kwargs['sock'] = socket.socket(fileno=self.listen_fd)
+            host = port = None
+            logger.info("使用继承的监听 socket (fd %s)", self.listen_fd)
+        elif self.reuse_port:
+            # 多个工作进程共享同一监听端口
+            serve_kwargs['reuse_port'] = True
+
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        handlers = [(signal.SIGTERM, False), (signal.SIGINT, False)]
+        if self.allow_handoff and hasattr(signal, 'SIGHUP'):
+            handlers.append((signal.SIGHUP, True))
+        installed = []
+        for sig, handoff in handlers:
+            try:
+                loop.add_signal_handler(sig, self.request_stop, handoff)
+                installed.append(sig)
+            except NotImplementedError:
+                # Windows 的事件循环不支持信号处理，Ctrl+C 时直接退出
+                pass
 
         try:
             # 直接启动服务器，不使用SSL（由Nginx处理SSL）
-            async with websockets.serve(self.handle_client, self.host, self.port):
-                await asyncio.Future()  # 无限运行
+            server = await websockets.serve(self.handle_client, host, port, **serve_kwargs)
+            await self._stopping.wait()
+            if self._handoff:
+                # 先关闭监控端口，新进程才能绑定
+                if metrics_server:
+                    metrics_server.close()
+                    metrics_server = None
+                self.spawn_successor(server)
+            await self.drain(server)
         except KeyboardInterrupt:
-            print("服务器已停止")
+            logger.info("服务器已停止")
         except Exception as e:
-            print(f"服务器启动失败: {str(e)}")
+            logger.error("服务器启动失败: %s", e)
             raise
+        finally:
+            for sig in installed:
+                loop.remove_signal_handler(sig)
+            if purge_task:
+                purge_task.cancel()
+            if reap_task:
+                reap_task.cancel()
+            if metrics_server:
+                metrics_server.close()
+            await self.broker.close()
+            if self.job_store:
+                await self.job_store.close()
+
+
+def run_workers(args):
+    """多进程模式：主进程运行路由中转并管理共享监听端口的工作进程"""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        logger.error("❌ 当前系统不支持 SO_REUSEPORT，无法使用多进程模式")
+        return
+
+    broker_spec = args.broker
+    hub = None
+    if broker_spec == 'local':
+        # 默认使用主进程提供的 Unix socket 中转
+        socket_dir = args.data_dir or DEFAULT_DATA_DIR
+        os.makedirs(socket_dir, exist_ok=True)
+        socket_path = os.path.join(socket_dir, f'broker_{args.port}.sock')
+        broker_spec = f'unix:{socket_path}'
+        hub = BrokerHub(socket_path)
+
+    if args.data_dir:
+        # 上次运行时未确认的任务全部重新投递，工作进程启动时不再重复处理
+        store = JobStore(args.data_dir, ttl=args.job_ttl)
+        loop = asyncio.get_event_loop()
+        released = loop.run_until_complete(store.release())
+        loop.run_until_complete(store.close())
+        if released:
+            logger.info("%s 个未确认的任务将在客户端重连后重新投递", released)
+
+    if not args.token_secret and not os.environ.get(TOKEN_SECRET_ENV):
+        # 工作进程之间需要共享令牌密钥，通过环境变量传递，避免出现在进程参数中
+        os.environ[TOKEN_SECRET_ENV] = os.urandom(32).hex()
+
+    hostname = socket.gethostname()
+
+    async def supervise():
+        if hub:
+            await hub.start()
+            logger.info("路由中转已启动: %s", hub.path)
+        stopping = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+        processes = {}  # 序号 -> 当前的工作进程
+        draining = set()  # 平滑重启中正在排空的旧进程
+        generations = {}  # 序号 -> 启动次数，平滑重启时新旧进程同时运行，工作进程标识不能相同
+
+        async def spawn(index):
+            generation = generations[index] = generations.get(index, -1) + 1
+            worker_id = f"{hostname}:{args.port}:{index}"
+            if generation:
+                worker_id += f".{generation}"
+            # 工作进程沿用主进程的参数，仅覆盖多进程相关的选项
+            argv = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + [
+                '--workers', '1', '--worker-id', worker_id, '--broker', broker_spec, '--reuse-port'
+            ]
+            if args.metrics_port:
+                # 每个工作进程使用单独的监控端口: 基础端口 + 序号
+                argv += ['--metrics-port', str(args.metrics_port + index)]
+            process = processes[index] = await asyncio.create_subprocess_exec(*argv)
+            logger.info("工作进程 %s 已启动 (PID %s)", worker_id, process.pid)
+            return process
+
+        async def run_worker(index):
+            await spawn(index)
+            while not stopping.is_set():
+                process = processes[index]
+                waiter = asyncio.ensure_future(process.wait())
+                stopper = asyncio.ensure_future(stopping.wait())
+                await asyncio.wait([waiter, stopper], return_when=asyncio.FIRST_COMPLETED)
+                if not waiter.done():
+                    # 工作进程收到 SIGTERM 后排空再退出
+                    process.terminate()
+                    await waiter
+                    stopper.cancel()
+                    break
+                stopper.cancel()
+                if processes[index] is not process:
+                    continue  # 平滑重启时旧进程排空后退出，继续监视新进程
+                logger.warning("⚠️ 工作进程 %s 已退出 (退出码 %s)，1 秒后重启", index, process.returncode)
+                await asyncio.sleep(1)
+                if not stopping.is_set():
+                    await spawn(index)
+
+        reloading = []
+
+        async def reload_workers():
+            """逐个重启工作进程：先启动新进程共享监听端口，再让旧进程排空退出"""
+            if reloading:
+                return
+            reloading.append(True)
+            try:
+                logger.info("开始平滑重启 %s 个工作进程", args.workers)
+                for index in range(args.workers):
+                    if stopping.is_set():
+                        break
+                    old = processes.get(index)
+                    await spawn(index)
+                    await asyncio.sleep(WORKER_START_GRACE)  # 等待新进程开始监听
+                    if old is not None and old.returncode is None:
+                        draining.add(old)
+                        old.terminate()
+                        # 旧进程排空完成后再重启下一个，同一时间只有一个进程在排空
+                        await old.wait()
+                        draining.discard(old)
+                logger.info("平滑重启完成")
+            finally:
+                reloading.clear()
+
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(reload_workers()))
+        await asyncio.gather(*(run_worker(i) for i in range(args.workers)))
+        for process in list(draining):
+            await process.wait()
+        if hub:
+            await hub.close()
+        logger.info("所有工作进程已停止")
+
+    asyncio.get_event_loop().run_until_complete(supervise())
 
 
 def main():
@@ -369,12 +1588,111 @@ def main():
     parser.add_argument('--port', type=int, default=8770, help='服务器监听端口')
     parser.add_argument('--local-port', type=int, default=8771, help='本地客户端端口')
     parser.add_argument('--auto-port', action='store_true', help='启用自动查找可用端口')
+    parser.add_argument('--data-dir', type=str, default=DEFAULT_DATA_DIR, help='离线任务队列数据目录（留空则不启用）')
+    parser.add_argument('--job-ttl', type=int, default=DEFAULT_JOB_TTL, help='离线任务保留时间（秒）')
+    parser.add_argument('--drain-batch', type=int, default=50, help='客户端上线后每批转发的离线任务数')
+    parser.add_argument('--workers', type=int, default=1, help='工作进程数量（大于 1 时启用多进程模式，仅支持 Linux/macOS）')
+    parser.add_argument('--broker', type=str, default='local',
+                        help='多进程路由后端: local（主进程 Unix socket 中转）、unix:<路径> 或 redis://主机:端口/库')
+    parser.add_argument('--worker-id', type=str, default=None, help='工作进程标识（由主进程自动设置）')
+    parser.add_argument('--reuse-port', action='store_true', help='使用 SO_REUSEPORT 与其他进程共享监听端口')
+    parser.add_argument('--send-timeout', type=float, default=5.0, help='单个连接的发送超时（秒），超时的连接会被断开')
+    parser.add_argument('--outbound-queue-size', type=int, default=256, help='每个连接发送队列的最大长度')
+    parser.add_argument('--overflow-policy', type=str, default=POLICY_DROP_OLDEST, choices=OVERFLOW_POLICIES,
+                        help='发送队列溢出策略: drop_oldest（丢弃最早的状态消息）、coalesce（合并同一任务的状态消息）、disconnect（断开连接）')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Prometheus 监控指标端口（不指定则不启用；多进程模式下每个工作进程依次使用后续端口）')
+    parser.add_argument('--metrics-host', type=str, default='127.0.0.1', help='监控指标监听地址')
+    parser.add_argument('--schedule', type=str, default=POLICY_LEAST_LOADED, choices=SCHEDULE_POLICIES,
+                        help='同一用户有多台打印客户端时的调度策略: least_loaded（未完成任务最少）、'
+                             'affinity（优先拥有指定打印机的客户端）、round_robin（轮流分配）')
+    parser.add_argument('--codecs', type=str, nargs='+', default=None, choices=available_codecs(),
+                        help='允许客户端协商的编码（默认全部可用的编码，msgpack 需要安装 msgpack）')
+    parser.add_argument('--compression', type=str, nargs='+', default=None, choices=available_compression(),
+                        help='允许客户端协商的压缩方式（默认全部可用的方式，zstd 需要安装 zstandard）')
+    parser.add_argument('--compress-threshold', type=int, default=DEFAULT_COMPRESS_THRESHOLD,
+                        help='超过该字节数的消息才压缩')
+    parser.add_argument('--ping-interval', type=float, default=20.0,
+                        help='心跳间隔（秒）：连接空闲超过该时间后发送 ping，0 表示不发送心跳')
+    parser.add_argument('--ping-timeout', type=float, default=20.0,
+                        help='心跳超时（秒）：超时无响应的打印客户端被移除，任务交给其他客户端或重新排队')
+    parser.add_argument('--drain-timeout', type=float, default=10.0,
+                        help='收到 SIGTERM 后等待进行中任务转发完成的最长时间（秒）')
+    parser.add_argument('--reconnect-jitter', type=float, default=5.0,
+                        help='排空时通知客户端重连的随机延迟上限（秒），避免重启后所有客户端同时重连')
+    parser.add_argument('--no-requeue', action='store_true',
+                        help='启动时不重新投递未确认的任务（平滑重启时由旧进程自动添加，旧进程排空时仍在处理这些任务）')
+    parser.add_argument('--listen-fd', type=int, default=None,
+                        help='使用继承的监听 socket 文件描述符（平滑重启时自动设置；systemd socket 激活时自动检测）')
+    parser.add_argument('--user-rate', type=float, default=20.0,
+                        help='每个用户每秒允许的打印请求和状态查询数（0 表示不限制）')
+    parser.add_argument('--user-burst', type=int, default=50, help='每个用户允许的突发请求数')
+    parser.add_argument('--conn-rate', type=float, default=20.0, help='每个前端连接每秒允许的消息数（0 表示不限制）')
+    parser.add_argument('--conn-burst', type=int, default=50, help='每个前端连接允许的突发消息数')
+    parser.add_argument('--max-inflight', type=int, default=1000,
+                        help='进行中任务数上限（每个工作进程），超过时回复 busy（0 表示不限制）')
+
+    parser.add_argument('--auth-backend', type=str, default='api', choices=['api', 'stub'],
+                        help='凭证验证方式: api（调用编辑器后端登录接口）或 stub（接受所有凭证，仅用于测试）')
+    parser.add_argument('--auth-url', type=str, default=DEFAULT_AUTH_URL, help='编辑器后端登录接口地址')
+    parser.add_argument('--auth-cache-ttl', type=float, default=300, help='验证成功的缓存时间（秒）')
+    parser.add_argument('--auth-negative-ttl', type=float, default=10, help='验证失败的缓存时间（秒）')
+    parser.add_argument('--token-secret', type=str, default=None,
+                        help=f'会话令牌签名密钥（也可通过环境变量 {TOKEN_SECRET_ENV} 设置；未设置时每次启动随机生成）')
+    parser.add_argument('--token-ttl', type=int, default=DEFAULT_TOKEN_TTL, help='会话令牌有效期（秒）')
+    parser.add_argument('--log-level', type=str, default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='日志级别（DEBUG 会输出每条消息的预览）')
 
     args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    if args.workers > 1:
+        try:
+            run_workers(args)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    listen_fd = args.listen_fd
+    if listen_fd is None and os.environ.get('LISTEN_PID') == str(os.getpid()) and os.environ.get('LISTEN_FDS'):
+        # systemd socket 激活：第一个传入的 socket 为 fd 3
+        listen_fd = 3
+
+    if not args.token_secret and not os.environ.get(TOKEN_SECRET_ENV):
+        # 平滑重启时新进程继承环境变量，与旧进程使用相同的令牌密钥，已签发的令牌继续有效
+        os.environ[TOKEN_SECRET_ENV] = os.urandom(32).hex()
+
+    worker_id = args.worker_id
+    if worker_id is None and args.broker != 'local':
+        # 单进程使用 Redis 等外部路由时也需要唯一标识
+        worker_id = f"{socket.gethostname()}:{args.port}:0"
 
     # 默认禁用自动寻找端口，除非明确指定了 --auto-port
-    server = PrintServer(host=args.host, port=args.port, auto_find_port=args.auto_port)
+    server = PrintServer(host=args.host, port=args.port, auto_find_port=args.auto_port,
+                         data_dir=args.data_dir, job_ttl=args.job_ttl, drain_batch=args.drain_batch,
+                         worker_id=worker_id,
+                         broker=create_broker(args.broker, worker_id or '0'),
+                         reuse_port=args.reuse_port,
+                         requeue_on_start=args.worker_id is None and not args.no_requeue,
+                         send_timeout=args.send_timeout,
+                         outbound_queue_size=args.outbound_queue_size,
+                         overflow_policy=args.overflow_policy,
+                         metrics_host=args.metrics_host, metrics_port=args.metrics_port,
+                         verifier=create_verifier(args.auth_backend, args.auth_url,
+                                                  ttl=args.auth_cache_ttl, negative_ttl=args.auth_negative_ttl),
+                         token_signer=TokenSigner(args.token_secret or os.environ.get(TOKEN_SECRET_ENV),
+                                                  ttl=args.token_ttl),
+                         schedule=args.schedule, codecs=args.codecs, compression=args.compression,
+                         compress_threshold=args.compress_threshold,
+                         ping_interval=args.ping_interval, ping_timeout=args.ping_timeout,
+                         listen_fd=listen_fd, drain_timeout=args.drain_timeout,
+                         reconnect_jitter=args.reconnect_jitter,
+                         user_rate=args.user_rate, user_burst=args.user_burst,
+                         conn_rate=args.conn_rate, conn_burst=args.conn_burst,
+                         max_inflight=args.max_inflight)
     server.local_client_url = f"ws://localhost:{args.local_port}"
+    # 多进程模式的工作进程由主进程负责平滑重启
+    server.allow_handoff = args.worker_id is None
 
     try:
         loop = asyncio.get_event_loop()
@@ -382,7 +1700,7 @@ def main():
     except (KeyboardInterrupt, EOFError):
         pass
     except Exception as e:
-        print(f"服务器运行出错: {str(e)}")
+        logger.error("服务器运行出错: %s", e)
 
 
 if __name__ == "__main__":
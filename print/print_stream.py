@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大文档分块传输
+- 发送方: print_begin（任务信息）→ print_chunk × N（seq 从 0 递增）→ print_end（chunks 为总块数）
+- 打印客户端收到 print_begin 后回复 print_credit 给出初始窗口，每写入一块再归还一个额度，
+  发送方只能在有额度时发送下一块，服务器和客户端的内存占用与文档大小无关
+- 服务器只转发不缓存，记录每个传输的目标客户端、下一个序号和剩余额度
+- 打印客户端把分块依次写入本地缓冲文件，传输完成后打印该文件
+"""
+
+import base64
+import os
+import tempfile
+import time
+
+from print_protocol import ProtocolError
+
+
+STREAM_TYPES = ('print_begin', 'print_chunk', 'print_end', 'print_abort')
+STREAM_CAPABILITY = 'stream'
+DEFAULT_WINDOW = 8  # 打印客户端给出的初始额度（块数）
+DEFAULT_CHUNK_SIZE = 256 * 1024  # 建议的分块大小（字符），远小于 websockets 默认的 1MB 消息上限
+ENCODINGS = ('utf-8', 'base64')  # print_chunk 中 data 字段的编码：文本或 base64 二进制
+
+
+class StreamError(ProtocolError):
+    """分块顺序、额度或大小不符合约定，code 用于回复给发送方"""
+
+
+class StreamState:
+    """服务器上一个分块传输的转发状态"""
+
+    __slots__ = ('username', 'job_id', 'origin', 'client_id', 'worker', 'next_seq', 'credits', 'size', 'updated')
+
+    def __init__(self, username, job_id, origin=None, client_id=None, worker=None):
+        self.username = username
+        self.job_id = job_id
+        self.origin = origin  # 发送方连接（只在接收发送方连接的进程上记录）
+        self.client_id = client_id  # 本进程内的目标打印客户端
+        self.worker = worker  # 目标打印客户端所在的其他工作进程
+        self.next_seq = 0
+        self.credits = 0
+        self.size = 0
+        self.updated = time.monotonic()
+
+    def accept(self, seq, length):
+        """校验并记录发送方的一个分块"""
+        if seq != self.next_seq:
+            raise StreamError('stream_out_of_order', f"分块序号错误: 期望 {self.next_seq}，收到 {seq}")
+        if self.credits <= 0:
+            raise StreamError('flow_control', "打印客户端尚未给出发送额度")
+        self.credits -= 1
+        self.next_seq += 1
+        self.size += length
+        self.updated = time.monotonic()
+
+
+class StreamTable:
+    """(username, job_id) -> StreamState"""
+
+    def __init__(self):
+        self._streams = {}
+
+    def open(self, state):
+        key = (state.username, state.job_id)
+        if key in self._streams:
+            raise StreamError('stream_exists', f"任务 {state.job_id} 正在传输中")
+        self._streams[key] = state
+        return state
+
+    def get(self, username, job_id):
+        return self._streams.get((username, job_id))
+
+    def close(self, username, job_id):
+        return self._streams.pop((username, job_id), None)
+
+    def for_client(self, client_id):
+        """目标为指定打印客户端的传输"""
+        return [state for state in self._streams.values() if state.client_id == client_id]
+
+    def __len__(self):
+        return len(self._streams)
+
+
+class SpoolWriter:
+    """打印客户端的缓冲文件：按序号追加写入分块，内存中只保留当前分块"""
+
+    def __init__(self, job_id, suffix='.txt', encoding='utf-8', size=None, directory=None):
+        if encoding not in ENCODINGS:
+            raise StreamError('invalid_message', f"不支持的分块编码: {encoding}")
+        self.job_id = job_id
+        self.encoding = encoding
+        self.expected_size = size  # 发送方声明的总大小（字符或字节），可选
+        self.next_seq = 0
+        self.written = 0
+        fd, self.path = tempfile.mkstemp(prefix='print_stream_', suffix=suffix, dir=directory)
+        self._file = os.fdopen(fd, 'wb')
+        self.updated = time.monotonic()
+
+    def write(self, seq, data):
+        """写入一个分块，返回写入的字节数"""
+        if seq != self.next_seq:
+            raise StreamError('stream_out_of_order', f"分块序号错误: 期望 {self.next_seq}，收到 {seq}")
+        raw = base64.b64decode(data) if self.encoding == 'base64' else data.encode('utf-8')
+        self._file.write(raw)
+        self.next_seq += 1
+        self.written += len(raw)
+        self.updated = time.monotonic()
+        return len(raw)
+
+    def finish(self, chunks, size=None):
+        """传输结束，校验块数后关闭文件并返回路径"""
+        self._file.close()
+        if chunks != self.next_seq:
+            self.discard()
+            raise StreamError('stream_incomplete', f"分块数量不符: 声明 {chunks}，收到 {self.next_seq}")
+        if size is not None and self.encoding == 'base64' and size != self.written:
+            self.discard()
+            raise StreamError('stream_incomplete', f"文件大小不符: 声明 {size}，收到 {self.written}")
+        return self.path
+
+    def discard(self):
+        """中止传输，删除缓冲文件"""
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+凭证验证测试：StubVerifier 作为后端，不访问网络
+- TokenSigner: 签发的令牌可验证，篡改、换密钥、过期、格式错误时返回 None
+- CachedVerifier: 成功和失败结果分别缓存，同一凭证的并发验证只请求一次后端，后端出错不缓存
+- 用法: python -m pytest print/tests
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_auth import CachedVerifier, StubVerifier, TokenSigner
+
+
+def test_token_round_trip():
+    signer = TokenSigner('secret', ttl=60)
+    token, ttl = signer.issue('张三')
+    assert ttl == 60
+    assert signer.verify(token) == '张三'
+    # 字符串和字节密钥等价，多个工作进程使用同一个密钥即可互相验证
+    assert TokenSigner(b'secret').verify(token) == '张三'
+
+
+@pytest.mark.parametrize('mutate', [
+    lambda token: token.replace('.A', '.B') if '.A' in token else token.replace('.', '.A', 1)[:-1],  # 签名被改动
+    lambda token: 'x' + token,  # 用户名和过期时间被改动
+    lambda token: token.replace('.', ''),
+    lambda token: token + '.extra',
+    lambda token: None,
+])
+def test_tampered_or_malformed_tokens_are_rejected(mutate):
+    signer = TokenSigner('secret')
+    token, _ = signer.issue('alice')
+    assert signer.verify(mutate(token)) is None
+
+
+def test_token_from_other_secret_or_expired_is_rejected():
+    token, _ = TokenSigner('secret').issue('alice')
+    assert TokenSigner('other').verify(token) is None
+    # 未配置密钥时每个实例使用不同的随机密钥
+    assert TokenSigner().verify(TokenSigner().issue('alice')[0]) is None
+    expired = TokenSigner('secret', ttl=-1)
+    assert expired.verify(expired.issue('alice')[0]) is None
+
+
+def test_cached_verifier_caches_positive_and_negative_results():
+    async def scenario():
+        backend = StubVerifier({'alice': 'pw'})
+        verifier = CachedVerifier(backend)
+        assert await verifier.verify('alice', 'pw')
+        assert await verifier.verify('alice', 'pw')
+        assert not await verifier.verify('alice', 'wrong')
+        assert not await verifier.verify('alice', 'wrong')
+        assert not await verifier.verify('alice', '')
+        assert backend.calls == 2
+        assert (verifier.hits, verifier.misses) == (2, 2)
+
+        # 修改密码后清除缓存，旧密码重新请求后端
+        backend.users['alice'] = 'new'
+        verifier.invalidate('alice')
+        assert not await verifier.verify('alice', 'pw')
+        assert await verifier.verify('alice', 'new')
+        assert backend.calls == 4
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_verifications_share_one_backend_call():
+    class SlowVerifier(StubVerifier):
+        async def verify(self, username, password):
+            await asyncio.sleep(0.01)
+            return await super().verify(username, password)
+
+    async def scenario():
+        backend = SlowVerifier({'alice': 'pw'})
+        verifier = CachedVerifier(backend)
+        results = await asyncio.gather(*(verifier.verify('alice', 'pw') for _ in range(10)))
+        assert results == [True] * 10
+        assert backend.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_backend_errors_are_not_cached():
+    class FlakyVerifier(StubVerifier):
+        async def verify(self, username, password):
+            if self.calls == 0:
+                self.calls += 1
+                raise RuntimeError('后端不可用')
+            return await super().verify(username, password)
+
+    async def scenario():
+        backend = FlakyVerifier({'alice': 'pw'})
+        verifier = CachedVerifier(backend)
+        with pytest.raises(RuntimeError):
+            await verifier.verify('alice', 'pw')
+        assert await verifier.verify('alice', 'pw')
+        assert backend.calls == 2
+
+    asyncio.run(scenario())
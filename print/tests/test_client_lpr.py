@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印客户端边下载边提交到 lpr 的测试
+- 下载中断或出错时先终止 lpr 再关闭标准输入，lpr 不会收到 EOF 而提交不完整的任务
+- 下载完成后才关闭标准输入并等待 lpr 退出
+- 用法: python -m unittest discover -s print/tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_client import PrintClient
+from print_downloader import DownloadError, DownloadInterrupted
+
+URL = 'http://example.invalid/report.pdf'
+
+
+class FakeStdin:
+    """记录写入内容和关闭时机的标准输入"""
+
+    def __init__(self, events):
+        self.events = events
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        self.events.append('close')
+
+
+class FakeLpr:
+    """代替 subprocess.Popen 返回的 lpr 进程，按顺序记录 kill、wait 和关闭标准输入"""
+
+    def __init__(self, returncode=0):
+        self.events = []
+        self.stdin = FakeStdin(self.events)
+        self.returncode = returncode
+
+    def kill(self):
+        self.events.append('kill')
+
+    def wait(self):
+        self.events.append('wait')
+        return self.returncode
+
+
+class FakeDownloader:
+    """写入一部分内容后按指定的异常结束"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def stream(self, url, sink, report_status):
+        sink.write(b'%PDF-1.4 partial')
+        if self.error is not None:
+            raise self.error
+        return 16
+
+
+class StreamToLprTest(unittest.TestCase):
+    def setUp(self):
+        home = tempfile.TemporaryDirectory()
+        self.addCleanup(home.cleanup)
+        patcher = mock.patch.dict(os.environ, {'HOME': home.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = PrintClient(log_callback=lambda message: None, cache_size=0)
+        self.client.printer_name = 'P1'
+        self.messages = []
+
+    def submit(self, downloader, process):
+        self.client.downloader = downloader
+        with mock.patch('print_client.subprocess.Popen', return_value=process) as popen:
+            try:
+                return self.client._stream_url_to_lpr(URL, {}, self.messages.append)
+            finally:
+                popen.assert_called_once()
+
+    def test_interrupted_download_kills_lpr_before_closing_stdin(self):
+        process = FakeLpr()
+        self.assertFalse(self.submit(FakeDownloader(DownloadInterrupted("连接提前关闭")), process))
+        self.assertEqual(process.events, ['kill', 'wait', 'close'])
+        self.assertTrue(any('改用临时文件下载' in message for message in self.messages))
+
+    def test_write_error_kills_lpr_before_closing_stdin(self):
+        process = FakeLpr()
+        self.assertFalse(self.submit(FakeDownloader(BrokenPipeError()), process))
+        self.assertEqual(process.events, ['kill', 'wait', 'close'])
+
+    def test_download_error_kills_lpr_and_raises(self):
+        process = FakeLpr()
+        with self.assertRaises(DownloadError):
+            self.submit(FakeDownloader(DownloadError("HTTP 404: Not Found")), process)
+        self.assertEqual(process.events, ['kill', 'wait', 'close'])
+
+    def test_complete_download_closes_stdin_then_waits(self):
+        process = FakeLpr()
+        self.assertTrue(self.submit(FakeDownloader(), process))
+        self.assertEqual(process.events, ['close', 'wait'])
+        self.assertEqual(process.stdin.data, b'%PDF-1.4 partial')
+
+    def test_lpr_failure_falls_back(self):
+        process = FakeLpr(returncode=1)
+        self.assertFalse(self.submit(FakeDownloader(), process))
+        self.assertEqual(process.events, ['close', 'wait'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息编码测试：编码后再由 decode_frame 解码，得到原来的消息
+- 默认 JSON 文本帧原样传输；deflate 只压缩超过阈值且能变小的帧
+- 解压超过上限或格式错误的二进制帧报 invalid_message
+- 按客户端偏好和服务器允许的列表协商编码；msgpack/zstd 未安装时跳过相应用例
+- 用法: python -m pytest print/tests
+"""
+
+import json
+import os
+import sys
+import zlib
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_codec import (CODEC_JSON, CODEC_MSGPACK, COMPRESSION_DEFLATE, COMPRESSION_NONE, COMPRESSION_ZSTD,
+                         WireFormat, available_codecs, available_compression, decode_frame, negotiate_wire)
+from print_protocol import ProtocolError
+
+MESSAGE = {'type': 'print_request', 'job_id': 'j1', 'content': '# 标题\n\n' + '正文内容。' * 500}
+
+
+def test_plain_json_is_a_text_frame():
+    wire = WireFormat()
+    assert wire.plain
+    frame = wire.encode(MESSAGE)
+    assert isinstance(frame, str)
+    assert json.loads(decode_frame(frame)) == MESSAGE
+
+
+def test_deflate_round_trip_and_threshold():
+    wire = WireFormat(compression=COMPRESSION_DEFLATE, threshold=256)
+    frame = wire.encode(MESSAGE)
+    assert isinstance(frame, bytes) and frame[0] == 0x01
+    assert len(frame) < len(json.dumps(MESSAGE, ensure_ascii=False).encode('utf-8'))
+    assert json.loads(decode_frame(frame)) == MESSAGE
+    # 小于阈值的消息保持文本帧
+    assert isinstance(wire.encode({'type': 'ping'}), str)
+
+
+def test_decode_rejects_bombs_and_garbage():
+    bomb = bytes((0x01,)) + zlib.compress(b' ' * (1024 * 1024))
+    with pytest.raises(ProtocolError) as info:
+        decode_frame(bomb, limit=1024)
+    assert info.value.code == 'invalid_message'
+    for frame in (b'', bytes((0x01,)) + b'not deflate', bytes((0x0F,)) + b'{}', bytes((0xF0,)) + b'{}'):
+        with pytest.raises(ProtocolError):
+            decode_frame(frame)
+
+
+def test_negotiate_wire_picks_first_supported_preference():
+    assert negotiate_wire({}) is None
+    wire = negotiate_wire({'codecs': ['cbor', CODEC_JSON], 'compression': ['brotli', COMPRESSION_DEFLATE]})
+    assert (wire.codec, wire.compression) == (CODEC_JSON, COMPRESSION_DEFLATE)
+    # 服务器只允许不压缩时忽略客户端的压缩偏好
+    wire = negotiate_wire({'compression': [COMPRESSION_DEFLATE]}, compression=[COMPRESSION_NONE])
+    assert wire.plain
+    with pytest.raises(ValueError):
+        WireFormat(codec='cbor')
+
+
+@pytest.mark.skipif(CODEC_MSGPACK not in available_codecs(), reason='未安装 msgpack')
+def test_msgpack_round_trip():
+    wire = WireFormat(codec=CODEC_MSGPACK, compression=COMPRESSION_DEFLATE, threshold=256)
+    frame = wire.encode(MESSAGE)
+    assert frame[0] >> 4 == 1
+    assert decode_frame(frame) == MESSAGE
+
+
+@pytest.mark.skipif(COMPRESSION_ZSTD not in available_compression(), reason='未安装 zstandard')
+def test_zstd_round_trip():
+    wire = WireFormat(compression=COMPRESSION_ZSTD, threshold=256)
+    frame = wire.encode(MESSAGE)
+    assert frame[0] == 0x02
+    assert json.loads(decode_frame(frame)) == MESSAGE
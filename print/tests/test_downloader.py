@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件下载测试：本地 http.server 按用例返回中断、错误和条件响应
+- 断点续传（Range/If-Range）、文件变化后从头下载、已下载完整时的 416
+- 503 + Retry-After、读取超时后重试、不可重试的 404、条件请求的 304
+- 用法: python -m unittest discover -s print/tests
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import print_downloader
+from print_downloader import Downloader, DownloadError
+
+DATA = bytes(range(256)) * 1024  # 256KB
+ETAG = '"v1"'
+CHUNK_SIZE = 64 * 1024
+
+
+class Handler(BaseHTTPRequestHandler):
+    """把请求交给当前用例的 respond(handler, 第几次请求)"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(dict(self.headers))
+            count = len(server.requests)
+        server.respond(self, count)
+
+    def send_body(self, body, status=200, headers=None, length=None, close_after=None):
+        """发送响应；close_after 为只发送的字节数，之后直接断开连接"""
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body) if length is None else length))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body if close_after is None else body[:close_after])
+        self.wfile.flush()
+
+    def send_range(self, start, total=DATA):
+        """按 Range 请求返回 206"""
+        body = total[start:]
+        self.send_body(body, 206, {
+            'Content-Range': f'bytes {start}-{len(total) - 1}/{len(total)}',
+            'ETag': ETAG
+        })
+
+    def requested_offset(self):
+        value = self.headers.get('Range', '')
+        return int(value[len('bytes='):-1]) if value.startswith('bytes=') else 0
+
+
+class DownloaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/report.pdf'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests = []
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'report.pdf')
+        self.downloader = Downloader(timeout=0.5, retries=3, chunk_size=CHUNK_SIZE, progress_interval=60)
+        # 重试前不实际等待，只记录等待时间
+        patcher = mock.patch.object(print_downloader.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.messages = []
+
+    def fetch(self, **kwargs):
+        return self.downloader.fetch(self.url, self.path, self.messages.append, **kwargs)
+
+    def read_file(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_resumes_with_range_after_connection_drop(self):
+        def respond(handler, count):
+            if count == 1:
+                handler.send_body(DATA, headers={'ETag': ETAG}, close_after=100000)
+            else:
+                handler.send_range(handler.requested_offset())
+        self.server.respond = respond
+
+        info = self.fetch()
+        self.assertEqual(info['size'], len(DATA))
+        self.assertEqual(self.read_file(), DATA)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]['Range'], 'bytes=100000-')
+        self.assertEqual(self.server.requests[1]['If-Range'], ETAG)
+
+    def test_if_range_mismatch_restarts_from_zero(self):
+        changed = DATA[::-1]
+
+        def respond(handler, count):
+            if count == 1:
+                handler.send_body(DATA, headers={'ETag': ETAG}, close_after=100000)
+            else:
+                # If-Range 不匹配：服务器返回 200 和完整的新文件
+                handler.send_body(changed, headers={'ETag': '"v2"'})
+        self.server.respond = respond
+
+        info = self.fetch()
+        self.assertEqual(info['size'], len(changed))
+        self.assertEqual(info['etag'], '"v2"')
+        self.assertEqual(self.read_file(), changed)
+        self.assertTrue(any('从头下载' in message for message in self.messages))
+
+    def test_416_when_already_complete(self):
+        def respond(handler, count):
+            if count == 1:
+                # 声明的长度多一个字节：内容已经完整，但客户端认为连接提前关闭
+                handler.send_body(DATA, headers={'ETag': ETAG}, length=len(DATA) + 1)
+            else:
+                handler.send_response(416)
+                handler.send_header('Content-Range', f'bytes */{len(DATA)}')
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+        self.server.respond = respond
+
+        info = self.fetch()
+        self.assertEqual(info['size'], len(DATA))
+        self.assertEqual(self.read_file(), DATA)
+        self.assertEqual(self.server.requests[1]['Range'], f'bytes={len(DATA)}-')
+
+    def test_503_uses_retry_after(self):
+        def respond(handler, count):
+            if count == 1:
+                handler.send_body(b'busy', 503, {'Retry-After': '7'})
+            else:
+                handler.send_body(DATA)
+        self.server.respond = respond
+
+        info = self.fetch()
+        self.assertEqual(info['size'], len(DATA))
+        self.sleep.assert_called_once_with(7.0)
+
+    def test_read_timeout_then_retry(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def respond(handler, count):
+            if count == 1:
+                handler.send_response(200)
+                handler.send_header('Content-Length', str(len(DATA)))
+                handler.send_header('ETag', ETAG)
+                handler.end_headers()
+                handler.wfile.write(DATA[:CHUNK_SIZE + 1000])
+                handler.wfile.flush()
+                # 之后不再发送内容，客户端读取第二块时超时（第二块已收到的部分不写入文件）
+                release.wait(5)
+            else:
+                handler.send_range(handler.requested_offset())
+        self.server.respond = respond
+
+        info = self.fetch()
+        self.assertEqual(info['size'], len(DATA))
+        self.assertEqual(self.read_file(), DATA)
+        self.assertEqual(self.server.requests[1]['Range'], f'bytes={CHUNK_SIZE}-')
+
+    def test_404_is_not_retried(self):
+        def respond(handler, count):
+            handler.send_body(b'missing', 404)
+        self.server.respond = respond
+
+        with self.assertRaises(DownloadError) as context:
+            self.fetch()
+        self.assertIn('404', str(context.exception))
+        self.assertEqual(len(self.server.requests), 1)
+        self.sleep.assert_not_called()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_304_on_conditional_request(self):
+        def respond(handler, count):
+            if handler.headers.get('If-None-Match') == ETAG:
+                handler.send_response(304)
+                handler.send_header('ETag', ETAG)
+                handler.send_header('Cache-Control', 'max-age=60')
+                handler.end_headers()
+            else:
+                handler.send_body(DATA, headers={'ETag': ETAG})
+        self.server.respond = respond
+
+        info = self.fetch(etag=ETAG, last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertTrue(info['not_modified'])
+        self.assertIsNone(info['size'])
+        self.assertEqual(info['etag'], ETAG)
+        self.assertEqual(info['cache_control'], 'max-age=60')
+        self.assertEqual(self.server.requests[0]['If-Modified-Since'], 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+
+if __name__ == '__main__':
+    unittest.main()
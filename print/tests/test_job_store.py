@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线任务队列测试：临时目录中的 SQLite 数据库
+- 待投递的任务按提交顺序认领，认领后标记为已投递，确认后删除
+- 断线时未确认的任务重新变为待投递，过期的任务不再投递并被清理
+- 多个进程各自打开同一个数据库认领任务时，同一个任务只会被认领一次
+- 用法: python -m pytest print/tests
+"""
+
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_job_store import JobStore
+
+
+def states(store):
+    """直接查询数据库中每个任务的状态和所属客户端"""
+    return {job_id: (state, client_id) for job_id, state, client_id in
+            store._connection().execute('SELECT job_id, state, client_id FROM jobs ORDER BY id')}
+
+
+def test_claim_ack_and_delete(tmp_path):
+    async def scenario():
+        store = JobStore(str(tmp_path))
+        for job_id in ('j1', 'j2', 'j3'):
+            await store.enqueue('alice', job_id, f'{{"job_id": "{job_id}"}}')
+        await store.enqueue('bob', 'j4', '{}')
+
+        batch = await store.claim_batch('alice', 'c1', 2)
+        assert [(job_id, payload) for _, job_id, payload in batch] == [('j1', '{"job_id": "j1"}'),
+                                                                         ('j2', '{"job_id": "j2"}')]
+        assert states(store)['j1'] == ('inflight', 'c1')
+        assert states(store)['j3'] == ('pending', None)
+        # 已认领的任务不会再被认领
+        assert [job_id for _, job_id, _ in await store.claim_batch('alice', 'c2', 10)] == ['j3']
+        assert await store.claim_batch('alice', 'c2', 10) == []
+
+        assert await store.ack('alice', 'j1') == 1
+        assert await store.ack('alice', 'j1') == 0
+        await store.delete([batch[1][0]])
+        assert await store.count_pending('alice') == 1
+        assert await store.count_pending() == 2
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_release_returns_unacked_jobs_to_pending(tmp_path):
+    async def scenario():
+        store = JobStore(str(tmp_path))
+        await store.enqueue('alice', 'live', '{}', client_id='c1')  # 直接发送给在线客户端的任务
+        await store.enqueue('alice', 'queued', '{}')
+        await store.claim_batch('alice', 'c2', 10)
+        # 只释放断开的客户端的任务
+        assert await store.release('c1') == 1
+        assert states(store) == {'live': ('pending', None), 'queued': ('inflight', 'c2')}
+        # 服务器重启时全部释放
+        assert await store.release() == 1
+        assert [job_id for _, job_id, _ in await store.claim_batch('alice', 'c3', 10)] == ['live', 'queued']
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_expired_jobs_are_skipped_and_purged(tmp_path):
+    async def scenario():
+        store = JobStore(str(tmp_path), ttl=0)
+        await store.enqueue('alice', 'old', '{}')
+        assert await store.claim_batch('alice', 'c1', 10) == []
+        assert await store.count_pending('alice') == 0
+        assert await store.purge_expired() == 1
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_reopening_keeps_jobs(tmp_path):
+    async def scenario():
+        store = JobStore(str(tmp_path))
+        await store.enqueue('alice', 'j1', '{}')
+        await store.close()
+        store = JobStore(str(tmp_path))
+        assert await store.count_pending('alice') == 1
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_claims_never_share_a_job(tmp_path):
+    async def seed():
+        store = JobStore(str(tmp_path))
+        for i in range(200):
+            await store.enqueue('alice', f'job-{i}', '{}')
+        await store.close()
+
+    asyncio.run(seed())
+
+    # 每个线程一个独立的连接，相当于多进程模式下的各个工作进程
+    claimed = {}
+    start = threading.Barrier(4)
+
+    async def drain(name):
+        store = JobStore(str(tmp_path))
+        rows = []
+        while True:
+            batch = await store.claim_batch('alice', name, 7)
+            if not batch:
+                break
+            rows.extend(job_id for _, job_id, _ in batch)
+        await store.close()
+        return rows
+
+    def worker(name):
+        start.wait()
+        claimed[name] = asyncio.run(drain(name))
+
+    threads = [threading.Thread(target=worker, args=(f'worker-{i}',)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == [f'worker-{i}' for i in range(4)]
+    all_jobs = [job_id for rows in claimed.values() for job_id in rows]
+    assert len(all_jobs) == 200
+    assert len(set(all_jobs)) == 200
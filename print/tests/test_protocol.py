@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息协议测试：字段校验、版本协商、信封帧的拆分与合并
+- 信封帧的消息体不能覆盖头部的路由字段（服务器拒绝，客户端合并时也拒绝）
+- 用法: python -m pytest print/tests
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_protocol import (ProtocolError, check_envelope_body, decode_message, envelope_to_json,
+                            make_envelope, negotiate_version, split_envelope, validate_frame,
+                            PROTOCOL_VERSION)
+
+HEADER = {'type': 'print_request', 'job_id': 'A', 'username': 'alice'}
+
+
+def test_validate_frame_checks_required_fields():
+    assert validate_frame({'type': 'client_auth', 'username': 'u', 'password': 'p', 'client_id': 'c1'}) == 'client_auth'
+    with pytest.raises(ProtocolError):
+        validate_frame({'type': 'client_auth', 'username': 'u', 'password': 'p'})
+    with pytest.raises(ProtocolError):
+        validate_frame({'type': 'no_such_type'})
+
+
+def test_negotiate_version_picks_highest_common():
+    assert negotiate_version({'protocol_version': PROTOCOL_VERSION + 10}) == PROTOCOL_VERSION
+    assert negotiate_version({'protocol_version': 3}) == 3
+    with pytest.raises(ProtocolError):
+        negotiate_version({'versions': [PROTOCOL_VERSION + 1]})
+
+
+def test_envelope_round_trip():
+    frame = make_envelope(HEADER, json.dumps({'content': '第一行\n第二行'}, ensure_ascii=False))
+    header, body = split_envelope(frame)
+    assert header == dict(HEADER, envelope=1)
+    check_envelope_body(body)
+    assert decode_message(frame) == dict(HEADER, content='第一行\n第二行')
+    assert json.loads(envelope_to_json(header, body)) == dict(HEADER, content='第一行\n第二行')
+
+
+def test_plain_json_is_not_an_envelope():
+    assert split_envelope(json.dumps(HEADER)) is None
+    assert split_envelope(json.dumps(HEADER, indent=2)) is None
+
+
+@pytest.mark.parametrize('key', ['type', 'job_id', 'username', 'envelope', 'printer'])
+def test_server_rejects_body_with_routing_key(key):
+    body = json.dumps({'content': 'hi', key: 'B'})
+    with pytest.raises(ProtocolError) as info:
+        check_envelope_body(body)
+    assert info.value.code == 'invalid_message'
+
+
+def test_escaped_key_names_inside_content_are_allowed():
+    check_envelope_body(json.dumps({'content': '{"job_id": "B", "type": "x"}'}))
+
+
+def test_client_merge_rejects_body_with_routing_key():
+    frame = make_envelope(HEADER, json.dumps({'content': 'hi', 'job_id': 'B'}))
+    with pytest.raises(ProtocolError):
+        decode_message(frame)
+    # \u 转义的键名服务器查找不到，客户端解析后同样拒绝
+    frame = make_envelope(HEADER, '{"content": "hi", "\\u006aob_id": "B"}')
+    with pytest.raises(ProtocolError):
+        decode_message(frame)
+
+
+def test_header_wins_when_joined_for_legacy_clients():
+    # 旧客户端收到拼接后的普通 JSON，字段重复时以头部为准
+    joined = envelope_to_json(dict(HEADER, envelope=1), '{"content": "hi", "job_id": "B"}')
+    assert json.loads(joined)['job_id'] == 'A'
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+限流测试：令牌桶按传入的时间计算补充的令牌，不实际等待
+- 先消耗 burst 个令牌，之后按 rate 匀速补充，拒绝时返回需要等待的秒数
+- RateLimiter 按键分别限流，超过 max_keys 时移除最久未使用的令牌桶；rate 为 0 时不限制
+- 用法: python -m pytest print/tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_ratelimit import RateLimiter, TokenBucket
+
+
+def test_bucket_allows_burst_then_refills_at_rate():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated
+    assert [bucket.take(now) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(now) == pytest.approx(0.5)
+    # 0.25 秒补充半个令牌，仍需等待 0.25 秒
+    assert bucket.take(now + 0.25) == pytest.approx(0.25)
+    assert bucket.take(now + 0.5) == 0
+    # 空闲再久也最多积累 burst 个令牌
+    later = now + 100
+    assert [bucket.take(later) == 0 for _ in range(4)] == [True, True, True, False]
+
+
+def test_limiter_keeps_separate_buckets_per_key():
+    limiter = RateLimiter(rate=1, burst=2)
+    assert [limiter.check('alice') for _ in range(2)] == [0, 0]
+    assert limiter.check('alice') > 0
+    assert limiter.check('bob') == 0
+    assert len(limiter) == 2
+
+
+def test_limiter_evicts_least_recently_used_key():
+    limiter = RateLimiter(rate=1, burst=1, max_keys=2)
+    limiter.check('a')
+    limiter.check('b')
+    limiter.check('a')  # a 最近使用过，b 先被移除
+    limiter.check('c')
+    assert list(limiter._buckets) == ['a', 'c']
+    # 被移除的键重新创建时是满的
+    assert limiter.check('b') == 0
+
+
+def test_zero_rate_disables_limiting():
+    limiter = RateLimiter(rate=0, burst=1)
+    assert not limiter.enabled
+    assert limiter.bucket() is None
+    assert all(limiter.check('alice') == 0 for _ in range(100))
+    assert len(limiter) == 0
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+连接注册表测试：websocket、client_id、用户三者的映射在绑定、重新绑定、断开后保持一致
+- 未完成任务数（job_count）随分配、完成、断开同步增减
+- 前端订阅与任务来源路由在连接断开后清除
+- 用法: python -m pytest print/tests
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_registry import ConnectionRegistry
+
+
+class FakeWebSocket:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f'<ws {self.name}>'
+
+
+def test_bind_and_unbind_keep_maps_consistent():
+    registry = ConnectionRegistry()
+    ws1, ws2 = FakeWebSocket('1'), FakeWebSocket('2')
+    registry.bind('c1', ws1, 'alice', capabilities=['ack'], printers=['P1'])
+    registry.bind('c2', ws2, 'alice')
+
+    assert registry.username_for(ws1) == 'alice'
+    assert registry.client_id_for(ws2) == 'c2'
+    assert sorted(client_id for client_id, _ in registry.clients_for_user('alice')) == ['c1', 'c2']
+    assert registry.client_for_user('alice')[0] == 'c1'
+    assert 'ack' in registry.get_client('c1')['capabilities']
+
+    assert registry.unbind_websocket(ws1) == 'c1'
+    assert not registry.is_client(ws1)
+    assert [client_id for client_id, _ in registry.clients_for_user('alice')] == ['c2']
+    registry.unbind_websocket(ws2)
+    assert registry.user_bindings == {}
+    assert registry.client_for_user('alice') == (None, None)
+
+
+def test_job_count_follows_assign_complete_and_disconnect():
+    registry = ConnectionRegistry()
+    ws = FakeWebSocket('1')
+    registry.bind('c1', ws, 'alice')
+    registry.assign_job('c1', 'j1')
+    registry.assign_job('c1', 'j1')  # 重复分配不重复计数
+    registry.assign_job('c1', 'j2')
+    assert registry.job_count == 2
+    registry.complete_job('c1', 'j1')
+    registry.complete_job('c1', 'unknown')
+    assert registry.job_count == 1
+    registry.unbind_websocket(ws)
+    assert registry.job_count == 0
+
+
+def test_rebind_from_new_connection_drops_old_connection():
+    registry = ConnectionRegistry()
+    old, new = FakeWebSocket('old'), FakeWebSocket('new')
+    registry.bind('c1', old, 'alice')
+    registry.assign_job('c1', 'j1')
+
+    # 同一连接重新认证保留未完成的任务
+    registry.bind('c1', old, 'alice')
+    assert registry.get_client('c1')['jobs'] == {'j1'}
+
+    # 从新连接重新认证并换了用户：旧连接和旧用户的绑定都失效，旧连接上的任务不再计数
+    registry.bind('c1', new, 'bob')
+    assert registry.client_id_for(old) is None
+    assert registry.client_id_for(new) == 'c1'
+    assert registry.job_count == 0
+    assert 'alice' not in registry.user_bindings
+    assert registry.clients_for_user('bob')[0][0] == 'c1'
+    # 旧连接随后断开不影响新的绑定
+    assert registry.unbind_websocket(old) is None
+    assert len(registry) == 1
+
+
+def test_forget_websocket_clears_subscriptions_and_job_origins():
+    registry = ConnectionRegistry()
+    front, other = FakeWebSocket('front'), FakeWebSocket('other')
+    registry.subscribe(front, 'alice')
+    registry.subscribe(other, 'alice')
+    registry.track_job('alice', 'j1', front)
+    registry.track_job('alice', 'j2', front)
+    registry.track_job('alice', 'j2', other)  # 同一任务改由另一个连接发起
+
+    registry.forget_websocket(front)
+    assert registry.subscribers('alice') == {other}
+    assert registry.job_origin('alice', 'j1') is None
+    assert registry.job_origin('alice', 'j2') is other
+
+    registry.finish_job('alice', 'j2')
+    registry.forget_websocket(other)
+    assert registry.job_origin('alice', 'j2') is None
+    assert registry.subscribers('alice') == ()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印任务调度测试：客户端信息来自真实的连接注册表
+- 报告了打印机负载的客户端和旧客户端按同一单位（每个并发槽位的未完成任务数）比较
+- least_loaded、affinity、round_robin 三种策略的候选顺序，任务指定打印机的解析
+- 用法: python -m pytest print/tests
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from print_registry import ConnectionRegistry
+from print_scheduler import (JobScheduler, POLICY_AFFINITY, POLICY_LEAST_LOADED, POLICY_ROUND_ROBIN,
+                             client_load, job_printer)
+
+
+def connect(registry, client_id, jobs=(), load=None):
+    """绑定一台客户端并记录已发送的任务；load 为客户端报告的打印机负载，旧客户端不报告"""
+    websocket = object()
+    registry.bind(client_id, websocket, 'alice', printers=('P1',))
+    for job_id in jobs:
+        registry.assign_job(client_id, job_id)
+    if load:
+        registry.update_load(websocket, load)
+    return registry.clients[client_id]
+
+
+def test_reporting_and_legacy_clients_share_one_unit():
+    registry = ConnectionRegistry()
+    # 4 个任务占满 2 个并发槽位：每个槽位 2 个任务
+    busy = connect(registry, 'busy', load={'P1': {'queued': 2, 'inflight': 2, 'concurrency': 2}})
+    # 旧客户端 1 个未完成任务，按并发数 1 计算
+    legacy = connect(registry, 'legacy', jobs=['j1'])
+    assert client_load(busy) == client_load(busy, 'P1') == 2
+    assert client_load(legacy) == client_load(legacy, 'P1') == 1
+
+    scheduler = JobScheduler()
+    for printer in (None, 'P1'):
+        assert [client_id for client_id, _ in scheduler.order('alice', registry.clients_for_user('alice'), printer)] \
+            == ['legacy', 'busy']
+
+
+def test_jobs_not_yet_queued_count_towards_reporting_client():
+    registry = ConnectionRegistry()
+    # 已发送但客户端还未加入本地队列的 2 个任务，加上 1 个排队任务，分摊到 4 个并发槽位
+    idle = connect(registry, 'idle', jobs=['j1', 'j2'], load={'P1': {'queued': 1, 'inflight': 0, 'concurrency': 4}})
+    legacy = connect(registry, 'legacy', jobs=['j3'])
+    assert client_load(idle) == 0.75
+    assert JobScheduler().order('alice', [('legacy', legacy), ('idle', idle)])[0][0] == 'idle'
+
+
+def test_printer_load_only_counts_the_requested_printer():
+    registry = ConnectionRegistry()
+    info = connect(registry, 'c1', load={
+        'slow': {'queued': 9, 'inflight': 1, 'concurrency': 1},
+        'fast': {'queued': 0, 'inflight': 1, 'concurrency': 2},
+    })
+    assert client_load(info, 'fast') == 0.5
+    assert client_load(info, 'slow') == 10
+    assert client_load(info) == 11 / 3
+
+
+def clients(*specs):
+    """按连接顺序生成候选客户端：每项为 (client_id, 未完成任务数, 打印机列表)"""
+    start = datetime(2024, 1, 1)
+    return [(client_id, {'connected_at': start + timedelta(seconds=i), 'jobs': set(range(jobs)),
+                         'printers': frozenset(printers), 'printer_load': {}})
+            for i, (client_id, jobs, printers) in enumerate(specs)]
+
+
+def ids(candidates):
+    return [client_id for client_id, _ in candidates]
+
+
+def test_least_loaded_breaks_ties_by_connection_time():
+    candidates = clients(('a', 2, ()), ('b', 0, ()), ('c', 0, ()))
+    assert ids(JobScheduler(POLICY_LEAST_LOADED).order('alice', candidates)) == ['b', 'c', 'a']
+
+
+def test_affinity_prefers_clients_with_the_printer():
+    candidates = clients(('a', 0, ('P1',)), ('b', 3, ('P2',)), ('c', 1, ('P2',)))
+    scheduler = JobScheduler(POLICY_AFFINITY)
+    assert ids(scheduler.order('alice', candidates, 'P2')) == ['c', 'b', 'a']
+    # 任务没有指定打印机时按负载选择
+    assert ids(scheduler.order('alice', candidates)) == ['a', 'c', 'b']
+
+
+def test_round_robin_rotates_per_user_and_forgets():
+    candidates = clients(('a', 5, ()), ('b', 0, ()), ('c', 0, ()))
+    scheduler = JobScheduler(POLICY_ROUND_ROBIN)
+    assert [ids(scheduler.order('alice', candidates))[0] for _ in range(4)] == ['a', 'b', 'c', 'a']
+    assert ids(scheduler.order('bob', candidates))[0] == 'a'
+    scheduler.forget('alice')
+    assert ids(scheduler.order('alice', candidates)) == ['a', 'b', 'c']
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        JobScheduler('random')
+
+
+def test_job_printer_reads_request_or_settings():
+    assert job_printer({'printer': 'P1', 'settings': {'printer': 'P2'}}) == 'P1'
+    assert job_printer({'settings': {'printer': 'P2'}}) == 'P2'
+    assert job_printer({'printer': '', 'settings': 'invalid'}) is None